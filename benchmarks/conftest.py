@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the hot paths of nsct, on a synthetic definition (see synthetic.py).
+
+    pytest benchmarks [--devices N] [--domains N] [--interfaces N]
+
+Timings come from pytest-benchmark if it is installed, which adds its own options to save runs and compare
+them (``--benchmark-autosave``, ``--benchmark-compare``).  Without it each benchmark runs once, and is timed
+and reported at the end.  Peak memory, measured with tracemalloc, is reported either way.
+"""
+from __future__ import absolute_import, unicode_literals, print_function
+
+import time
+
+import pytest
+
+try:
+    import pytest_benchmark
+except ImportError:
+    pytest_benchmark = None
+
+_results = []
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('nsct', 'nsct benchmarks')
+    group.addoption('--devices', type=int, default=2000, help='Number of devices of the synthetic definition')
+    group.addoption('--domains', type=int, default=4, help='Number of domains of the synthetic definition')
+    group.addoption('--interfaces', type=int, default=2, help='Interfaces per device of the synthetic definition')
+
+
+class _Benchmark(object):
+    """The part of pytest-benchmark's ``benchmark`` fixture the benchmarks use, running the target once."""
+    def __init__(self, name):
+        self._name = name
+        self.extra_info = {}
+
+    def _run(self, target, args, kwargs):
+        start = time.perf_counter()
+        result = target(*args, **kwargs)
+        _results.append((self._name, time.perf_counter() - start, self.extra_info))
+        return result
+
+    def __call__(self, target, *args, **kwargs):
+        return self._run(target, args, kwargs)
+
+    def pedantic(self, target, args=(), kwargs=None, setup=None, rounds=1, iterations=1):
+        if setup is not None:
+            args, kwargs = setup()
+        return self._run(target, args, kwargs or {})
+
+
+if pytest_benchmark is None:
+    @pytest.fixture
+    def benchmark(request):
+        return _Benchmark(request.node.name)
+
+    def pytest_terminal_summary(terminalreporter):
+        if _results:
+            terminalreporter.section('nsct benchmarks (single runs; install pytest-benchmark for statistics)')
+            for name, elapsed, extra in _results:
+                terminalreporter.write_line('{:<40} {:10.1f}ms {}'.format(
+                    name, elapsed * 1000, ' '.join('{}={}'.format(k, v) for k, v in sorted(extra.items()))))
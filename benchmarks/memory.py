@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Memory held by a parsed and computed definition, per device.
+
+    python benchmarks/memory.py [--devices N] [--interfaces N] [--fast]
+
+:copyright: (c) 2018 by Neil Jarvis
+:licence: MIT, see LICENCE for more details
+"""
+from __future__ import absolute_import, unicode_literals, print_function
+
+import argparse
+import gc
+import tracemalloc
+
+from nsct.definition import Definition
+from nsct.yaml import Fragment, Location
+
+from synthetic import definitionYaml
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the memory held by a definition')
+    parser.add_argument('--devices', type=int, default=10000, help='Number of devices (default: %(default)s)')
+    parser.add_argument('--interfaces', type=int, default=1, help='Interfaces per device (default: %(default)s)')
+    parser.add_argument('--fast', action='store_true', help='Parse with the safe loader, as the CLI does')
+    args = parser.parse_args()
+
+    ymlstr = definitionYaml(devices=args.devices, interfaces=args.interfaces, servers=0)
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    definition = Definition.parse(Fragment(Location('bench.yaml'), ymlstr=ymlstr, fast=args.fast))
+    definition.compute()
+
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] - before
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+
+    # The source text is kept to report errors against; count it separately
+    model = held - len(ymlstr.encode('utf-8'))
+    interfaces = args.devices * args.interfaces
+    print('{} devices, {} interfaces: {} bytes held ({} peak)'.format(args.devices, interfaces, held, peak))
+    print('{:.0f} bytes per device, {:.0f} bytes per interface (excluding the {} bytes of source)'.format(
+        model / args.devices, model / interfaces, len(ymlstr)))
+    assert len(definition.devices) == args.devices
+
+
+if __name__ == '__main__':
+    main()
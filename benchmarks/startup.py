@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Time taken to import the command line interface, and the modules taking the most of it.
+
+    python benchmarks/startup.py [--runs N] [--top N]
+
+:copyright: (c) 2018 by Neil Jarvis
+:licence: MIT, see LICENCE for more details
+"""
+from __future__ import absolute_import, unicode_literals, print_function
+
+import argparse
+from os.path import dirname, realpath
+import subprocess
+import sys
+
+
+def importTimes(*args):
+    """Run python with ``args`` (by default, importing nsct.__main__) under ``-X importtime``, from the top of
+    the source tree, returning the ``(self, cumulative)`` import time of each module, in microseconds.
+    """
+    cp = subprocess.run([sys.executable, '-X', 'importtime'] + list(args or ('-c', 'import nsct.__main__')),
+                        stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=dirname(dirname(realpath(__file__))))
+    times = {}
+    for line in cp.stderr.decode('utf-8').splitlines():
+        if line.startswith('import time:') and '|' in line:
+            self, cumulative, module = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                times[module.strip()] = (int(self), int(cumulative))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the import time of nsct.__main__')
+    parser.add_argument('--runs', type=int, default=5, help='Number of runs, the fastest being shown (default: %(default)s)')
+    parser.add_argument('--top', type=int, default=15, help='Number of modules to show (default: %(default)s)')
+    args = parser.parse_args()
+
+    runs = [importTimes() for i in range(args.runs)]
+    best = min(runs, key=lambda times: times['nsct.__main__'][1])
+
+    print('import nsct.__main__: {:.1f}ms (best of {})'.format(best['nsct.__main__'][1] / 1000.0, args.runs))
+    print('{:>10} {:>10}  module'.format('self ms', 'total ms'))
+    for module, (self, cumulative) in sorted(best.items(), key=lambda item: -item[1][0])[:args.top]:
+        print('{:10.1f} {:10.1f}  {}'.format(self / 1000.0, cumulative / 1000.0, module))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Synthetic definitions of large networks, for benchmarking.
+
+    python benchmarks/synthetic.py [--domains N] [--devices N] [--interfaces N] ... > big.yaml
+
+:copyright: (c) 2018 by Neil Jarvis
+:licence: MIT, see LICENCE for more details
+"""
+from __future__ import absolute_import, unicode_literals, print_function
+
+import argparse
+from os.path import dirname, join, realpath
+import sys
+
+IDENTITY = join(dirname(dirname(realpath(__file__))), 'tests', 'test_id_rsa')
+
+
+def definitionYaml(domains=4, devices=2000, interfaces=2, pools=2, records=20, servers=2, identity=IDENTITY):
+    """A definition of ``devices`` devices of ``interfaces`` interfaces each, spread over ``domains`` domains.
+
+    Each domain has a /16 IPv4 and a /64 IPv6 subnet, ``pools`` pools sized to hold the allocations made
+    from them, a DHCP range of 255 addresses served by one of the ``servers`` servers, and ``records``
+    records of each type.  Interfaces take turns between static, AUTO and (pooled) AUTO/<pool> IPv4
+    allocations, and all take EUI IPv6 allocations.  Every server also serves DNS, ethers and smokeping
+    for every domain.
+    """
+    assert 0 < domains <= 200 and pools <= 50
+    names = ['d{}.example.com'.format(d) for d in range(domains)]
+
+    # Work out every interface's allocation first, so that the pools can be sized to what they hand out.
+    # Static offsets count up from 1 and AUTO allocations take the next free ones; the pools sit at the top
+    # of the subnet, just below the DHCP range in its last /24.
+    statics = [0] * domains
+    autos = [0] * domains
+    pooled = [0] * domains
+    allocations = []
+    for n in range(devices * interfaces):
+        d = n % domains
+        if n % 3 == 0:
+            statics[d] += 1
+            allocations.append((d, str(statics[d])))
+        elif n % 3 == 1 or not pools:
+            autos[d] += 1
+            allocations.append((d, 'AUTO'))
+        else:
+            allocations.append((d, 'AUTO/pool{}'.format(pooled[d] % pools)))
+            pooled[d] += 1
+
+    # Pools are a whole number of /24s, each holding its share of the pooled allocations
+    poolSize = 0
+    if pools:
+        perPool = -(-max(pooled) // pools)
+        poolSize = 256 * max(1, -(-perPool // 256))
+    poolStart = 255 * 256 - pools * poolSize
+    for d in range(domains):
+        assert poolStart > 0 and statics[d] + autos[d] < poolStart, 'Too many devices for the domains'
+
+    def _address(d, offset):
+        return '10.{}.{}.{}'.format(d, offset >> 8, offset & 0xff)
+
+    lines = ['nameserver: bench', 'domains:']
+    for d, name in enumerate(names):
+        lines += ['  {}:'.format(name),
+                  '    ipv4-subnet: !ipv4network 10.{}.0.0/16'.format(d),
+                  '    ipv6-subnet: !ipv6network fd00:{:x}::/64'.format(d)]
+        if pools:
+            lines.append('    pools:')
+            for p in range(pools):
+                first = poolStart + p * poolSize
+                lines.append('      pool{}: !ipv4range {}-{}'.format(p, _address(d, first), _address(d, first + poolSize - 1)))
+        if records:
+            lines.append('    records:')
+            lines.append('      a:')
+            lines += ['        host-a{0}: !a 192.0.{1}.{2}'.format(r, r // 256, r % 256) for r in range(records)]
+            lines.append('      aaaa:')
+            lines += ['        host-aaaa{0}: !aaaa \'2001:db8::{0:x}\''.format(r) for r in range(records)]
+            lines.append('      mx:')
+            lines += ['        mx{0}: !mx {0}/mail{0}.{1}'.format(r, name) for r in range(records)]
+            lines.append('      cname:')
+            lines += ['        alias{0}: !cname host-a{0}.{1}'.format(r, name) for r in range(records)]
+            lines.append('      txt:')
+            lines += ['        txt{0}: !txt \'text {0}\''.format(r) for r in range(records)]
+
+    lines.append('devices:')
+    n = 0
+    for i in range(devices):
+        lines.append('  dev{}:'.format(i))
+        for k in range(interfaces):
+            d, strategy = allocations[n]
+            n += 1
+            mac = '02:00:{:02x}:{:02x}:{:02x}:{:02x}'.format((n >> 24) & 0xff, (n >> 16) & 0xff, (n >> 8) & 0xff, n & 0xff)
+            lines += ['    eth{}:'.format(k),
+                      '      mac: !mac {}'.format(mac),
+                      '      ipv4: !allocation {}/{}'.format(names[d], strategy),
+                      '      ipv6: !allocation {}/EUI'.format(names[d])]
+
+    if servers:
+        lines.append('servers:')
+    for s in range(servers):
+        d = s % domains
+        lines += ['  router{}:'.format(s),
+                  '    ssh:',
+                  '      host: !ipv4address 10.{}.255.255'.format(d),
+                  '      user: root',
+                  '      identity: {}'.format(identity),
+                  '      host-key: ssh-rsa AAAAB3NzaC1yc2E=',
+                  '    services:',
+                  '      ipv4-dhcp:',
+                  '        type: dnsmasq.openwrt',
+                  '        interface: lan',
+                  '        domain: {}'.format(names[d]),
+                  '        range: !ipv4range 10.{0}.255.0-10.{0}.255.254'.format(d),
+                  '      dns:',
+                  '        type: dnsmasq.openwrt',
+                  '        domains:'] + \
+                 ['          - {}'.format(name) for name in names] + \
+                 ['      ethers:',
+                  '        type: dnsmasq.openwrt',
+                  '      smokeping:',
+                  '        type: docker',
+                  '        config-name: /srv/smokeping/Targets',
+                  '        domains:'] + \
+                 ['          - {}'.format(name) for name in names]
+
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic definition to standard output')
+    parser.add_argument('--domains', type=int, default=4, help='Number of domains (default: %(default)s)')
+    parser.add_argument('--devices', type=int, default=2000, help='Number of devices (default: %(default)s)')
+    parser.add_argument('--interfaces', type=int, default=2, help='Interfaces per device (default: %(default)s)')
+    parser.add_argument('--pools', type=int, default=2, help='Pools per domain (default: %(default)s)')
+    parser.add_argument('--records', type=int, default=20, help='Records of each type per domain (default: %(default)s)')
+    parser.add_argument('--servers', type=int, default=2, help='Number of servers (default: %(default)s)')
+    args = parser.parse_args()
+
+    sys.stdout.write(definitionYaml(args.domains, args.devices, args.interfaces, args.pools, args.records, args.servers))
+
+
+if __name__ == '__main__':
+    main()
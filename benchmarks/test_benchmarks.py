@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+test_benchmarks
+----------------------------------
+
+Benchmarks of loading, parsing, computing and rendering a synthetic definition.
+"""
+from __future__ import absolute_import, unicode_literals, print_function
+
+import gc
+import tracemalloc
+
+import pytest
+
+from nsct.definition import Definition
+from nsct.sink import DirectorySink
+from nsct.support import supportedServices
+from nsct.yaml import Fragment, Location
+
+from synthetic import definitionYaml
+
+
+def _peak(f, *args, **kwargs):
+    """Call ``f``, returning its result and the peak memory allocated while it ran, in bytes."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = f(*args, **kwargs)
+        return (result, tracemalloc.get_traced_memory()[1])
+    finally:
+        tracemalloc.stop()
+
+
+def _measure(benchmark, f, *args, **kwargs):
+    """Record the peak memory of ``f`` in the benchmark's extra info, then benchmark it."""
+    benchmark.extra_info['peak_bytes'] = _peak(f, *args, **kwargs)[1]
+    return benchmark(f, *args, **kwargs)
+
+
+@pytest.fixture(scope='module')
+def ymlstr(request):
+    config = request.config
+    return definitionYaml(domains=config.getoption('domains'), devices=config.getoption('devices'),
+                          interfaces=config.getoption('interfaces'))
+
+
+def _load(ymlstr, fast=True):
+    return Fragment(Location('bench.yaml'), ymlstr=ymlstr, fast=fast)
+
+
+def _parse(ymlstr):
+    return Definition.parse(_load(ymlstr))
+
+
+def _computed(ymlstr):
+    definition = _parse(ymlstr)
+    definition.compute()
+    return definition
+
+
+@pytest.fixture(scope='module')
+def computed(ymlstr):
+    return _computed(ymlstr)
+
+
+def test_load_fast(benchmark, ymlstr):
+    _measure(benchmark, _load, ymlstr)
+
+
+def test_load_round_trip(benchmark, ymlstr):
+    _measure(benchmark, _load, ymlstr, fast=False)
+
+
+def test_parse(benchmark, ymlstr):
+    fragment = _load(ymlstr)
+    definition = _measure(benchmark, Definition.parse, fragment)
+    assert len(definition.devices) > 0
+
+
+def test_compute(benchmark, ymlstr):
+    # compute() can only be run once on a definition, so each round is given a fresh parse
+    benchmark.extra_info['peak_bytes'] = _peak(_parse(ymlstr).compute)[1]
+    benchmark.pedantic(lambda definition: definition.compute(), setup=lambda: ((_parse(ymlstr),), {}), rounds=5)
+
+
+@pytest.mark.parametrize('service', list(supportedServices))
+def test_render(benchmark, computed, service, tmpdir):
+    def _generate():
+        results = computed.generate([service], sinkFactory=lambda server: DirectorySink(str(tmpdir.join(str(server)))))
+        assert all(result.ok for result in results)
+
+    _measure(benchmark, _generate)
+
+
+def test_synthetic_pools_sized():
+    # More pooled allocations than a /24 holds
+    definition = _parse(definitionYaml(domains=1, devices=1000, interfaces=1, pools=1, records=0, servers=0))
+    definition.compute()
+    assert len(definition.devices) == 1000
@@ -12,21 +12,171 @@ or ``python -m nsct`` (no install required).
 from __future__ import absolute_import, unicode_literals, print_function
 
 from argparse import ArgumentParser, FileType
+from contextlib import contextmanager
+import cProfile
+import io
+import json
 import logging
 import os
-from subprocess import run
+import shutil
+from subprocess import CalledProcessError, check_output, run
 import sys
-from tempfile import TemporaryFile
+import tarfile
+from tempfile import mkdtemp, TemporaryFile
 
 from nsct import __version__, __summary__
+from nsct.cache import DefinitionCache
 from nsct.definition import Definition
+from nsct.error import DefinitionErrors
 from nsct.log import configure_stream, LEVELS
+from nsct.plan import plan
+from nsct.sink import DirectorySink, SinkPool
+from nsct.state import State
 from nsct.support import supportedServices
+from nsct.timing import timings
+from nsct.watch import FileWatcher
 from nsct.yaml import Fragment, Location, DefinitionError
 
 logger = logging.getLogger(__name__)
 
 
+def _load(args, fast, cache):
+    """Parse (or fetch from ``cache``) and return the definition named on the command line, with its fragment.
+
+    The fragment is None if the definition came from the cache.
+    """
+    fragment = None
+    definition = None
+    if cache:
+        with timings.span('cache.load'):
+            definition = cache.load(args.filename.name)
+    if definition is None:
+        with timings.span('load', filename=args.filename.name):
+            fragment = Fragment(Location(args.filename.name), fast=fast)
+        with timings.span('parse'):
+            definition = Definition.parse(fragment, allErrors=args.all_errors, jobs=args.jobs)
+        if cache and not definition.errors.errors:
+            with timings.span('cache.save'):
+                cache.save(args.filename.name, definition)
+    else:
+        definition.errors.collect = args.all_errors
+    return (definition, fragment)
+
+
+def _reportErrors(e, asJson):
+    errors = e.errors if isinstance(e, DefinitionErrors) else [e]
+    if asJson:
+        print(json.dumps({'errors': [error.asDict() for error in errors]}, indent=2), file=sys.stdout)
+    else:
+        print(e, file=sys.stdout)
+
+
+def _reportTimings(args):
+    """Show the timings of the run with --timings, and write them as a trace with --trace."""
+    if args.timings:
+        print(timings.summary(), file=sys.stderr)
+    if args.trace:
+        with open(args.trace, 'w') as f:
+            json.dump(timings.asTrace(), f, indent=1)
+
+
+def _stateFilename(args):
+    return args.state if args.state else args.filename.name + '.state'
+
+
+@contextmanager
+def _gitRevision(filename, rev):
+    """Yield the name of ``filename`` as it was at git revision ``rev``, in a copy of the repository at ``rev``."""
+    directory = os.path.dirname(os.path.abspath(filename))
+    top = check_output(['git', '-C', directory, 'rev-parse', '--show-toplevel']).decode('utf-8').strip()
+    archive = check_output(['git', '-C', top, 'archive', '--format=tar', rev])
+
+    # Included files are read as they were at the revision too
+    tmp = mkdtemp(prefix='nsct-')
+    try:
+        with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+            tar.extractall(tmp)
+        yield os.path.join(tmp, os.path.relpath(os.path.realpath(filename), os.path.realpath(top)))
+    finally:
+        shutil.rmtree(tmp)
+
+
+def _plan(args, definition):
+    """The :class:`nsct.plan.Plan` from the definition named by ``--plan`` to ``definition``."""
+    def _old(filename):
+        old = Definition.parse(Fragment(Location(filename), fast=True), allErrors=args.all_errors, jobs=args.jobs)
+        # The state is only read, so that AUTO allocations come out as they would be deployed
+        old.compute(State(_stateFilename(args)))
+        return old
+
+    if args.plan.startswith('git:'):
+        with _gitRevision(args.filename.name, args.plan[len('git:'):]) as filename:
+            return plan(_old(filename), definition)
+    return plan(_old(args.plan), definition)
+
+
+def _directorySinkFactory(args):
+    return lambda server: DirectorySink(os.path.join(args.output_dir, str(server)))
+
+
+def _watch(args, actions, cache):
+    """Deploy the definition, then again each time it (or a file it includes) changes, until interrupted.
+
+    Each deployment starts from the state as last saved, so only services whose configuration changed
+    are pushed, and SSH connections to servers are kept open from one deployment to the next.
+    """
+    pool = SinkPool() if not args.output_dir else None
+    watcher = FileWatcher(interval=args.watch_interval)
+    files = [args.filename.name]
+    force = args.force
+    try:
+        while True:
+            # Look at the files before loading them, so that changes made from now on are noticed
+            watcher.watch(files)
+            try:
+                definition, fragment = _load(args, True, cache)
+                state = State(_stateFilename(args)) if pool else None
+                with timings.span('compute'):
+                    definition.compute(state)
+
+                # Watch the files of the last good definition, so that an include fixing an error is noticed
+                files = definition.files or files
+                watcher.watch(files)
+                with timings.span('generate'):
+                    if pool:
+                        try:
+                            results = definition.generate(actions, jobs=args.jobs, state=state, force=force,
+                                                          sinkFactory=pool.sink)
+                        finally:
+                            state.save()
+                        pool.prune(definition.servers.values())
+                        force = False
+                    else:
+                        results = definition.generate(actions, jobs=args.jobs, sinkFactory=_directorySinkFactory(args))
+
+                for result in results:
+                    print(result, file=sys.stdout)
+                sys.stdout.flush()
+            except DefinitionError as e:
+                _reportErrors(e, args.json)
+            except Exception:
+                # Keep watching: the next change may well put it right
+                logger.exception('Deploying %s failed', args.filename.name)
+
+            # Timings are of each deployment in turn
+            if timings.enabled:
+                _reportTimings(args)
+                timings.enable()
+
+            logger.info('Watching {} for changes'.format(', '.join(files)))
+            watcher.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if pool:
+            pool.close()
+
+
 def cli():
     """Add some useful functionality here or import from a submodule."""
     # configure root logger to print to STDERR
@@ -46,22 +196,105 @@ def cli():
     parser.add_argument('filename', metavar='<FILENAME>', type=FileType('r'), help='Name of YAML file containing definition')
     parser.add_argument('--version', action='version', version='%(prog)s ' + __version__)
     parser.add_argument('--check', action='store_true', help='Read and check the YAML file')
+    parser.add_argument('--all-errors', action='store_true',
+                        help='Report every error in the YAML file rather than stopping at the first')
+    parser.add_argument('--json', action='store_true', help='Report errors in the YAML file as JSON')
     parser.add_argument('--diff', action='store_true', help='Read and re-generate YAML file, showing differences')
+    parser.add_argument('--plan', metavar='<OLD>',
+                        help='Show what changes from the definition in <OLD>, a file name or git:<REVISION> for the '
+                             'YAML file as it was at that git revision, to the YAML file')
     parser.add_argument('--dump', metavar='<FILENAME>', type=FileType('w'), help='Read and dump the YAML file to <FILENAME>')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Parse the YAML file even if a cached parse of it is available, and do not cache it')
     parser.add_argument('--generate', choices=list(supportedServices.keys()) + ['all'], action='append')
+    parser.add_argument('--jobs', '-j', metavar='<N>', type=int, default=1,
+                        help='Number of included files to load, and of servers to generate, concurrently (default: 1)')
+    parser.add_argument('--state', metavar='<FILENAME>',
+                        help='File recording what was last generated, used to skip unchanged services and keep '
+                             'AUTO allocations stable (default: <FILENAME>.state)')
+    parser.add_argument('--force', action='store_true', help='Generate all services, even if unchanged')
+    parser.add_argument('--output-dir', metavar='<DIRECTORY>',
+                        help='Write generated configuration under <DIRECTORY>/<server> instead of to the servers')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running, generating again each time the YAML file, or a file it includes, changes')
+    parser.add_argument('--watch-interval', metavar='<SECONDS>', type=float, default=1.0,
+                        help='How often --watch looks for changes when inotify is not available (default: 1.0)')
+    parser.add_argument('--timings', action='store_true',
+                        help='Show the time taken by each step (load, parse, compute, render, transfer...) on stderr')
+    parser.add_argument('--trace', metavar='<FILENAME>',
+                        help='Write the time taken by each step to <FILENAME> as a JSON trace (Trace Event Format)')
+    parser.add_argument('--profile', metavar='<FILENAME>',
+                        help='Profile the run with cProfile, writing the profile to <FILENAME>')
     args = parser.parse_args()
 
+    if args.timings or args.trace:
+        timings.enable()
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+
+    try:
+        _run(parser, args)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if timings.enabled and not args.watch:
+            _reportTimings(args)
+
+
+def _run(parser, args):
+    if args.watch and (args.check or args.diff or args.dump or args.plan):
+        parser.error('--watch cannot be used with --check, --diff, --dump or --plan')
+
     logger.debug('Running')
 
+    # Only --dump and --diff need the slower round-trip YAML loader, for its comments and layout
+    roundTrip = args.dump or args.diff
+    cache = DefinitionCache() if not (roundTrip or args.no_cache) else None
+
+    if not args.generate:
+        args.generate = ['all']
+
+    if 'all' in args.generate:
+        args.generate = list(supportedServices.keys())
+
+    actions = [action for action in supportedServices if action in args.generate]
+
+    if args.watch:
+        _watch(args, actions, cache)
+        sys.exit(0)
+
+    # Only a run that generates to the servers records anything in the state
+    state = State(_stateFilename(args))
+
     try:
-        fragment = Fragment(Location(args.filename.name))
-        definition = Definition.parse(fragment)
-        definition.compute()
+        definition, fragment = _load(args, not roundTrip, cache)
+        with timings.span('compute'):
+            definition.compute(state)
     except DefinitionError as e:
-        print(e, file=sys.stdout)
+        _reportErrors(e, args.json)
         sys.exit(1)
     else:
         if args.check:
+            if args.json:
+                print(json.dumps({'errors': []}, indent=2), file=sys.stdout)
+            sys.exit(0)
+        if args.plan:
+            try:
+                changes = _plan(args, definition)
+            except DefinitionError as e:
+                if not args.json:
+                    print('In {}:'.format(args.plan), file=sys.stdout)
+                _reportErrors(e, args.json)
+                sys.exit(1)
+            except (CalledProcessError, EnvironmentError) as e:
+                print('Error: cannot read {}: {}'.format(args.plan, e), file=sys.stderr)
+                sys.exit(1)
+            if args.json:
+                print(json.dumps(changes.asDict(), indent=2), file=sys.stdout)
+            else:
+                print(changes, file=sys.stdout)
             sys.exit(0)
         if args.diff:
             with TemporaryFile() as fp:
@@ -73,17 +306,24 @@ def cli():
             fragment.dump(args.dump)
             sys.exit(0)
 
-        if not args.generate:
-            args.generate = ['all']
+        logger.debug('Generation phase: {}'.format(args.generate))
 
-        if 'all' in args.generate:
-            args.generate = list(supportedServices.keys())
+        with timings.span('generate'):
+            if args.output_dir:
+                # Rendering locally says nothing about what is on the servers, so leave the state alone
+                results = definition.generate(actions, jobs=args.jobs, sinkFactory=_directorySinkFactory(args))
+            else:
+                try:
+                    results = definition.generate(actions, jobs=args.jobs, state=state, force=args.force)
+                finally:
+                    definition.close()
+                    state.save()
 
-        logger.debug('Generation phase: {}'.format(args.generate))
+        for result in results:
+            print(result, file=sys.stdout)
 
-        for action in supportedServices:
-            if action in args.generate:
-                definition.generate(action)
+        if not all(result.ok for result in results):
+            sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2018 by Neil Jarvis
+:licence: MIT, see LICENCE for more details
+"""
+from __future__ import absolute_import, unicode_literals, print_function
+
+import socket
+import struct
+
+# Addresses and MACs are held as plain ints in the model, and only formatted as text when rendered,
+# in the same form as netaddr gives.
+
+_ipv4Struct = struct.Struct('!I')
+
+
+def formatIPv4(value):
+    return socket.inet_ntoa(_ipv4Struct.pack(value))
+
+
+def formatIPv6(value):
+    return socket.inet_ntop(socket.AF_INET6, value.to_bytes(16, 'big'))
+
+
+formatAddress = {'ipv4': formatIPv4,
+                 'ipv6': formatIPv6}
+
+
+def formatMAC(value):
+    """Format a MAC address as ``00:01:02:03:04:05``."""
+    h = '%012x' % value
+    return ':'.join((h[0:2], h[2:4], h[4:6], h[6:8], h[8:10], h[10:12]))
+
+
+def modifiedEUI64(mac):
+    """The modified EUI-64 interface identifier of a MAC address (RFC 4291, appendix A)."""
+    return (((mac >> 24) << 40) | (0xfffe << 24) | (mac & 0xffffff)) ^ (1 << 57)
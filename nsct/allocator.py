@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2018 by Neil Jarvis
+:licence: MIT, see LICENCE for more details
+"""
+from __future__ import absolute_import, unicode_literals, print_function
+
+from bisect import bisect_right
+
+
+class AddressAllocator(object):
+    """Allocations of the offsets ``0..size-1`` of a subnet.
+
+    Allocations are held as sorted, non-overlapping runs of offsets, each with an owner, so reserving
+    a range costs the same however large the range is.  Alongside the runs the allocator keeps the
+    merged blocks of contiguous allocated offsets, which lets every query (owner of an offset, whether
+    a range is free, the next free offset, the free ranges) be answered with a binary search rather
+    than by scanning offsets.
+    """
+    def __init__(self, size):
+        self._size = size
+
+        # Allocated runs: [first, last] -> owner
+        self._firsts = []
+        self._lasts = []
+        self._owners = []
+
+        # Merged blocks of contiguous allocated offsets
+        self._blockFirsts = []
+        self._blockLasts = []
+
+    @property
+    def size(self):
+        return self._size
+
+    def __len__(self):
+        """Number of allocations, a reserved range counting once."""
+        return len(self._firsts)
+
+    def _run(self, offset):
+        i = bisect_right(self._firsts, offset) - 1
+        if i >= 0 and self._lasts[i] >= offset:
+            return i
+        return None
+
+    def owner(self, offset):
+        i = self._run(offset)
+        return self._owners[i] if i is not None else None
+
+    def isFree(self, first, last=None):
+        if last is None:
+            last = first
+        i = bisect_right(self._blockFirsts, last) - 1
+        return i < 0 or self._blockLasts[i] < first
+
+    def allocate(self, offset, owner):
+        self.reserve(offset, offset, owner)
+
+    def reserve(self, first, last, owner):
+        """Allocate every offset in ``first..last`` to ``owner``.  The range must be free."""
+        if first < 0 or last >= self._size or first > last:
+            raise IndexError('range {}..{} is not within 0..{}'.format(first, last, self._size - 1))
+        if not self.isFree(first, last):
+            raise ValueError('range {}..{} is already allocated'.format(first, last))
+
+        i = bisect_right(self._firsts, first)
+        self._firsts.insert(i, first)
+        self._lasts.insert(i, last)
+        self._owners.insert(i, owner)
+
+        # Merge into the neighbouring blocks where contiguous
+        i = bisect_right(self._blockFirsts, first)
+        mergeLeft = i > 0 and self._blockLasts[i - 1] == first - 1
+        mergeRight = i < len(self._blockFirsts) and self._blockFirsts[i] == last + 1
+        if mergeLeft and mergeRight:
+            self._blockLasts[i - 1] = self._blockLasts[i]
+            del self._blockFirsts[i]
+            del self._blockLasts[i]
+        elif mergeLeft:
+            self._blockLasts[i - 1] = last
+        elif mergeRight:
+            self._blockFirsts[i] = first
+        else:
+            self._blockFirsts.insert(i, first)
+            self._blockLasts.insert(i, last)
+
+    def nextFree(self, start=0, stop=None):
+        """Return the lowest free offset in ``start..stop`` (default: to the end), or None."""
+        if stop is None or stop >= self._size:
+            stop = self._size - 1
+        i = bisect_right(self._blockFirsts, start) - 1
+        if i >= 0 and self._blockLasts[i] >= start:
+            start = self._blockLasts[i] + 1
+        return start if start <= stop else None
+
+    def freeRanges(self, start=0, stop=None):
+        """Yield ``(first, last)`` for each maximal free range within ``start..stop``, in order."""
+        if stop is None or stop >= self._size:
+            stop = self._size - 1
+        i = bisect_right(self._blockFirsts, start) - 1
+        if i >= 0 and self._blockLasts[i] >= start:
+            start = self._blockLasts[i] + 1
+        i += 1
+        while start <= stop:
+            if i < len(self._blockFirsts) and self._blockFirsts[i] <= stop:
+                if self._blockFirsts[i] > start:
+                    yield (start, self._blockFirsts[i] - 1)
+                start = self._blockLasts[i] + 1
+                i += 1
+            else:
+                yield (start, stop)
+                break
+
+    def items(self):
+        """Yield ``(first, last, owner)`` for each allocation, in offset order."""
+        for run in zip(self._firsts, self._lasts, self._owners):
+            yield run
+
+    def __repr__(self):
+        return '{0.__class__.__name__}(size={0._size!r}, allocations={1!r})'.format(self, list(self.items()))
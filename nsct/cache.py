@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2018 by Neil Jarvis
+:licence: MIT, see LICENCE for more details
+"""
+from __future__ import absolute_import, unicode_literals, print_function
+
+import glob
+import hashlib
+import logging
+import os
+import pickle
+import sys
+
+from nsct import __version__
+
+logger = logging.getLogger(__name__)
+
+
+def _defaultDirectory():
+    return os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser(os.path.join('~', '.cache'))), 'nsct')
+
+
+def _fileDigest(filename):
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class DefinitionCache(object):
+    """Parsed definitions, pickled so that unchanged definition files need not be parsed again.
+
+    A cached definition is used if its file, and each file it includes, has the modification time and
+    size recorded with it or, failing that, the same SHA-256 digest.  Entries made by a different version of nsct, or before any
+    of its modules last changed, are ignored.  Only the parse is cached: checks made while parsing
+    against other files, such as that ssh identities exist, are not made again.
+    """
+    VERSION = 1
+
+    def __init__(self, directory=None):
+        self._directory = directory if directory else _defaultDirectory()
+
+        modules = glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))
+        self._key = (self.VERSION, __version__, tuple(sys.version_info[:2]),
+                     max(os.stat(module).st_mtime_ns for module in modules))
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def _entry(self, filename):
+        name = hashlib.sha256(os.path.abspath(filename).encode('utf-8')).hexdigest()
+        return os.path.join(self._directory, name + '.pickle')
+
+    def _stale(self, files):
+        for filename, mtime, size, digest in files:
+            stat = os.stat(filename)
+            if (mtime, size) != (stat.st_mtime_ns, stat.st_size) and digest != _fileDigest(filename):
+                return filename
+        return None
+
+    def load(self, filename):
+        """The definition cached for ``filename``, or None."""
+        entry = self._entry(filename)
+        try:
+            with open(entry, 'rb') as f:
+                header = pickle.load(f)
+                if header.get('key') != self._key:
+                    logger.debug('Ignoring stale cache entry {} for {}'.format(entry, filename))
+                    return None
+
+                stale = self._stale(header['files'])
+                if stale:
+                    logger.debug('Cache entry {} for {} is not for the current {}'.format(entry, filename, stale))
+                    return None
+
+                definition = pickle.load(f)
+        except (IOError, OSError):
+            return None
+        except Exception as e:
+            logger.warning('Ignoring unreadable cache entry {}: {}'.format(entry, e))
+            return None
+
+        logger.info('Using cached parse of {}'.format(filename))
+        return definition
+
+    def save(self, filename, definition):
+        """Cache ``definition``, as parsed from ``filename`` and the files it includes.  Failure to do so is
+        only logged."""
+        entry = self._entry(filename)
+        try:
+            files = []
+            for f in definition.files:
+                # Absolute, so that the entry can be checked from any working directory
+                f = os.path.abspath(f)
+                stat = os.stat(f)
+                files.append((f, stat.st_mtime_ns, stat.st_size, _fileDigest(f)))
+            header = {'key': self._key, 'files': files}
+
+            if not os.path.isdir(self._directory):
+                os.makedirs(self._directory)
+            tmp = entry + '.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(definition, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, entry)
+        except Exception as e:
+            logger.warning('Unable to cache parse of {} in {}: {}'.format(filename, entry, e))
+        else:
+            logger.debug('Cached parse of {} in {}'.format(filename, entry))
+
+    def __repr__(self):
+        return '{0.__class__.__name__}({0._directory!r})'.format(self)
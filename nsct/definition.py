@@ -5,25 +5,38 @@
 """
 from __future__ import absolute_import, unicode_literals, print_function
 
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import os
 
 from nsct._compat import string_types, iteritems
 from nsct.domain import Domain
+from nsct.error import ErrorCollector
+from nsct.schema import Schema, Key
 from nsct.device import Device
 from nsct.server import Server
+from nsct.timing import timings
+from nsct.yaml import loadFragments
 
 logger = logging.getLogger(__name__)
 
 
 class Definition(object):
-    def __init__(self, nameserver):
+    def __init__(self, nameserver, errors=None):
         self._nameserver = nameserver
+        self._errors = errors if errors is not None else ErrorCollector()
+        self._failed = dict((kind, set()) for kind in ('domains', 'devices', 'servers'))
+        self._files = []
         self._domains = {}
         self._devices = {}
         self._servers = {}
 
         self._macs = {}  # Derived from devices
 
+        self._state = None
+        self._changed = {}
+        self._removed = {}
+
     @property
     def domains(self):
         return self._domains
@@ -40,6 +53,31 @@ class Definition(object):
     def macs(self):
         return self._macs
 
+    @property
+    def errors(self):
+        """The :class:`nsct.error.ErrorCollector` the definition is parsed and computed with."""
+        return self._errors
+
+    def failed(self, kind):
+        """Names of the ``kind`` entities left out of the definition because of errors collected in them."""
+        return self._failed[kind]
+
+    @property
+    def state(self):
+        """The :class:`nsct.state.State` given to :meth:`compute`, if any."""
+        return self._state
+
+    def changed(self, kind):
+        """Names of the ``kind`` ('domains', 'devices' or 'servers') entities added or changed since the state
+        given to :meth:`compute` was recorded; all of them if there was no state."""
+        if self._state is None:
+            return set(getattr(self, '_' + kind).keys())
+        return self._changed[kind]
+
+    def removed(self, kind):
+        """Names of the ``kind`` entities removed since the state given to :meth:`compute` was recorded."""
+        return self._removed.get(kind, set())
+
     def addDomain(self, name, domain):
         if len(self._domains) == 0:
             # First domain - this is the global domain by convention
@@ -57,51 +95,181 @@ class Definition(object):
         return '{0.__class__.__name__}(nameserver={0._nameserver!r}, domains={0._domains!r}, ' \
             'devices={0._devices!r}, macs={0._macs!r})'.format(self)
 
-    def compute(self):
+    def compute(self, state=None):
+        """Compute allocations and derived configuration.
+
+        If the definition was parsed collecting errors, every error collected in parsing and computing it
+        is raised at the end, as a :class:`nsct.error.DefinitionErrors` if there is more than one.
+
+        With a :class:`nsct.state.State`, the definition's entities are compared with those recorded in it,
+        AUTO allocations of unchanged devices keep the offsets recorded in it, and the entities and AUTO
+        allocations computed are recorded back into it.
+        """
         logger.info('Computing final definition state')
 
+        self._state = state
+        if state is not None:
+            for kind in state.ENTITY_KINDS:
+                entities = getattr(self, '_' + kind)
+                with timings.span('compute.state', kind=kind):
+                    self._changed[kind], self._removed[kind] = \
+                        state.updateEntities(kind, dict((name, entity.digest) for name, entity in iteritems(entities)))
+                logger.info('{} of {} {} changed, {} removed since last recorded'.
+                            format(len(self._changed[kind]), len(entities), kind, len(self._removed[kind])))
+
         for serverName, server in iteritems(self._servers):
-            server.compute()
+            with timings.span('compute.server', server=serverName):
+                server.compute()
 
         for deviceName, device in iteritems(self._devices):
-            device.compute()
+            with timings.span('compute.device', device=deviceName):
+                device.compute()
 
         for domainName, domain in iteritems(self._domains):
-            domain.compute()
+            with timings.span('compute.domain', domain=domainName):
+                domain.compute()
+
+        # Errors collected while parsing are reported here too, all together
+        self._errors.raiseErrors()
+
+    def generate(self, actions, jobs=1, state=None, force=False, sinkFactory=None):
+        """Generate ``actions`` on every server, running up to ``jobs`` servers concurrently.
+
+        The actions for any one server are always run in the order given.  ``state`` and ``force``
+        are passed to :meth:`nsct.server.Server.generate`.  If ``sinkFactory`` is given it is called
+        with each server to get the :class:`nsct.sink.Sink` to generate to, otherwise each server is
+        generated over SSH.  Returns a list of :class:`nsct.server.ServerResult`, one per server, in
+        definition order.
+        """
+        logger.info('Generating for actions: {} ({} jobs)'.format(actions, jobs))
+
+        def _generate(server):
+            if sinkFactory is not None:
+                server.sink = sinkFactory(server)
+            try:
+                with timings.span('generate.server', server=server):
+                    return server.generate(actions, state=state, force=force)
+            finally:
+                server.close()
 
-    def generate(self, action):
-        logger.info('Generating for action: {}'.format(action))
+        servers = list(self._servers.values())
+        if jobs <= 1 or len(servers) <= 1:
+            return [_generate(server) for server in servers]
 
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(_generate, servers))
+
+    def close(self):
         for serverName, server in iteritems(self._servers):
-            server.generate(action)
+            server.close()
+
+    def _parseEntity(self, kind, name, fragment, cls, add):
+        if name in getattr(self, '_' + kind) or name in self._failed[kind]:
+            fragment.raiseError('{} \'{}\' is already defined'.format(kind[:-1].capitalize(), name))
+
+        entity = self._errors.attempt(cls.parse, name, fragment, self)
+        if entity is None:
+            self._failed[kind].add(name)
+        else:
+            add(name, entity)
+
+    def _include(self, fragment, record, jobs):
+        """Load the files included by ``fragment``, and those they include, returning a record for each."""
+        records = []
+        included = set([os.path.abspath(fragment.filename)])
+        pending = [(fragment, record)]
+        while pending:
+            filenames = []
+            for includingFragment, includingRecord in pending:
+                if not includingRecord['includes']:
+                    continue
+                directory = os.path.dirname(includingFragment.filename)
+                for i, includeFragment in includingRecord.fragment('includes').getElements():
+                    include = includeFragment.getValue(string_types, source='for include')
+                    filename = os.path.join(directory, include)
+                    if not os.path.isfile(filename):
+                        includeFragment.raiseError('Included file \'{}\' not found'.format(filename))
+                    if os.path.abspath(filename) in included:
+                        includeFragment.raiseError('File \'{}\' is already included'.format(filename))
+                    included.add(os.path.abspath(filename))
+                    filenames.append(filename)
+
+            # Each round of includes is loaded concurrently
+            pending = []
+            for includedFragment in loadFragments(filenames, fast=not fragment.hasPositions, jobs=jobs):
+                if not includedFragment.ymlIsInstance(dict):
+                    includedFragment.raiseError('Expecting dict at top level of included file')
+                includedRecord = includedSchema.validate(includedFragment)
+                records.append(includedRecord)
+                pending.append((includedFragment, includedRecord))
+            self._files.extend(filenames)
+
+        return records
+
+    @property
+    def files(self):
+        """The file the definition was parsed from followed by every file it includes."""
+        return self._files
 
     @staticmethod
-    def parse(fragment):
+    def parse(fragment, allErrors=False, jobs=1):
+        """Parse a definition.
+
+        The domains, devices and servers of the files named by ``includes`` (relative to the including file),
+        and by their own ``includes``, are added to those of the definition, in order.  Included files are
+        loaded by up to ``jobs`` worker processes.
+
+        With ``allErrors``, errors in domains, devices, servers and their parts are collected rather than
+        raised, leaving the part in error out, and are raised by :meth:`compute`.
+        """
         logger.info('Starting parse of {}'.format(fragment))
 
         if not fragment.ymlIsInstance(dict):
             fragment.raiseError('Expecting dict at top level of definition')
 
-        definition = Definition(fragment.getMappingValue('nameserver', string_types, required=True))
+        record = definitionSchema.validate(fragment)
+        definition = Definition(record['nameserver'], ErrorCollector(collect=allErrors))
+        definition._files.append(fragment.filename)
+        with timings.span('parse.includes'):
+            records = [record] + definition._include(fragment, record, jobs)
 
         #
         # Parse domains
         #
-        for domainName, domainFragment in fragment.getMappingItems('domains', required=False):
-            definition.addDomain(domainName, Domain.parse(domainName, domainFragment, definition))
+        with timings.span('parse.domains'):
+            for record in records:
+                for domainName, domain, domainFragment in record.items('domains'):
+                    definition._errors.attempt(definition._parseEntity, 'domains', domainName, domainFragment, Domain,
+                                               definition.addDomain)
 
         #
         # Parse devices
         #
-        for deviceName, deviceFragment in fragment.getMappingItems('devices', required=False):
-            definition.addDevice(deviceName, Device.parse(deviceName, deviceFragment, definition))
+        with timings.span('parse.devices'):
+            for record in records:
+                for deviceName, device, deviceFragment in record.items('devices'):
+                    definition._errors.attempt(definition._parseEntity, 'devices', deviceName, deviceFragment, Device,
+                                               definition.addDevice)
 
         #
         # Parse servers
         #
-        for serverName, serverFragment in fragment.getMappingItems('servers', required=False):
-            definition.addServer(serverName, Server.parse(serverName, serverFragment, definition))
+        with timings.span('parse.servers'):
+            for record in records:
+                for serverName, server, serverFragment in record.items('servers'):
+                    definition._errors.attempt(definition._parseEntity, 'servers', serverName, serverFragment, Server,
+                                               definition.addServer)
 
         logger.info('Completed parse of {}'.format(fragment))
 
         return definition
+
+
+_entitiesKeys = [Key('domains', dict, required=False, itemType=dict, itemSource='for domain'),
+                 Key('devices', dict, required=False, itemType=dict, itemSource='for device'),
+                 Key('servers', dict, required=False, itemType=dict, itemSource='for server'),
+                 Key('includes', list, required=False)]
+
+definitionSchema = Schema(Key('nameserver', string_types), *_entitiesKeys)
+
+includedSchema = Schema(*_entitiesKeys)
@@ -9,6 +9,8 @@ from collections import OrderedDict
 import logging
 
 from nsct._compat import iteritems
+from nsct.address import formatAddress, formatMAC
+from nsct.schema import Schema, Key
 from nsct.yaml import YAML_allocation, YAML_mac
 from nsct.util import nth
 
@@ -16,9 +18,10 @@ logger = logging.getLogger(__name__)
 
 
 class DeviceInterface(object):
-    def __init__(self, name, fragment, definition, device, mac=None):
+    __slots__ = ('_name', '_primary', '_definition', '_device', '_mac', '_ipv4', '_ipv6')
+
+    def __init__(self, name, definition, device, mac=None):
         self._name = name
-        self._fragment = fragment
         self._primary = False
         self._definition = definition
         self._device = device
@@ -37,17 +40,18 @@ class DeviceInterface(object):
 
     @property
     def mac(self):
+        """The MAC address, as an int, or None."""
         return self._mac
 
     @property
     def device(self):
         return self._device
 
-    def addAllocation(self, version, allocation, allocationFragment):
+    def addAllocation(self, version, allocation, allocationLocation):
         if version == 'ipv4':
-            self._ipv4.append((allocation, allocationFragment))
+            self._ipv4.append((allocation, allocationLocation))
         elif version == 'ipv6':
-            self._ipv6.append((allocation, allocationFragment))
+            self._ipv6.append((allocation, allocationLocation))
 
     @property
     def hostname(self, sep='-'):
@@ -61,23 +65,31 @@ class DeviceInterface(object):
 
     def __repr__(self):
         return '{0.__class__.__name__}({0._name!r}, primary={0._primary!r}, ' \
-            'mac={0._mac!r}, ipv4={0._ipv4!r}, ipv6={0._ipv6!r})'.format(self)
+            'mac={1}, ipv4={0._ipv4!r}, ipv6={0._ipv6!r})'.format(self, formatMAC(self._mac) if self._mac is not None else None)
 
     def compute(self):
-        for (allocation, allocationFragment) in self._ipv4:
-            address = self._definition.domains[allocation.domain].allocate(allocationFragment, 'ipv4', allocation, self)
-            logger.debug('Allocated ipv4 addresses {} for {} from {}'.format(address, self, allocation.domain))
+        attempt = self._definition.errors.attempt
+
+        for (allocation, allocationLocation) in self._ipv4:
+            address = attempt(self._definition.domains[allocation.domain].allocate, allocationLocation, 'ipv4', allocation, self)
+            if address is not None:
+                logger.debug('Allocated ipv4 addresses {} for {} from {}'.
+                             format(formatAddress['ipv4'](address), self, allocation.domain))
 
-        for (allocation, allocationFragment) in self._ipv6:
-            address = self._definition.domains[allocation.domain].allocate(allocationFragment, 'ipv6', allocation, self)
-            logger.debug('Allocated ipv6 addresses {} for {} from {}'.format(address, self, allocation.domain))
+        for (allocation, allocationLocation) in self._ipv6:
+            address = attempt(self._definition.domains[allocation.domain].allocate, allocationLocation, 'ipv6', allocation, self)
+            if address is not None:
+                logger.debug('Allocated ipv6 addresses {} for {} from {}'.
+                             format(formatAddress['ipv6'](address), self, allocation.domain))
 
     @staticmethod
     def parse(name, fragment, definition, device, primary):
-        logger.debug('Parsing device at {!r}'.format(fragment))
+        logger.debug('Parsing device at %r', fragment)
+
+        interface = deviceInterfaceSchema.validate(fragment)
 
         def _parseAllocations(version, deviceInterface):
-            a, f = fragment.getMappingValue(version, (YAML_allocation, list), required=False, returnValueFragment=True)
+            a, f = interface[version], interface.fragment(version)
             if a is not None:
                 if isinstance(a, list):
                     es = f.getElements()
@@ -85,21 +97,28 @@ class DeviceInterface(object):
                     es = [(0, f)]
 
                 for i, f in es:
-                    a = f.getValue(YAML_allocation, source='for {} allocation'.format(version))
-                    if a.domain not in definition.domains:
-                        f.raiseError('Unknown domain \'{}\' in {} allocation'.format(a.domain, nth(i + 1)))
-                    else:
-                        deviceInterface.addAllocation(version, a, f)
-
-        mac, macFragment = fragment.getMappingValue('mac', YAML_mac, required=False, returnValueFragment=True)
-        deviceInterface = DeviceInterface(name, fragment, definition, device, mac)
+                    definition.errors.attempt(_parseAllocation, version, deviceInterface, i, f)
+
+        def _parseAllocation(version, deviceInterface, i, f):
+            a = f.getValue(YAML_allocation, source='for {} allocation'.format(version))
+            if a.domain not in definition.domains:
+                # A domain left out because of its own errors is not reported again here
+                if a.domain not in definition.failed('domains'):
+                    f.raiseError('Unknown domain \'{}\' in {} allocation'.format(a.domain, nth(i + 1)))
+            else:
+                # Only the location is kept, for errors in compute, not the YAML
+                deviceInterface.addAllocation(version, a, f.location.detach())
+
+        mac = int(interface['mac']) if interface['mac'] is not None else None
+        deviceInterface = DeviceInterface(name, definition, device, mac)
         deviceInterface.primary = primary
 
-        if mac:
+        if mac is not None:
             if mac not in definition.macs:
                 definition.macs[mac] = deviceInterface
             else:
-                macFragment.raiseError('MAC address {} already defined for device interface {}'.format(mac, definition.macs[mac]))
+                interface.fragment('mac').raiseError('MAC address {} already defined for device interface {}'.
+                                                     format(formatMAC(mac), definition.macs[mac]))
 
         _parseAllocations('ipv4', deviceInterface)
         _parseAllocations('ipv6', deviceInterface)
@@ -107,13 +126,25 @@ class DeviceInterface(object):
         return deviceInterface
 
 
+deviceInterfaceSchema = Schema(Key('mac', YAML_mac, required=False),
+                               Key('ipv4', (YAML_allocation, list), required=False),
+                               Key('ipv6', (YAML_allocation, list), required=False))
+
+
 class Device(object):
-    def __init__(self, name, fragment, definition):
+    __slots__ = ('_name', '_digest', '_definition', '_interfaces')
+
+    def __init__(self, name, digest, definition):
         self._name = name
-        self._fragment = fragment
+        self._digest = digest
         self._definition = definition
         self._interfaces = OrderedDict()
 
+    @property
+    def digest(self):
+        """SHA-256 of the device's definition."""
+        return self._digest
+
     def addInterface(self, name, deviceInterface):
         self._interfaces[name] = deviceInterface
 
@@ -129,11 +160,14 @@ class Device(object):
 
     @staticmethod
     def parse(name, fragment, definition):
-        device = Device(name, fragment, definition)
+        device = Device(name, fragment.digest(), definition)
 
         primary = True
         for interfaceName, interfaceFragment in fragment.getItems():
-            device.addInterface(interfaceName, DeviceInterface.parse(interfaceName, interfaceFragment, definition, device, primary))
+            deviceInterface = definition.errors.attempt(DeviceInterface.parse, interfaceName, interfaceFragment, definition,
+                                                        device, primary)
+            if deviceInterface is not None:
+                device.addInterface(interfaceName, deviceInterface)
             primary = False
 
         return device
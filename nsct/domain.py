@@ -8,27 +8,45 @@ from __future__ import absolute_import, unicode_literals, print_function
 from collections import OrderedDict, defaultdict
 import logging
 
+from nsct._compat import string_types, iteritems, range
+from nsct.address import formatAddress, modifiedEUI64
+from nsct.allocator import AddressAllocator
+from nsct.schema import Schema, Key
 from nsct.support import supportedRecords
-from nsct.yaml import (YAML_ipv4network, YAML_ipv6network, YAML_mx, YAML_a, YAML_aaaa, YAML_cname, YAML_txt)  # noqa
+from nsct.yaml import (YAML_ipv4network, YAML_ipv6network, YAML_ipv4range, YAML_mx, YAML_a, YAML_aaaa, YAML_cname,  # noqa
+                       YAML_txt)
 
 logger = logging.getLogger(__name__)
 
 
 class Domain(object):
-    def __init__(self, name, fragment, definition, ipv4Subnet, ipv6Subnet, records):
+    __slots__ = ('_name', '_digest', '_globalDomain', '_definition', '_ipv4Subnet', '_ipv4Allocations', '_ipv6Subnet',
+                 '_ipv6Allocations', '_records', '_ipv4DHCPServices', '_ipv6DHCPServices', '_dhcpRanges', '_pools',
+                 '_autoAllocations')
+
+    def __init__(self, name, digest, definition, ipv4Subnet, ipv6Subnet, records, pools=None):
         self._name = name
-        self._fragment = fragment
+        self._digest = digest
         self._globalDomain = False
         self._definition = definition
 
         self._ipv4Subnet = ipv4Subnet
-        self._ipv4Allocations = dict()
+        self._ipv4Allocations = AddressAllocator(ipv4Subnet.size if ipv4Subnet else 0)
         self._ipv6Subnet = ipv6Subnet
-        self._ipv6Allocations = dict()
+        self._ipv6Allocations = AddressAllocator(ipv6Subnet.size if ipv6Subnet else 0)
         self._records = records if records is not None else OrderedDict([(t, defaultdict(set)) for t in supportedRecords])
 
         self._ipv4DHCPServices = []
         self._ipv6DHCPServices = []
+        self._dhcpRanges = []
+
+        self._pools = pools if pools is not None else OrderedDict()
+        self._autoAllocations = []
+
+    @property
+    def digest(self):
+        """SHA-256 of the domain's definition."""
+        return self._digest
 
     @property
     def globalDomain(self):
@@ -47,73 +65,148 @@ class Domain(object):
         services = getattr(self, '_{}DHCPServices'.format(version))
         services.append(service)
 
+    def allocations(self, version):
+        """The :class:`nsct.allocator.AddressAllocator` of the ``version`` subnet."""
+        return getattr(self, '_{}Allocations'.format(version))
+
+    def formatAddress(self, version, offset):
+        """The address at ``offset`` in the ``version`` subnet, as text."""
+        return formatAddress[version](getattr(self, '_{}Subnet'.format(version)).first + offset)
+
+    def interfaceAllocations(self, version):
+        """Yield ``(offset, deviceInterface)`` for each device interface allocated an address, in address order."""
+        for first, last, owner in self.allocations(version).items():
+            if not isinstance(owner, string_types):
+                yield (first, owner)
+
     def reserveAddressRange(self, version, addressRange):
         logger.debug('Reserving {} DHCP address range {} in domain {}'.format(version, addressRange, self))
 
         subnet = getattr(self, '_{}Subnet'.format(version))
         allocations = getattr(self, '_{}Allocations'.format(version))
-        record = 'a' if version == 'ipv4' else 'aaaa'
 
-        for a in addressRange.range:
-            offset = int(a - subnet.first)
-            allocations[offset] = 'DHCP allocation range {}'.format(addressRange)
-            self._records[record]['dhcp-{}.{}'.format(offset, self._name)] = a
+        first = int(addressRange.range.first - subnet.first)
+        last = int(addressRange.range.last - subnet.first)
 
-    def allocate(self, fragment, version, allocation, deviceInterface):
-        deviceInterfaceName = deviceInterface.hostname
+        # Overlapping ranges (e.g. several servers serving the same pool) only reserve what is left
+        # free.  The dhcp-N records for the range are produced on demand by records().
+        for freeFirst, freeLast in list(allocations.freeRanges(first, last)):
+            allocations.reserve(freeFirst, freeLast, 'DHCP allocation range {}'.format(addressRange))
+            self._dhcpRanges.append((version, freeFirst, freeLast))
+
+    def _dhcpRecords(self, version):
+        subnet = getattr(self, '_{}Subnet'.format(version))
+        for rangeVersion, first, last in self._dhcpRanges:
+            if rangeVersion == version:
+                for offset in range(first, last + 1):
+                    yield ('dhcp-{}.{}'.format(offset, self._name), {subnet.first + offset})
+
+    def records(self, recordType):
+        """Yield ``(name, values)`` for every ``recordType`` record of the domain.
 
+        Records defined in the domain come first, followed by a ``dhcp-N`` A or AAAA record for each
+        address N of the DHCP ranges served in the domain, which are only produced as they are consumed.
+        The values of A and AAAA records are addresses as ints.
+        """
+        for item in iteritems(self._records[recordType]):
+            yield item
+
+        if recordType == 'a':
+            for item in self._dhcpRecords('ipv4'):
+                yield item
+        elif recordType == 'aaaa':
+            for item in self._dhcpRecords('ipv6'):
+                yield item
+
+    def snapshot(self):
+        """The records of the domain as ``{recordType: {name: values}}``, the values as space separated text.
+
+        Only the records defined in the domain and those of its device interfaces are included, not the
+        ``dhcp-N`` records of its DHCP ranges.  Used by :mod:`nsct.plan`.
+        """
+        snapshot = {}
+        for recordType, records in iteritems(self._records):
+            if recordType in ('a', 'aaaa'):
+                format = formatAddress['ipv4' if recordType == 'a' else 'ipv6']
+            else:
+                format = repr
+            snapshot[recordType] = dict((name, ' '.join(sorted(format(value) for value in values)))
+                                        for name, values in iteritems(records) if values)
+        return snapshot
+
+    def allocate(self, location, version, allocation, deviceInterface):
+        """Allocate an address to ``deviceInterface``, returning it as an int.
+
+        AUTO allocations are deferred until :meth:`compute`, and None is returned for them.
+        """
         subnet = getattr(self, '_{}Subnet'.format(version))
         allocations = getattr(self, '_{}Allocations'.format(version))
-        services = getattr(self, '_{}DHCPServices'.format(version))
 
         def _subnetAllocate(offset, unique=True):
-            if not unique or offset not in allocations:
-                try:
-                    address = subnet[offset]
-                except IndexError as e:
-                    fragment.raiseError('Offset {} in {} subnet of domain {} is out of valid range 0..{}'.
-                                        format(offset, version, self, len(subnet) - 1))
-                else:
-                    if unique:
-                        allocations[offset] = deviceInterface
-                    return address
-            else:
-                if isinstance(allocations[offset], str):
-                    fragment.raiseError('Address {} in {} subnet of domain {} reserved for {!s}'.
-                                        format(subnet[offset], version, self, allocations[offset]))
+            size = subnet.size
+            if offset < 0:
+                offset += size
+            if offset < 0 or offset >= size:
+                location.raiseError('Offset {} in {} subnet of domain {} is out of valid range 0..{}'.
+                                    format(offset, version, self, size - 1))
+
+            if unique:
+                owner = allocations.owner(offset)
+                if owner is None:
+                    allocations.allocate(offset, deviceInterface)
+                elif isinstance(owner, string_types):
+                    location.raiseError('Address {} in {} subnet of domain {} reserved for {!s}'.
+                                        format(self.formatAddress(version, offset), version, self, owner))
                 else:
-                    fragment.raiseError('Address {} in {} subnet of domain {} allocated to device interface {!s}'.
-                                        format(subnet[offset], version, self, allocations[offset]))
+                    location.raiseError('Address {} in {} subnet of domain {} allocated to device interface {!s}'.
+                                        format(self.formatAddress(version, offset), version, self, owner))
+            return subnet.first + offset
 
         if allocation.isEUIStrategy:
             if version == 'ipv6':
                 if self._ipv6Subnet:
-                    if deviceInterface.mac:
-                        eui = deviceInterface.mac.ipv6(self._ipv6Subnet.first)
-                        offset = int(eui - self._ipv6Subnet.first)
-                        address = _subnetAllocate(offset)
+                    if deviceInterface.mac is not None:
+                        address = _subnetAllocate(modifiedEUI64(deviceInterface.mac))
                     else:
-                        fragment.raiseError('No MAC address defined on device interface {} to generate EUI ipv6 address'.
+                        location.raiseError('No MAC address defined on device interface {} to generate EUI ipv6 address'.
                                             format(deviceInterface))
                 else:
-                    fragment.raiseError('No ipv6 subnet defined on domain {}'.format(self))
+                    location.raiseError('No ipv6 subnet defined on domain {}'.format(self))
             else:
-                fragment.raiseError('Cannot allocate EUI address from an {} subnet'.format(version))
+                location.raiseError('Cannot allocate EUI address from an {} subnet'.format(version))
             dhcp = False
         elif allocation.isAliasStrategy:
             if subnet:
                 address = _subnetAllocate(allocation.offset, unique=False)
             else:
-                fragment.raiseError('No subnet defined on domain {}'.format(version, self))
+                location.raiseError('No subnet defined on domain {}'.format(version, self))
             dhcp = False
         elif allocation.isOffsetStrategy:
             if subnet:
                 address = _subnetAllocate(allocation.offset)
             else:
-                fragment.raiseError('No {} subnet defined on domain {}'.format(version, self))
+                location.raiseError('No {} subnet defined on domain {}'.format(version, self))
             dhcp = deviceInterface.mac is not None
+        elif allocation.isAutoStrategy:
+            if not subnet:
+                location.raiseError('No {} subnet defined on domain {}'.format(version, self))
+            if allocation.pool is not None:
+                if allocation.pool not in self._pools:
+                    location.raiseError('Unknown pool \'{}\' in domain {}'.format(allocation.pool, self))
+                if version != 'ipv4':
+                    location.raiseError('Pool \'{}\' in domain {} is an ipv4 pool'.format(allocation.pool, self))
+            # Resolved by compute() once every explicit allocation has been made
+            self._autoAllocations.append((version, location, allocation, deviceInterface))
+            return None
         else:
-            fragment.raiseError('Unknown allocation strategy type {}'.format(allocation.strategyType))
+            location.raiseError('Unknown allocation strategy type {}'.format(allocation.strategyType))
+
+        self._allocated(version, address, dhcp, deviceInterface)
+        return address
+
+    def _allocated(self, version, address, dhcp, deviceInterface):
+        deviceInterfaceName = deviceInterface.hostname
+        services = getattr(self, '_{}DHCPServices'.format(version))
 
         if dhcp:
             for service in services:
@@ -125,8 +218,6 @@ class Domain(object):
             recordType = 'aaaa'
         self._records[recordType][deviceInterfaceName].add(address)
 
-        return address
-
     def __str__(self):
         return self._name
 
@@ -134,22 +225,94 @@ class Domain(object):
         return '{0.__class__.__name__}({0._name!r}, globalDomain={0._globalDomain!r}, ipv4Subnet={0._ipv4Subnet!r}, ' \
             'ipv6Subnet={0._ipv6Subnet!r}, records={0._records!r})'.format(self)
 
+    def _autoRange(self, version, pool):
+        subnet = getattr(self, '_{}Subnet'.format(version))
+        if pool is not None:
+            addressRange = self._pools[pool]
+            return (int(addressRange.range.first - subnet.first), int(addressRange.range.last - subnet.first))
+        elif version == 'ipv4' and subnet.prefixlen < 31:
+            # Never the network or broadcast address
+            return (1, subnet.size - 2)
+        else:
+            # Never the subnet-router anycast address
+            return (1, subnet.size - 1)
+
     def compute(self):
-        pass
+        # AUTO allocations take the lowest free offset in their range (DHCP ranges and explicit
+        # allocations are already taken), in order of device interface so the result does not
+        # depend on the order of the definition.  With recorded state, unchanged devices first take
+        # back their recorded offsets, and changed devices prefer theirs if still free.
+        state = self._definition.state
+        changedDevices = self._definition.changed('devices')
+
+        pinned = []
+        unpinned = []
+        for version, location, allocation, deviceInterface in sorted(self._autoAllocations, key=lambda a: (a[0], str(a[3]))):
+            previous = state.allocation(self, version, deviceInterface) if state is not None else None
+            first, last = self._autoRange(version, allocation.pool)
+            if previous is not None and not first <= previous <= last:
+                previous = None
+
+            entry = (version, location, allocation, deviceInterface, previous, first, last)
+            if previous is not None and str(deviceInterface.device) not in changedDevices:
+                pinned.append(entry)
+            else:
+                unpinned.append(entry)
+
+        autoOffsets = {'ipv4': OrderedDict(), 'ipv6': OrderedDict()}
+        for entry in pinned + unpinned:
+            self._definition.errors.attempt(self._autoAllocate, autoOffsets, *entry)
+        self._autoAllocations = []
+
+        if state is not None:
+            for version, offsets in iteritems(autoOffsets):
+                state.setAllocations(self, version, offsets)
+
+    def _autoAllocate(self, autoOffsets, version, location, allocation, deviceInterface, previous, first, last):
+        subnet = getattr(self, '_{}Subnet'.format(version))
+        allocations = getattr(self, '_{}Allocations'.format(version))
+
+        if previous is not None and allocations.isFree(previous):
+            offset = previous
+        else:
+            offset = allocations.nextFree(first, last)
+        if offset is None:
+            where = 'pool \'{}\''.format(allocation.pool) if allocation.pool else 'subnet'
+            location.raiseError('No free address left in {} {} of domain {}'.format(version, where, self))
+
+        allocations.allocate(offset, deviceInterface)
+        autoOffsets[version][deviceInterface] = offset
+        logger.debug('Allocated {} address {} for {} from {}'.
+                     format(version, self.formatAddress(version, offset), deviceInterface, self))
+        self._allocated(version, subnet.first + offset, deviceInterface.mac is not None, deviceInterface)
 
     @staticmethod
     def parse(name, fragment, definition):
-        logger.debug('Parsing domain at {!r}'.format(fragment))
+        logger.debug('Parsing domain at %r', fragment)
 
-        ipv4Subnet = fragment.getMappingValue('ipv4-subnet', YAML_ipv4network, required=False)
-        ipv6Subnet = fragment.getMappingValue('ipv6-subnet', YAML_ipv6network, required=False)
+        domain = domainSchema.validate(fragment)
+        ipv4Subnet = domain['ipv4-subnet']
+        ipv6Subnet = domain['ipv6-subnet']
 
         records = OrderedDict([(t, defaultdict(set)) for t in supportedRecords])
         for recordType in records.keys():
-            for recordName, recordFragment in fragment.getMappingItems('records.%s' % recordType,
-                                                                       required=False):
+            for recordName, record, recordFragment in domain.items('records.%s' % recordType):
+                records[recordType][recordName].add(int(record) if recordType in ('a', 'aaaa') else record)
+
+        pools = OrderedDict()
+        for poolName, pool, poolFragment in domain.items('pools'):
+            if not ipv4Subnet:
+                poolFragment.raiseError('No ipv4 subnet defined in domain')
+            if pool.range[0] not in ipv4Subnet or pool.range[-1] not in ipv4Subnet:
+                poolFragment.raiseError('Pool not inside domain\'s ipv4 subnet {}'.format(ipv4Subnet))
+            pools[poolName] = pool
+
+        return Domain(name, fragment.digest(), definition, ipv4Subnet, ipv6Subnet, records, pools)
 
-                records[recordType][recordName].add(recordFragment.getValue(globals()['YAML_%s' % recordType],
-                                                                            source='for %s record' % recordType))
 
-        return Domain(name, fragment, definition, ipv4Subnet, ipv6Subnet, records)
+domainSchema = Schema(Key('ipv4-subnet', YAML_ipv4network, required=False),
+                      Key('ipv6-subnet', YAML_ipv6network, required=False),
+                      *([Key('records.%s' % recordType, dict, required=False,
+                             itemType=globals()['YAML_%s' % recordType], itemSource='for %s record' % recordType)
+                         for recordType in supportedRecords] +
+                        [Key('pools', dict, required=False, itemType=YAML_ipv4range, itemSource='for pool')]))
@@ -7,4 +7,77 @@ from __future__ import absolute_import, unicode_literals
 
 
 class DefinitionError(Exception):
-    pass
+    """An error in a definition, with where it is (when known) and what it is."""
+    def __init__(self, text, filename=None, line=None, column=None, section=None, message=None):
+        super(DefinitionError, self).__init__(text)
+        self.filename = filename
+        self.line = line
+        self.column = column
+        self.section = section
+        self.message = message if message is not None else text
+
+    def __reduce__(self):
+        # Keep the details when pickled, e.g. from a worker process
+        return (self.__class__, (self.args[0], self.filename, self.line, self.column, self.section, self.message))
+
+    def asDict(self):
+        return {'filename': self.filename,
+                'line': self.line,
+                'column': self.column,
+                'section': self.section,
+                'message': self.message}
+
+
+class DefinitionErrors(DefinitionError):
+    """Every error collected from a definition by an :class:`ErrorCollector`, one per line."""
+    def __init__(self, errors):
+        super(DefinitionErrors, self).__init__('\n'.join(str(e) for e in errors))
+        self.errors = errors
+
+    def __reduce__(self):
+        return (self.__class__, (self.errors,))
+
+
+class ErrorCollector(object):
+    """Runs the parts of parsing and computing a definition that may fail.
+
+    Without ``collect``, a :class:`DefinitionError` is raised as usual.  With it, the error is kept and
+    the part of the definition concerned is left out so that checking can carry on with the rest;
+    :meth:`raiseErrors` then raises every error kept.
+    """
+    def __init__(self, collect=False):
+        self._collect = collect
+        self._errors = []
+
+    @property
+    def collect(self):
+        return self._collect
+
+    @collect.setter
+    def collect(self, value):
+        assert isinstance(value, bool)
+        self._collect = value
+
+    @property
+    def errors(self):
+        return self._errors
+
+    def attempt(self, f, *args, **kwargs):
+        """Return ``f(*args, **kwargs)``, or None if it raised a :class:`DefinitionError` that was kept."""
+        try:
+            return f(*args, **kwargs)
+        except DefinitionErrors as e:
+            if not self._collect:
+                raise
+            self._errors.extend(e.errors)
+        except DefinitionError as e:
+            if not self._collect:
+                raise
+            self._errors.append(e)
+        return None
+
+    def raiseErrors(self):
+        if len(self._errors) == 1:
+            raise self._errors[0]
+        elif self._errors:
+            raise DefinitionErrors(list(self._errors))
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2018 by Neil Jarvis
+:licence: MIT, see LICENCE for more details
+"""
+from __future__ import absolute_import, unicode_literals, print_function
+
+from collections import OrderedDict
+import logging
+
+from nsct._compat import iteritems
+
+logger = logging.getLogger(__name__)
+
+
+class Change(object):
+    """An entry added (``old`` is None), removed (``new`` is None) or changed between two definitions."""
+    __slots__ = ('_scope', '_kind', '_key', '_old', '_new')
+
+    def __init__(self, scope, kind, key, old, new):
+        self._scope = scope
+        self._kind = kind
+        self._key = key
+        self._old = old
+        self._new = new
+
+    @property
+    def scope(self):
+        return self._scope
+
+    @property
+    def kind(self):
+        return self._kind
+
+    @property
+    def key(self):
+        return self._key
+
+    @property
+    def old(self):
+        return self._old
+
+    @property
+    def new(self):
+        return self._new
+
+    @property
+    def action(self):
+        if self._old is None:
+            return 'add'
+        if self._new is None:
+            return 'remove'
+        return 'change'
+
+    def asDict(self):
+        return OrderedDict([('scope', self._scope), ('kind', self._kind), ('key', self._key), ('action', self.action),
+                            ('old', self._old), ('new', self._new)])
+
+    def __str__(self):
+        if self._old is None:
+            return '+ {} {}'.format(self._key, self._new)
+        if self._new is None:
+            return '- {} {}'.format(self._key, self._old)
+        return '~ {} {} -> {}'.format(self._key, self._old, self._new)
+
+    def __repr__(self):
+        return '{0.__class__.__name__}({0._scope!r}, {0._kind!r}, {0._key!r}, {0._old!r}, {0._new!r})'.format(self)
+
+
+class Plan(object):
+    """The changes between two computed definitions, grouped by scope and kind in definition order.
+
+    Scopes are ``servers/<server>/<service>`` for the entries a service configures (see
+    :meth:`nsct.server.ServerService.snapshot`) and ``domains/<domain>`` for the records of a domain
+    (see :meth:`nsct.domain.Domain.snapshot`).
+    """
+    def __init__(self, changes):
+        self._changes = changes
+
+    @property
+    def changes(self):
+        return self._changes
+
+    def __len__(self):
+        return len(self._changes)
+
+    def services(self):
+        """``{server: [service, ...]}`` of the services with changes, in definition order."""
+        services = OrderedDict()
+        for change in self._changes:
+            parts = change.scope.split('/')
+            if parts[0] == 'servers' and parts[2] not in services.setdefault(parts[1], []):
+                services[parts[1]].append(parts[2])
+        return services
+
+    def asDict(self):
+        return OrderedDict([('changes', [change.asDict() for change in self._changes])])
+
+    def __str__(self):
+        if not self._changes:
+            return 'No changes'
+
+        lines = []
+        scope = kind = None
+        for change in self._changes:
+            if change.scope != scope:
+                scope, kind = change.scope, None
+                lines.append('{}:'.format(scope))
+            if change.kind != kind:
+                kind = change.kind
+                lines.append('  {}:'.format(kind))
+            lines.append('    {!s}'.format(change))
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return '{0.__class__.__name__}({0._changes!r})'.format(self)
+
+
+def snapshot(definition):
+    """``OrderedDict`` of scope to ``(digest, entries)`` for a computed definition.
+
+    ``entries`` is a callable returning the ``{kind: {key: value}}`` of the scope, only called when the
+    scope has to be compared entry by entry.  ``digest`` is that of the rendered configuration for a
+    service, the one recorded in :class:`nsct.state.State`, and None for a domain.
+    """
+    scopes = OrderedDict()
+    for serverName, server in iteritems(definition.servers):
+        for serviceType, service in iteritems(server.services):
+            scopes['servers/{}/{}'.format(serverName, serviceType)] = (service.digest(), service.snapshot)
+    for domainName, domain in iteritems(definition.domains):
+        scopes['domains/{}'.format(domainName)] = (None, domain.snapshot)
+    return scopes
+
+
+def _changes(scope, old, new):
+    for kind in list(new) + [k for k in old if k not in new]:
+        oldEntries = old.get(kind, {})
+        newEntries = new.get(kind, {})
+        for key in sorted(set(oldEntries) | set(newEntries)):
+            oldValue = oldEntries.get(key)
+            newValue = newEntries.get(key)
+            if oldValue != newValue:
+                yield Change(scope, kind, key, oldValue, newValue)
+
+
+def plan(old, new):
+    """The :class:`Plan` of the changes from the computed definition ``old`` to the computed definition ``new``.
+
+    Scopes are matched by name and entries by key, each with a dictionary lookup, and services whose
+    rendered configuration has the same digest in both are not compared any further.
+    """
+    oldScopes = snapshot(old)
+    newScopes = snapshot(new)
+
+    changes = []
+    for scope in list(newScopes) + [s for s in oldScopes if s not in newScopes]:
+        oldDigest, oldEntries = oldScopes.get(scope, (None, dict))
+        newDigest, newEntries = newScopes.get(scope, (None, dict))
+        if oldDigest is not None and oldDigest == newDigest:
+            continue
+        changes.extend(_changes(scope, oldEntries(), newEntries()))
+
+    logger.info('{} changes in {} scopes'.format(len(changes), len(set(change.scope for change in changes))))
+    return Plan(changes)
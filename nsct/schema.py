@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2018 by Neil Jarvis
+:licence: MIT, see LICENCE for more details
+"""
+from __future__ import absolute_import, unicode_literals, print_function
+
+from collections import OrderedDict
+
+from nsct._compat import iteritems
+
+
+class Key(object):
+    """A key of a :class:`Schema`, dotted (``ssh.host``) to reach into nested mappings.
+
+    ``itemType``, for keys whose value is a mapping, is the type every value of that mapping must have,
+    ``itemSource`` describing those values in errors.
+    """
+    def __init__(self, key, expectedType, required=True, default=None, itemType=None, itemSource=None):
+        self._key = key
+        self._expectedType = expectedType
+        self._required = required
+        self._default = default
+        self._itemType = itemType
+        self._itemSource = itemSource
+
+    @property
+    def key(self):
+        return self._key
+
+    def __repr__(self):
+        return '{0.__class__.__name__}({0._key!r})'.format(self)
+
+
+class Record(object):
+    """The values of a fragment validated by a :class:`Schema`, indexed by (dotted) key.
+
+    Fragments of values are only built when asked for, typically to report an error against one.
+    """
+    __slots__ = ('_values', '_sources', '_fragments')
+
+    def __init__(self):
+        self._values = {}
+        self._sources = {}
+        self._fragments = {}
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __contains__(self, key):
+        return self._values.get(key) is not None
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+    def fragment(self, key):
+        """The fragment of the value of ``key``, or None if the key was not present."""
+        if key not in self._fragments:
+            source = self._sources.get(key)
+            self._fragments[key] = source[0].subFragment(source[1]) if source else None
+        return self._fragments[key]
+
+    def items(self, key):
+        """``(name, value, fragment)`` for each item of the mapping value of ``key``."""
+        mapping = self._values.get(key)
+        if not mapping:
+            return []
+        parent = self.fragment(key)
+        return [(str(k), _scalarValue(v), parent.subFragment(k)) for k, v in iteritems(mapping)]
+
+    def __repr__(self):
+        return '{0.__class__.__name__}({0._values!r})'.format(self)
+
+
+def _scalarValue(yml):
+    return yml.scalarValue if hasattr(yml, 'scalarValue') else yml
+
+
+class Schema(object):
+    """A declarative description of a YAML mapping, compiled once into a tree of nested keys.
+
+    :meth:`validate` walks a fragment against the tree in a single pass, visiting each nested mapping
+    once however many keys are read from it, and checks each value against its expected type.  Error
+    messages are the same as those of :meth:`nsct.yaml.Fragment.getMappingValue`.
+    """
+    def __init__(self, *keys):
+        self._keys = keys
+        self._tree = OrderedDict()
+        for key in keys:
+            node = self._tree
+            path = key.key.split('.')
+            for part in path[:-1]:
+                node = node.setdefault(part, OrderedDict())
+                assert isinstance(node, OrderedDict), 'Key {} nested in a non-mapping key'.format(key.key)
+            node[path[-1]] = key
+
+    def validate(self, fragment):
+        assert fragment.ymlIsInstance(dict)
+        record = Record()
+        self._validate(self._tree, fragment, record, '')
+        return record
+
+    @staticmethod
+    def _required(node):
+        if isinstance(node, Key):
+            return node._required
+        return any(Schema._required(n) for n in node.values())
+
+    @staticmethod
+    def _defaults(node, record, prefix):
+        for name, child in iteritems(node):
+            if isinstance(child, Key):
+                record._values[prefix + name] = child._default
+            else:
+                Schema._defaults(child, record, prefix + name + '.')
+
+    def _validate(self, tree, fragment, record, prefix):
+        yml = fragment._yml
+        for name, node in iteritems(tree):
+            if name not in yml:
+                if self._required(node):
+                    fragment.raiseError('Missing required key \'{}\''.format(name))
+                if isinstance(node, Key):
+                    record._values[prefix + name] = node._default
+                else:
+                    self._defaults(node, record, prefix + name + '.')
+                continue
+
+            value = yml[name]
+            if isinstance(node, Key):
+                if not isinstance(value, node._expectedType):
+                    # Let the fragment report the error in its usual form
+                    fragment.getMappingValue(name, node._expectedType)
+                record._values[prefix + name] = _scalarValue(value)
+                record._sources[prefix + name] = (fragment, name)
+
+                if node._itemType is not None:
+                    for k, v in iteritems(value):
+                        if not isinstance(v, node._itemType):
+                            itemFragment = record.fragment(prefix + name).subFragment(k)
+                            itemFragment.getValue(node._itemType, source=node._itemSource)
+            else:
+                if not isinstance(value, dict):
+                    fragment.getMappingValue(name, dict)
+                self._validate(node, fragment.subFragment(name), record, prefix + name + '.')
+
+    def __repr__(self):
+        return '{0.__class__.__name__}({0._keys!r})'.format(self)
@@ -6,20 +6,73 @@
 from __future__ import absolute_import, unicode_literals, print_function
 
 import base64
+from collections import OrderedDict
+import hashlib
 import logging
-import paramiko
 from pathlib import Path
 
-from nsct._compat import string_types, integer_types, iteritems, itervalues
-from nsct.device import DeviceInterface
+from nsct._compat import string_types, integer_types, iteritems
+from nsct.address import formatIPv4, formatMAC
 from nsct.error import DefinitionError
+from nsct.schema import Schema, Key
+from nsct.sink import SSHSink
 from nsct.support import supportedServices
+from nsct.timing import timings
 from nsct.yaml import YAML_ipv4range, YAML_ipv4address, YAML_ipv6address
 
 logger = logging.getLogger(__name__)
 
+# Commands run once per server after all of its services have been generated, keyed by the process
+# acted upon and then by level.  Levels are in increasing order of disruption; when several services
+# request the same process the most disruptive level wins.
+postActionLevels = ['reload', 'restart']
+postActionCommands = {'dnsmasq': {'reload': 'killall -HUP dnsmasq',
+                                  'restart': '/etc/init.d/dnsmasq restart'},
+                      'docker-smokeping': {'restart': 'sudo systemctl restart docker-smokeping'}}
+
+
+class ServerService(object):
+    """Base class of all server services.
+
+    A service renders its configuration with :meth:`render` and pushes it to a server with
+    :meth:`generate`.  The digest of the rendered configuration is used to skip services whose
+    configuration has not changed since they were last generated.
+
+    :meth:`render` is a generator of pieces of the configuration, typically a line at a time, which
+    are handed as they come to the server's sink rather than built into one string first.
+    """
+    __slots__ = ()
+
+    def compute(self):
+        pass
+
+    def render(self):
+        raise NotImplementedError('{0.__class__.__name__}:render() method needs to be implemented'.format(self))
+
+    def digest(self):
+        h = hashlib.sha256(self.__class__.__name__.encode('utf-8'))
+        h.update(b'\0')
+        for piece in self.render():
+            h.update(piece.encode('utf-8'))
+        return h.hexdigest()
+
+    def snapshot(self):
+        """The entries the service configures, as ``{kind: {key: value}}`` with text keys and values.
+
+        Used by :mod:`nsct.plan` to say what generating the service would change.
+        """
+        return {}
+
+    def generate(self, server):
+        raise NotImplementedError('{0.__class__.__name__}:generate() method needs to be implemented'.format(self))
+
+    def __repr__(self):
+        return '{0.__class__.__name__}()'.format(self)
+
+
+class ServerIpv4DHCP(ServerService):
+    __slots__ = ('_interface', '_addressRange', '_leasetime', '_domain', '_staticAllocations')
 
-class ServerIpv4DHCP(object):
     def __init__(self, interface, addressRange, leasetime, domain):
         self._interface = interface
         self._addressRange = addressRange
@@ -34,294 +87,216 @@ class ServerIpv4DHCP(object):
         return self._addressRange
 
     def addStaticAllocation(self, mac, ipv4, host, domain):
+        """Serve ``ipv4`` to ``mac``, both ints."""
         self._staticAllocations[mac] = (ipv4, host, domain)
 
     def compute(self):
         self._domain.reserveAddressRange('ipv4', self._addressRange)
 
-    def generate(self, server):
-        raise NotImplementedError('{0.__class__.__name__}:generate() method needs to be implemented'.format(self))
+    def snapshot(self):
+        return {'dhcp-range': {self._interface: '{!s} leasetime {}'.format(self._addressRange, self._leasetime)},
+                'dhcp-statics': dict((formatMAC(mac), '{} {}'.format(formatIPv4(ipv4), host))
+                                     for mac, (ipv4, host, domain) in iteritems(self._staticAllocations))}
 
     def __repr__(self):
         return '{0.__class__.__name__}(addressRange={0._addressRange!s}, domain={0._domain!s}, ' \
             'static={0._staticAllocations!r})'.format(self)
 
 
+def _uciQuote(value):
+    return "'{}'".format(str(value).replace("'", "'\\''"))
+
+
 class ServerIpv4DHCP_dnsmasq_openwrt(ServerIpv4DHCP):
+    __slots__ = ()
+
+    # Delete every existing static host section by its real (-X) name, then apply the rendered
+    # change set, all inside a single uci batch.  Nothing is committed unless the batch succeeds.
+    UCI_SCRIPT_HEAD = '''{
+uci -q -X show dhcp | sed -n 's/^\\(dhcp\\.[^.=]*\\)=host$/delete \\1/p'
+cat <<'__NSCT_UCI_EOF__'
+'''
+    UCI_SCRIPT_TAIL = '''__NSCT_UCI_EOF__
+} | uci batch && uci commit dhcp || { uci revert dhcp; exit 1; }
+'''
+
+    def uciBatch(self):
+        start = int(self._addressRange.range.first - self._domain.ipv4Subnet.first)
+        limit = int(self._addressRange.range.last - self._addressRange.range.first)
+
+        yield 'set dhcp.{}.start={}'.format(self._interface, _uciQuote(start))
+        yield 'set dhcp.{}.limit={}'.format(self._interface, _uciQuote(limit))
+        yield 'set dhcp.{}.leasetime={}'.format(self._interface, _uciQuote(self._leasetime))
+        for mac, (ipv4, host, domain) in iteritems(self._staticAllocations):
+            yield 'add dhcp host'
+            yield 'set dhcp.@host[-1].ip={}'.format(_uciQuote(formatIPv4(ipv4)))
+            yield 'set dhcp.@host[-1].mac={}'.format(_uciQuote(formatMAC(mac)))
+            yield 'set dhcp.@host[-1].name={}'.format(_uciQuote(host))
+
+    def render(self):
+        yield self.UCI_SCRIPT_HEAD
+        for command in self.uciBatch():
+            yield command + '\n'
+        yield self.UCI_SCRIPT_TAIL
+
     def generate(self, server):
         logger.info('Generating DNSMASQ(OpenWrt) config for IPv4 service on {}'.format(server))
 
-        # Fetch DHCP config from server, modify and write back
-        try:
-            openwrtSSH = paramiko.SSHClient()
-            openwrtSSH.get_host_keys().add(server.ssh.host, server.ssh.hostkeyType, paramiko.RSAKey(data=server.ssh.hostkeyValue))
-            openwrtSSH.connect(server.ssh.host, port=server.ssh.port, username=server.ssh.user,
-                               key_filename=server.ssh.identity, look_for_keys=False)
-
-            try:
-                def exec_command(cmd):
-                    chan = openwrtSSH.get_transport().open_session()
-                    chan.settimeout(None)
-                    chan.exec_command(cmd)
-                    rc = chan.recv_exit_status()
-                    logger.debug('SSH cmd [{}] returned {}'.format(cmd, rc))
-
-                logger.info('Deleting exising static IPv4 DHCP hosts on {}'.format(server))
-                exec_command('/bin/ash -c "while uci -q delete dhcp.@host[0]; do :; done"')
-
-                logger.info('Configuring IPv4 DHCP service on interface {} on {}'.format(self._interface, server))
-                start = int(self._addressRange.range.first - self._domain.ipv4Subnet.first)
-                limit = int(self._addressRange.range.last - self._addressRange.range.first)
-
-                exec_command('uci set dhcp.{}.start={}'.format(self._interface, start))
-                exec_command('uci set dhcp.{}.limit={}'.format(self._interface, limit))
-                exec_command('uci set dhcp.{}.leasetime={}'.format(self._interface, self._leasetime))
-
-                logger.info('Defining {} static IPv4 DHCP hosts on {}'.format(len(self._staticAllocations), server))
-                for mac, (ipv4, host, domain) in iteritems(self._staticAllocations):
-                    exec_command('uci add dhcp host')
-                    exec_command('uci set dhcp.@host[-1].ip={}'.format(ipv4))
-                    exec_command('uci set dhcp.@host[-1].mac={}'.format(mac))
-                    exec_command('uci set dhcp.@host[-1].name={}'.format(host))
-                exec_command('uci commit dhcp')
-
-            except Exception as e:
-                logger.error('Failed to configure IPv4 DHCP service on {}: {}'.format(server, e))
-                exec_command('uci revert dhcp')
-                raise
-            else:
-                logger.info('Restarting dnsmasq service on {}'.format(server))
-                exec_command('/etc/init.d/dnsmasq restart')
+        # Replace the DHCP config on the server in a single uci batch transaction, which reverts itself on failure
+        logger.info('Configuring IPv4 DHCP service on interface {} with {} static hosts on {}'.
+                    format(self._interface, len(self._staticAllocations), server))
+        rc = server.sink.execCommand('/bin/ash -s', stdin=self.render())
+        if rc != 0:
+            raise RuntimeError('uci batch returned {}'.format(rc))
 
-        except Exception as e:
-            raise
+        server.requestPostAction('dnsmasq', 'restart')
 
-        finally:
-            try:
-                openwrtSSH.close()
-            except Exception:
-                pass
 
+class ServerDNS(ServerService):
+    __slots__ = ('_domains',)
 
-class ServerDNS(object):
     def __init__(self, domains):
         self._domains = domains
 
-    def compute(self):
-        pass
-
-    def generate(self, server):
-        raise NotImplementedError('{0.__class__.__name__}:generate() method needs to be implemented'.format(self))
-
-    def __repr__(self):
-        return '{0.__class__.__name__}()'.format(self)
+    def snapshot(self):
+        hosts = OrderedDict()
+        for domain in self._domains:
+            for version in ('ipv4', 'ipv6'):
+                for offset, deviceInterface in domain.interfaceAllocations(version):
+                    hosts.setdefault('{}.{}'.format(deviceInterface.hostname, domain), []).\
+                        append(domain.formatAddress(version, offset))
+        return {'hosts': dict((host, ' '.join(addresses)) for host, addresses in iteritems(hosts))}
 
 
 class ServerDNS_dnsmasq_openwrt(ServerDNS):
-    def generate(self, server):
-        logger.info('Generating DNSMASQ(OpenWrt) config for DNS service on {}'.format(server))
+    __slots__ = ()
+
+    HOSTS_HEAD = '127.0.0.1\tlocalhost\n' \
+        '::1\tlocalhost ip6-localhost ip6-loopback\n' \
+        'ff02::1\tip6-allnodes\n' \
+        'ff02::2\tip6-allrouters\n'
 
-        hosts = ['127.0.0.1\tlocalhost', '::1\tlocalhost ip6-localhost ip6-loopback',
-                 'ff02::1\tip6-allnodes', 'ff02::2\tip6-allrouters']
+    def render(self):
+        yield self.HOSTS_HEAD
 
         for domain in self._domains:
-            for offset, deviceInterface in iteritems(domain._ipv4Allocations):
-                if isinstance(deviceInterface, DeviceInterface):
-                    a = domain._ipv4Subnet[offset]
-                    hosts.append('{}\t{}.{}'.format(a, deviceInterface.hostname, domain))
-            for offset, deviceInterface in iteritems(domain._ipv6Allocations):
-                if isinstance(deviceInterface, DeviceInterface):
-                    a = domain._ipv6Subnet[offset]
-                    hosts.append('{}\t{}.{}'.format(a, deviceInterface.hostname, domain))
-        try:
-            openwrtSSH = paramiko.SSHClient()
-            openwrtSSH.get_host_keys().add(server.ssh.host, server.ssh.hostkeyType, paramiko.RSAKey(data=server.ssh.hostkeyValue))
-            openwrtSSH.connect(server.ssh.host, port=server.ssh.port, username=server.ssh.user,
-                               key_filename=server.ssh.identity, look_for_keys=False)
+            for version in ('ipv4', 'ipv6'):
+                for offset, deviceInterface in domain.interfaceAllocations(version):
+                    yield '{}\t{}.{}\n'.format(domain.formatAddress(version, offset), deviceInterface.hostname, domain)
 
-            try:
-                def exec_command(cmd):
-                    chan = openwrtSSH.get_transport().open_session()
-                    chan.settimeout(None)
-                    chan.exec_command(cmd)
-                    rc = chan.recv_exit_status()
-                    logger.debug('SSH cmd [{}] returned {}'.format(cmd, rc))
-
-                openwrtSFTP = paramiko.SFTPClient.from_transport(openwrtSSH.get_transport())
-
-                logger.info('Creating {} entries in /etc/hosts {}'.format(len(hosts), server))
-                with openwrtSFTP.open('/etc/hosts', 'w') as f:
-                    f.write('\n'.join(hosts))
-                    f.write('\n')
-            except Exception as e:
-                logger.error('Failed to configure /etc/hosts on {}: {}'.format(server, e))
-                raise
-            else:
-                logger.info('Restarting IPv4 dnsmasq service on {}'.format(server))
-                exec_command('/etc/init.d/dnsmasq restart')
-            finally:
-                try:
-                    openwrtSFTP.close()
-                except Exception:
-                    pass
+    def generate(self, server):
+        logger.info('Generating DNSMASQ(OpenWrt) config for DNS service on {}'.format(server))
 
+        try:
+            logger.info('Creating /etc/hosts on {}'.format(server))
+            server.sink.writeFile('/etc/hosts', self.render())
         except Exception as e:
+            logger.error('Failed to configure /etc/hosts on {}: {}'.format(server, e))
             raise
-        finally:
-            try:
-                openwrtSSH.close()
-            except Exception:
-                pass
+        else:
+            # dnsmasq re-reads /etc/hosts on SIGHUP, no restart needed
+            server.requestPostAction('dnsmasq', 'reload')
 
 
-class ServerEthers(object):
+class ServerEthers(ServerService):
+    __slots__ = ('_macs',)
+
     def __init__(self, macs):
         self._macs = macs
 
-    def compute(self):
-        pass
+    def snapshot(self):
+        return {'ethers': dict((formatMAC(mac), deviceInterface.hostname) for mac, deviceInterface in iteritems(self._macs))}
 
-    def generate(self, server):
-        raise NotImplementedError('{0.__class__.__name__}:generate() method needs to be implemented'.format(self))
 
-    def __repr__(self):
-        return '{0.__class__.__name__}()'.format(self)
+class ServerEthers_dnsmasq_openwrt(ServerEthers):
+    __slots__ = ()
 
+    def render(self):
+        for mac, deviceInterface in iteritems(self._macs):
+            yield '{} {}\n'.format(formatMAC(mac), deviceInterface.hostname)
 
-class ServerEthers_dnsmasq_openwrt(ServerEthers):
     def generate(self, server):
         logger.info('Generating DNSMASQ(OpenWrt) config for ethers service on {}'.format(server))
 
         try:
-            openwrtSSH = paramiko.SSHClient()
-            openwrtSSH.get_host_keys().add(server.ssh.host, server.ssh.hostkeyType, paramiko.RSAKey(data=server.ssh.hostkeyValue))
-            openwrtSSH.connect(server.ssh.host, port=server.ssh.port, username=server.ssh.user,
-                               key_filename=server.ssh.identity, look_for_keys=False)
-
-            try:
-                def exec_command(cmd):
-                    chan = openwrtSSH.get_transport().open_session()
-                    chan.settimeout(None)
-                    chan.exec_command(cmd)
-                    rc = chan.recv_exit_status()
-                    logger.debug('SSH cmd [{}] returned {}'.format(cmd, rc))
-
-                openwrtSFTP = paramiko.SFTPClient.from_transport(openwrtSSH.get_transport())
-
-                logger.info('Creating {} entries in /etc/ethers on {}'.format(len(self._macs), server))
-                with openwrtSFTP.open('/etc/ethers', 'w') as f:
-                    for mac, deviceInterface in iteritems(self._macs):
-                        f.write('{} {}\n'.format(mac, deviceInterface.hostname))
-            except Exception as e:
-                logger.error('Failed to configure /etc/ethers on {}: {}'.format(server, e))
-                raise
-            else:
-                logger.info('Restarting IPv4 dnsmasq service on {}'.format(server))
-                exec_command('/etc/init.d/dnsmasq restart')
-            finally:
-                try:
-                    openwrtSFTP.close()
-                except Exception:
-                    pass
-
+            logger.info('Creating {} entries in /etc/ethers on {}'.format(len(self._macs), server))
+            server.sink.writeFile('/etc/ethers', self.render())
         except Exception as e:
+            logger.error('Failed to configure /etc/ethers on {}: {}'.format(server, e))
             raise
-        finally:
-            try:
-                openwrtSSH.close()
-            except Exception:
-                pass
+        else:
+            # dnsmasq re-reads /etc/ethers on SIGHUP, no restart needed
+            server.requestPostAction('dnsmasq', 'reload')
 
 
-class ServerSmokeping(object):
+class ServerSmokeping(ServerService):
+    __slots__ = ('_configName', '_domains')
+
     def __init__(self, configName, domains):
         self._configName = configName
         self._domains = domains
 
-    def compute(self):
-        pass
+    def digest(self):
+        # Moving the config file is a change too
+        h = hashlib.sha256(super(ServerSmokeping, self).digest().encode('utf-8'))
+        h.update(self._configName.encode('utf-8'))
+        return h.hexdigest()
 
-    def generate(self, server):
-        raise NotImplementedError('{0.__class__.__name__}:generate() method needs to be implemented'.format(self))
-
-    def __repr__(self):
-        return '{0.__class__.__name__}()'.format(self)
+    def snapshot(self):
+        targets = {}
+        for domain in self._domains:
+            for offset, deviceInterface in domain.interfaceAllocations('ipv4'):
+                targets['{}.{}'.format(deviceInterface.hostname, domain)] = domain.formatAddress('ipv4', offset)
+        return {'config': {'path': self._configName}, 'targets': targets}
 
 
 class ServerSmokeping_docker(ServerSmokeping):
-    def generate(self, server):
-        logger.info('Generating Docker config for smokeping service on {}'.format(server))
+    __slots__ = ()
 
-        try:
-            openwrtSSH = paramiko.SSHClient()
-            openwrtSSH.get_host_keys().add(server.ssh.host, server.ssh.hostkeyType, paramiko.RSAKey(data=server.ssh.hostkeyValue))
-            openwrtSSH.connect(server.ssh.host, port=server.ssh.port, username=server.ssh.user,
-                               key_filename=server.ssh.identity, look_for_keys=False)
+    def render(self):
+        def _smokepingTarget(*args):
+            return '.'.join([str(a) for a in args]).replace('.', '_').replace('-', '_')
 
-            try:
-                def exec_command(cmd):
-                    chan = openwrtSSH.get_transport().open_session()
-                    chan.settimeout(None)
-                    chan.exec_command(cmd)
-                    rc = chan.recv_exit_status()
-                    logger.debug('SSH cmd [{}] returned {}'.format(cmd, rc))
-
-                openwrtSFTP = paramiko.SFTPClient.from_transport(openwrtSSH.get_transport())
-
-                logger.info('Creating {} on {}'.format(self._configName, server))
-                with openwrtSFTP.open(self._configName, 'w') as f:
-                    def _smokepingTarget(*args):
-                        return '.'.join([str(a) for a in args]).replace('.', '_').replace('-', '_')
-
-                    f.write('+ Devices\n\n')
-                    f.write('menu = Devices\n')
-                    f.write('title = Devices\n')
-                    f.write('\n')
-
-                    for domain in self._domains:
-                        if len(domain._ipv4Allocations) == 0:
-                            continue
+        yield '+ Devices\n\nmenu = Devices\ntitle = Devices\n\n'
 
-                        f.write('++ {}\n\n'.format(_smokepingTarget(domain)))
-                        f.write('menu = {}\n'.format(domain))
-                        f.write('title = Domain {}\n'.format(domain))
-                        f.write('host = {}\n'.format(' '.join(['/Devices/{}/{}'.
-                                                               format(_smokepingTarget(domain),
-                                                                      _smokepingTarget(h.hostname, domain))
-                                                               for h in itervalues(domain._ipv4Allocations)
-                                                               if isinstance(h, DeviceInterface)])))
-                        f.write('\n')
-
-                        for offset, deviceInterface in iteritems(domain._ipv4Allocations):
-                            if isinstance(deviceInterface, DeviceInterface):
-                                a = domain._ipv4Subnet[offset]
-                                f.write('+++ {}\n\n'.format(_smokepingTarget(deviceInterface.hostname, domain)))
-                                f.write('menu = {}\n'.format(deviceInterface.hostname))
-                                f.write('title = {}.{}\n'.format(deviceInterface.hostname, domain))
-                                f.write('host = {}\n'.format(a))
-                                f.write('\n')
-            except Exception as e:
-                logger.error('Failed to configure {} on {}: {}'.format(self._configName, server, e))
-                raise
-            else:
-                logger.info('Restarting smokeping service on {}'.format(server))
-                exec_command('sudo systemctl restart docker-smokeping')
-            finally:
-                try:
-                    openwrtSFTP.close()
-                except Exception:
-                    pass
+        for domain in self._domains:
+            interfaces = list(domain.interfaceAllocations('ipv4'))
+            if len(interfaces) == 0:
+                continue
+
+            yield '++ {}\n\n'.format(_smokepingTarget(domain))
+            yield 'menu = {}\n'.format(domain)
+            yield 'title = Domain {}\n'.format(domain)
+            yield 'host = {}\n'.format(' '.join(['/Devices/{}/{}'.
+                                                 format(_smokepingTarget(domain),
+                                                        _smokepingTarget(h.hostname, domain))
+                                                 for o, h in interfaces]))
+            yield '\n'
+
+            for offset, deviceInterface in interfaces:
+                a = domain.formatAddress('ipv4', offset)
+                yield '+++ {}\n\n'.format(_smokepingTarget(deviceInterface.hostname, domain))
+                yield 'menu = {}\n'.format(deviceInterface.hostname)
+                yield 'title = {}.{}\n'.format(deviceInterface.hostname, domain)
+                yield 'host = {}\n'.format(a)
+                yield '\n'
 
+    def generate(self, server):
+        logger.info('Generating Docker config for smokeping service on {}'.format(server))
+
+        try:
+            logger.info('Creating {} on {}'.format(self._configName, server))
+            server.sink.writeFile(self._configName, self.render())
         except Exception as e:
+            logger.error('Failed to configure {} on {}: {}'.format(self._configName, server, e))
             raise
-        finally:
-            try:
-                openwrtSSH.close()
-            except Exception:
-                pass
+        else:
+            server.requestPostAction('docker-smokeping', 'restart')
 
 
 class ServerSSH(object):
+    __slots__ = ('_host', '_port', '_user', '_identity', '_hostkeyType', '_hostkeyValue')
+
     def __init__(self, host, port, user, identity, hostkeyType, hostkeyValue):
         self._host = host
         self._port = port
@@ -346,6 +321,11 @@ class ServerSSH(object):
     def identity(self):
         return self._identity
 
+    @property
+    def target(self):
+        """``host:port``, naming the box the server's configuration is deployed to."""
+        return '{}:{}'.format(self._host, self._port)
+
     @property
     def hostkeyType(self):
         return self._hostkeyType
@@ -355,137 +335,295 @@ class ServerSSH(object):
         return base64.b64decode(self._hostkeyValue)
 
 
+class ServerResult(object):
+    def __init__(self, name):
+        self._name = name
+        self._succeeded = []
+        self._skipped = []
+        self._failed = []
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def succeeded(self):
+        return self._succeeded
+
+    @property
+    def skipped(self):
+        return self._skipped
+
+    @property
+    def failed(self):
+        return self._failed
+
+    @property
+    def ok(self):
+        return len(self._failed) == 0
+
+    def addSuccess(self, action):
+        self._succeeded.append(action)
+
+    def addSkipped(self, action):
+        self._skipped.append(action)
+
+    def addError(self, action, error):
+        if action in self._succeeded:
+            self._succeeded.remove(action)
+        self._failed.append((action, error))
+
+    def __str__(self):
+        parts = []
+        if self._failed:
+            parts.append('FAILED {}'.format(', '.join(['{} ({})'.format(a, e) for a, e in self._failed])))
+        if self._succeeded:
+            parts.append('ok {}'.format(', '.join(self._succeeded)))
+        if self._skipped:
+            parts.append('unchanged {}'.format(', '.join(self._skipped)))
+        return '{}: {}'.format(self._name, '; '.join(parts) if parts else 'nothing to do')
+
+    def __repr__(self):
+        return '{0.__class__.__name__}({0._name!r}, succeeded={0._succeeded!r}, skipped={0._skipped!r}, ' \
+            'failed={0._failed!r})'.format(self)
+
+
 class Server(object):
-    def __init__(self, name, fragment, definition, ssh, services):
+    __slots__ = ('_name', '_digest', '_definition', '_ssh', '_services', '_sink', '_action', '_postActions')
+
+    def __init__(self, name, digest, definition, ssh, services):
         self._name = name
-        self._fragment = fragment
+        self._digest = digest
         self._definition = definition
         self._ssh = ssh
         self._services = services
+        self._sink = None
+        self._action = None
+        self._postActions = OrderedDict()
+
+    @property
+    def digest(self):
+        """SHA-256 of the server's definition."""
+        return self._digest
 
     @property
     def ssh(self):
         return self._ssh
 
+    @property
+    def services(self):
+        """The server's services, by service type."""
+        return self._services
+
+    @property
+    def sink(self):
+        """Where generated configuration goes; an :class:`nsct.sink.SSHSink` to the server unless set."""
+        if self._sink is None:
+            self._sink = SSHSink(self)
+        return self._sink
+
+    @sink.setter
+    def sink(self, value):
+        self.close()
+        self._sink = value
+
+    def close(self):
+        if self._sink is not None:
+            self._sink.close()
+            self._sink = None
+
+    def requestPostAction(self, process, level):
+        """Ask for ``level`` (e.g. 'reload' or 'restart') of ``process`` once all services are generated."""
+        assert level in postActionCommands[process]
+
+        current, requesters = self._postActions.get(process, (None, []))
+        if current is None or postActionLevels.index(level) > postActionLevels.index(current):
+            current = level
+        if self._action not in requesters:
+            requesters.append(self._action)
+        self._postActions[process] = (current, requesters)
+
+    def _runPostActions(self, result):
+        for process, (level, requesters) in iteritems(self._postActions):
+            command = postActionCommands[process][level]
+            logger.info('Running {} of {} on {} (requested by {})'.format(level, process, self, ', '.join(requesters)))
+            try:
+                with timings.span('generate.post-action', server=self, process=process, level=level):
+                    rc = self.sink.execCommand(command)
+                if rc != 0:
+                    raise RuntimeError('{} of {} returned {}'.format(level, process, rc))
+            except Exception as e:
+                logger.error('Failed to {} {} on {}: {}'.format(level, process, self, e))
+                for action in requesters:
+                    result.addError(action, e)
+
     def __str__(self):
         return self._name
 
     def __repr__(self):
-        return '{0.__class__.__name__}({0._name!r}, host={0._host!r}, sshUser={0._sshUser!r}, ' \
-            'sshIdentity={0._sshIdentity!r}, services={0._services!r})'.format(self)
+        return '{0.__class__.__name__}({0._name!r}, host={0._ssh.host!r}, sshUser={0._ssh.user!r}, ' \
+            'sshIdentity={0._ssh.identity!r}, services={0._services!r})'.format(self)
 
     def compute(self):
         for serviceType, service in iteritems(self._services):
             service.compute()
 
-    def generate(self, action):
-        if action in self._services:
-            self._services[action].generate(self)
+    def generate(self, actions, state=None, force=False):
+        """Generate each of ``actions`` in order, returning a :class:`ServerResult`.
+
+        A failing service is recorded and does not stop the remaining services on this server.  Restarts
+        and reloads requested by the services are de-duplicated and run once, after all of them.  When
+        ``state`` is given, services whose rendered configuration matches the digest recorded there are
+        skipped unless ``force`` is set, and the digests of successfully generated services are recorded.
+        Digests recorded for a different SSH host or port do not count, so a server re-pointed at a new
+        box is configured in full.
+        """
+        result = ServerResult(self._name)
+        digests = {}
+        self._postActions = OrderedDict()
+        for action in actions:
+            if action in self._services:
+                service = self._services[action]
+                self._action = action
+                try:
+                    if state is not None:
+                        with timings.span('digest', server=self, service=action):
+                            digests[action] = service.digest()
+                        if not force and state.digest(self, action, self._ssh.target) == digests[action]:
+                            logger.info('Skipping unchanged {} on {}'.format(action, self))
+                            result.addSkipped(action)
+                            continue
+                    with timings.span('generate.service', server=self, service=action):
+                        service.generate(self)
+                except Exception as e:
+                    logger.error('Failed to generate {} on {}: {}'.format(action, self, e))
+                    result.addError(action, e)
+                else:
+                    result.addSuccess(action)
+        self._action = None
+
+        self._runPostActions(result)
+        self._postActions = OrderedDict()
+
+        if state is not None:
+            for action in result.succeeded:
+                state.setDigest(self, action, digests[action], self._ssh.target)
+
+        return result
 
     @staticmethod
     def parse(name, fragment, definition):
-        logger.debug('Parsing server at {!r}'.format(fragment))
+        logger.debug('Parsing server at %r', fragment)
 
-        sshHost = fragment.getMappingValue('ssh.host', (YAML_ipv4address, YAML_ipv6address), required=True)
-        sshPort = fragment.getMappingValue('ssh.port', integer_types, required=False, default=22)
-        sshUser = fragment.getMappingValue('ssh.user', string_types, required=True)
-        sshIdentity, sshIdentityFragment = fragment.getMappingValue('ssh.identity', string_types, required=True,
-                                                                    returnValueFragment=True)
+        server = serverSchema.validate(fragment)
+
+        sshIdentity = server['ssh.identity']
         sshIdentityPath = Path(sshIdentity).expanduser().resolve()
         try:
             if not sshIdentityPath.is_file():
-                sshIdentityFragment.raiseError('ssh.identity \'{}\' (path {}) is not a file'.format(sshIdentity,
-                                                                                                    sshIdentityPath))
+                server.fragment('ssh.identity').raiseError('ssh.identity \'{}\' (path {}) is not a file'.
+                                                           format(sshIdentity, sshIdentityPath))
             with sshIdentityPath.open():
                 pass
         except DefinitionError:
             raise
         except Exception as e:
-            sshIdentityFragment.raiseError('ssh.identity \'{}\' (path: {}) cannot be opened for reading: {}'.
-                                           format(sshIdentity, sshIdentityPath, e))
+            server.fragment('ssh.identity').raiseError('ssh.identity \'{}\' (path: {}) cannot be opened for reading: {}'.
+                                                       format(sshIdentity, sshIdentityPath, e))
         sshIdentity = str(sshIdentityPath)
-        sshHostkey, sshHostkeyFragment = fragment.getMappingValue('ssh.host-key', string_types, required=True,
-                                                                  returnValueFragment=True)
-        sshHostkeyType, sshHostkeyValue = sshHostkey.split(' ', 1)
+        sshHostkeyType, sshHostkeyValue = server['ssh.host-key'].split(' ', 1)
+
+        def _parseService(serviceType):
+            serviceFragment = server.fragment('services.%s' % serviceType)
+            serviceTypeType = serviceTypeSchema.validate(serviceFragment)
+            if serviceTypeType['type'] not in supportedServices[serviceType]:
+                serviceTypeType.fragment('type').raiseError('Unsupported service \'{}\' type \'{}\'.  Supported types: {}'.
+                                                            format(serviceType, serviceTypeType['type'],
+                                                                   ', '.join(supportedServices[serviceType])))
+            service = serviceSchemas[serviceType].validate(serviceFragment)
+            cls = globals()['Server{}_{}'.format(serviceClassNames[serviceType],
+                                                 serviceTypeType['type'].replace('.', '_').replace('-', '_'))]
+            serviceInstance = None
+
+            if serviceType == 'ipv4-dhcp':
+                dhcpIpv4Domain = service['domain']
+                if dhcpIpv4Domain in definition.failed('domains'):
+                    # Already reported in the domain itself
+                    return None
+                if dhcpIpv4Domain not in definition.domains:
+                    service.fragment('domain').raiseError('domain \'{}\' is not a known domain'.format(dhcpIpv4Domain))
+                else:
+                    dhcpIpv4Domain = definition.domains[dhcpIpv4Domain]
 
-        services = dict()
-        for serviceType in supportedServices.keys():
-            service, serviceFragment = fragment.getMappingValue('services.%s' % serviceType, dict,
-                                                                required=False, returnValueFragment=True)
-            if service:
-                serviceInstance = None
-                serviceTypeType, serviceTypeTypeFragment = serviceFragment.getMappingValue('type', string_types,
-                                                                                           required=True, returnValueFragment=True)
-                if serviceTypeType not in supportedServices[serviceType]:
-                    serviceTypeTypeFragment.raiseError('Unsupported service \'{}\' type \'{}\'.  Supported types: {}'.
-                                                       format(serviceType, serviceTypeType,
-                                                              ', '.join(supportedServices[serviceType])))
-                if serviceType == 'ipv4-dhcp':
-                    dhcpIpv4Interface = serviceFragment.getMappingValue('interface', string_types, required=True)
-                    dhcpIpv4Leasetime = serviceFragment.getMappingValue('leasetime', string_types, required=False, default='12h')
-                    dhcpIpv4Domain, dhcpIpv4DomainFragment = serviceFragment.getMappingValue('domain', string_types,
-                                                                                             required=True,
-                                                                                             returnValueFragment=True)
-                    if dhcpIpv4Domain not in definition.domains:
-                        dhcpIpv4DomainFragment.raiseError('domain \'{}\' is not a known domain'.format(dhcpIpv4Domain))
-                    else:
-                        dhcpIpv4Domain = definition.domains[dhcpIpv4Domain]
-
-                    dhcpIpv4Range, dhcpIpv4RangeFragment = serviceFragment.getMappingValue('range', YAML_ipv4range,
-                                                                                           required=True,
-                                                                                           returnValueFragment=True)
-                    if dhcpIpv4Domain.ipv4Subnet:
-                        if dhcpIpv4Range.range.first not in dhcpIpv4Domain.ipv4Subnet:
-                            dhcpIpv4RangeFragment.raiseError('Range start not inside domain\'s ipv4 subnet {}'.
+                dhcpIpv4Range = service['range']
+                if dhcpIpv4Domain.ipv4Subnet:
+                    if dhcpIpv4Range.range[0] not in dhcpIpv4Domain.ipv4Subnet:
+                        service.fragment('range').raiseError('Range start not inside domain\'s ipv4 subnet {}'.
                                                              format(dhcpIpv4Domain.ipv4Subnet))
-                        if dhcpIpv4Range.range.last not in dhcpIpv4Domain.ipv4Subnet:
-                            dhcpIpv4RangeFragment.raiseError('Range stop not inside domain\'s ipv4 subnet {}'.
+                    if dhcpIpv4Range.range[-1] not in dhcpIpv4Domain.ipv4Subnet:
+                        service.fragment('range').raiseError('Range stop not inside domain\'s ipv4 subnet {}'.
                                                              format(dhcpIpv4Domain.ipv4Subnet))
-                    else:
-                        dhcpIpv4RangeFragment.raiseError('No ipv4 subnet defined in domain')
+                else:
+                    service.fragment('range').raiseError('No ipv4 subnet defined in domain')
+
+                serviceInstance = cls(service['interface'], dhcpIpv4Range, service['leasetime'], dhcpIpv4Domain)
 
-                    cls = globals()['ServerIpv4DHCP_{}'.format(serviceTypeType.replace('.', '_').replace('-', '_'))]
-                    serviceInstance = cls(dhcpIpv4Interface, dhcpIpv4Range, dhcpIpv4Leasetime, dhcpIpv4Domain)
+            if serviceType in ('dns', 'smokeping'):
+                domains = []
+                for i, domainFragment in service.fragment('domains').getElements():
+                    domain = domainFragment.getValue(string_types, source='for {} {} domain'.format(name, serviceType))
+                    if domain in definition.failed('domains'):
+                        continue
+                    if domain not in definition.domains:
+                        domainFragment.raiseError('Unknown domain \'{}\''.format(domain))
+                    domains.append(definition.domains[domain])
 
                 if serviceType == 'dns':
-                    dnsDomains, dnsDomainsFragment = serviceFragment.getMappingValue('domains', list,
-                                                                                     required=True,
-                                                                                     returnValueFragment=True)
-                    dnsDomains = []
-                    for i, dnsDomainFragment in dnsDomainsFragment.getElements():
-                        dnsDomain = dnsDomainFragment.getValue(string_types, source='for {} dns domain')
-                        if dnsDomain not in definition.domains:
-                            dnsDomainFragment.raiseError('Unknown domain \'{}\''.format(dnsDomain))
-                        dnsDomains.append(definition.domains[dnsDomain])
-
-                    cls = globals()['ServerDNS_{}'.format(serviceTypeType.replace('.', '_').replace('-', '_'))]
-                    serviceInstance = cls(dnsDomains)
-
-                if serviceType == 'ethers':
-                    cls = globals()['ServerEthers_{}'.format(serviceTypeType.replace('.', '_').replace('-', '_'))]
-                    serviceInstance = cls(definition.macs)
-
-                if serviceType == 'smokeping':
-                    configName = serviceFragment.getMappingValue('config-name', string_types, required=True)
-                    smokepingDomains, smokepingDomainsFragment = serviceFragment.getMappingValue('domains', list,
-                                                                                     required=True,
-                                                                                     returnValueFragment=True)
-                    smokepingDomains = []
-                    for i, smokepingDomainFragment in smokepingDomainsFragment.getElements():
-                        smokepingDomain = smokepingDomainFragment.getValue(string_types, source='for {} smokeping domain')
-                        if smokepingDomain not in definition.domains:
-                            smokepingDomainFragment.raiseError('Unknown domain \'{}\''.format(smokepingDomain))
-                        smokepingDomains.append(definition.domains[smokepingDomain])
-
-                    cls = globals()['ServerSmokeping_{}'.format(serviceTypeType.replace('.', '_').replace('-', '_'))]
-                    serviceInstance = cls(configName, smokepingDomains)
+                    serviceInstance = cls(domains)
+                else:
+                    serviceInstance = cls(service['config-name'], domains)
+
+            if serviceType == 'ethers':
+                serviceInstance = cls(definition.macs)
+
+            if not serviceInstance:
+                logger.warning('Service {} does not have a valid service {}'.format(name, serviceType))
+            return serviceInstance
+
+        services = dict()
+        for serviceType in supportedServices.keys():
+            if server['services.%s' % serviceType]:
+                serviceInstance = definition.errors.attempt(_parseService, serviceType)
 
                 # Record service
                 if serviceInstance:
                     services[serviceType] = serviceInstance
-                else:
-                    logger.warning('Service {} does not have a valid service {}'.format(name, serviceType))
 
-        return Server(name, fragment, definition,
-                      ServerSSH(sshHost, sshPort, sshUser, sshIdentity, sshHostkeyType, sshHostkeyValue),
+        return Server(name, fragment.digest(), definition,
+                      ServerSSH(server['ssh.host'], server['ssh.port'], server['ssh.user'], sshIdentity,
+                                sshHostkeyType, sshHostkeyValue),
                       services)
+
+
+serverSchema = Schema(Key('ssh.host', (YAML_ipv4address, YAML_ipv6address)),
+                      Key('ssh.port', integer_types, required=False, default=22),
+                      Key('ssh.user', string_types),
+                      Key('ssh.identity', string_types),
+                      Key('ssh.host-key', string_types),
+                      *[Key('services.%s' % serviceType, dict, required=False) for serviceType in supportedServices])
+
+serviceTypeSchema = Schema(Key('type', string_types))
+
+serviceSchemas = {'ipv4-dhcp': Schema(Key('interface', string_types),
+                                      Key('leasetime', string_types, required=False, default='12h'),
+                                      Key('domain', string_types),
+                                      Key('range', YAML_ipv4range)),
+                  'dns': Schema(Key('domains', list)),
+                  'ethers': Schema(),
+                  'smokeping': Schema(Key('config-name', string_types),
+                                      Key('domains', list))}
+
+serviceClassNames = {'ipv4-dhcp': 'Ipv4DHCP',
+                     'dns': 'DNS',
+                     'ethers': 'Ethers',
+                     'smokeping': 'Smokeping'}
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2018 by Neil Jarvis
+:licence: MIT, see LICENCE for more details
+"""
+from __future__ import absolute_import, unicode_literals, print_function
+
+import io
+import logging
+import os
+import posixpath
+from threading import Lock
+
+from nsct._compat import string_types
+from nsct.timing import timings
+
+logger = logging.getLogger(__name__)
+
+# paramiko, and the cryptography it brings in, take longer to import than the rest of nsct put together, so
+# it is only imported once a connection is made; see _paramiko()
+paramiko = None
+
+
+def _paramiko():
+    global paramiko
+    if paramiko is None:
+        import paramiko as module
+        paramiko = module
+    return paramiko
+
+
+# Size of the chunks rendered configuration is written in, and of the SFTP write buffer
+CHUNK_SIZE = 256 * 1024
+
+# Seconds to wait for a server to accept an SSH connection
+CONNECT_TIMEOUT = 30
+
+
+def encodedChunks(data, size=CHUNK_SIZE):
+    """Yield ``data``, a string or an iterable of strings, as UTF-8 chunks of about ``size`` bytes.
+
+    Small pieces are coalesced so that a renderer can yield a line at a time without each line
+    becoming a write of its own, and large ones are passed on whole.
+    """
+    if isinstance(data, string_types):
+        data = (data,)
+
+    pending = []
+    length = 0
+    for piece in data:
+        piece = piece.encode('utf-8')
+        pending.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield b''.join(pending)
+            pending = []
+            length = 0
+    if pending:
+        yield b''.join(pending)
+
+
+def stagingPath(path, join=posixpath.join, split=posixpath.split):
+    """The temporary sibling of ``path`` a file is written to before being renamed over ``path``."""
+    directory, name = split(path)
+    return join(directory, '.{}.nsct-tmp'.format(name))
+
+
+class Sink(object):
+    """Destination for the configuration generated for a server.
+
+    Services write whole files with :meth:`writeFile` and run commands with :meth:`execCommand`,
+    without knowing whether they are talking to the server itself or to something standing in for it.
+    File contents and command input are given either as a string or as an iterable of strings, which
+    is consumed as it is written.
+
+    Files are replaced atomically: their contents are written in full to a sibling path (see
+    :func:`stagingPath`) which is then renamed over the file, so that the file is never seen partly
+    written and is left as it was if writing fails.
+    """
+    def writeFile(self, path, data):
+        raise NotImplementedError('{0.__class__.__name__}:writeFile() method needs to be implemented'.format(self))
+
+    def execCommand(self, cmd, stdin=None):
+        raise NotImplementedError('{0.__class__.__name__}:execCommand() method needs to be implemented'.format(self))
+
+    def close(self):
+        pass
+
+
+class SSHSink(Sink):
+    """A single SSH session to a server, shared by all of its services.
+
+    The SSH transport and SFTP channel are opened on first use and kept open
+    until :meth:`close` is called, so that generating several services (and
+    actions) for a server costs a single key exchange and authentication.
+    Likewise, if the connection cannot be made, the error is raised again for
+    each later use rather than trying again, until the sink is closed.
+    """
+    def __init__(self, server):
+        self._server = server
+        self._ssh = None
+        self._sftp = None
+        self._connectError = None
+
+    @property
+    def connected(self):
+        return self._ssh is not None
+
+    @property
+    def failed(self):
+        """Whether the connection could not be made."""
+        return self._connectError is not None
+
+    @property
+    def active(self):
+        """Whether the sink is connected and the connection is still up."""
+        if self._ssh is None:
+            return False
+        transport = self._ssh.get_transport()
+        return transport is not None and transport.is_active()
+
+    @property
+    def transport(self):
+        if self._connectError is not None:
+            raise self._connectError
+        if self._ssh is None:
+            ssh = self._server.ssh
+            logger.info('Opening SSH connection to {} ({}:{})'.format(self._server, ssh.host, ssh.port))
+
+            paramiko = _paramiko()
+            client = paramiko.SSHClient()
+            client.get_host_keys().add(ssh.host, ssh.hostkeyType, paramiko.RSAKey(data=ssh.hostkeyValue))
+            try:
+                client.connect(ssh.host, port=ssh.port, username=ssh.user,
+                               key_filename=ssh.identity, look_for_keys=False, timeout=CONNECT_TIMEOUT)
+            except Exception as e:
+                client.close()
+                self._connectError = e
+                raise
+            self._ssh = client
+        return self._ssh.get_transport()
+
+    @property
+    def sftp(self):
+        if self._sftp is None:
+            self._sftp = _paramiko().SFTPClient.from_transport(self.transport)
+        return self._sftp
+
+    def writeFile(self, path, data):
+        sftp = self.sftp
+        staging = stagingPath(path)
+        try:
+            mode = sftp.stat(path).st_mode & 0o7777
+        except IOError:
+            mode = None
+
+        # Buffer writes so that they go out as full-sized SFTP requests, and pipeline them so that the
+        # upload is not held up waiting for each request to be acknowledged in turn
+        written = 0
+        try:
+            with timings.span('transfer', server=self._server, path=path) as span:
+                with sftp.open(staging, 'w', bufsize=CHUNK_SIZE) as f:
+                    f.set_pipelined(True)
+                    if mode is not None:
+                        f.chmod(mode)
+                    for chunk in encodedChunks(timings.iterate('render', data, span, server=self._server, path=path)):
+                        f.write(chunk)
+                        written += len(chunk)
+                sftp.posix_rename(staging, path)
+        except Exception:
+            try:
+                sftp.remove(staging)
+            except Exception:
+                pass
+            raise
+        logger.debug('SFTP wrote {} bytes to {} via {}'.format(written, path, staging))
+
+    def execCommand(self, cmd, stdin=None):
+        with timings.span('exec', server=self._server, cmd=cmd) as span:
+            chan = self.transport.open_session()
+            try:
+                chan.settimeout(None)
+                chan.exec_command(cmd)
+                if stdin is not None:
+                    for chunk in encodedChunks(timings.iterate('render', stdin, span, server=self._server, cmd=cmd)):
+                        chan.sendall(chunk)
+                chan.shutdown_write()
+                stdout = chan.makefile('rb').read()
+                stderr = chan.makefile_stderr('rb').read()
+                rc = chan.recv_exit_status()
+            finally:
+                chan.close()
+        logger.debug('SSH cmd [{}] returned {}'.format(cmd, rc))
+        if stdout:
+            logger.debug('SSH cmd [{}] stdout: {}'.format(cmd, stdout.decode('utf-8', 'replace').rstrip()))
+        if stderr:
+            logger.debug('SSH cmd [{}] stderr: {}'.format(cmd, stderr.decode('utf-8', 'replace').rstrip()))
+        return rc
+
+    def close(self):
+        self._connectError = None
+        if self._sftp is not None:
+            try:
+                self._sftp.close()
+            except Exception:
+                pass
+            self._sftp = None
+
+        if self._ssh is not None:
+            logger.info('Closing SSH connection to {}'.format(self._server))
+            try:
+                self._ssh.close()
+            except Exception:
+                pass
+            self._ssh = None
+
+    def __repr__(self):
+        return '{0.__class__.__name__}({0._server!s})'.format(self)
+
+
+class _PooledSink(Sink):
+    """A :class:`SinkPool` sink lent to a server, which leaves the connection open when closed."""
+    def __init__(self, sink):
+        self._sink = sink
+
+    def writeFile(self, path, data):
+        self._sink.writeFile(path, data)
+
+    def execCommand(self, cmd, stdin=None):
+        return self._sink.execCommand(cmd, stdin=stdin)
+
+    def __repr__(self):
+        return '{0.__class__.__name__}({0._sink!r})'.format(self)
+
+
+class SinkPool(object):
+    """SSH sinks kept open from one generation to the next, for as long as their server stays the same.
+
+    :meth:`sink` is a ``sinkFactory`` for :meth:`nsct.definition.Definition.generate`.  A server is
+    given the sink of the server of the same name from an earlier definition if it is reached with the
+    same SSH settings and the connection is still up; otherwise a new sink is made.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._sinks = {}
+
+    @staticmethod
+    def _key(server):
+        ssh = server.ssh
+        return (str(server), ssh.host, ssh.port, ssh.user, ssh.identity, ssh.hostkeyType, ssh.hostkeyValue)
+
+    def sink(self, server):
+        key = self._key(server)
+        with self._lock:
+            sink = self._sinks.get(key)
+            if sink is not None and sink.connected and not sink.active:
+                logger.info('SSH connection to {} was lost'.format(server))
+                sink.close()
+            elif sink is not None and sink.failed:
+                # Try connecting again, as the server may be back
+                sink.close()
+            if sink is None:
+                sink = self._sinks[key] = SSHSink(server)
+            else:
+                # Let go of the server of the earlier definition
+                sink._server = server
+        return _PooledSink(sink)
+
+    def prune(self, servers):
+        """Close the sinks of servers other than ``servers``."""
+        keys = set(self._key(server) for server in servers)
+        with self._lock:
+            for key in [key for key in self._sinks if key not in keys]:
+                self._sinks.pop(key).close()
+
+    def close(self):
+        self.prune([])
+
+    def __len__(self):
+        return len(self._sinks)
+
+    def __repr__(self):
+        return '{0.__class__.__name__}({1!r})'.format(self, list(self._sinks.values()))
+
+
+class DirectorySink(Sink):
+    """Writes a server's generated configuration under a local directory instead of to the server.
+
+    Files keep their absolute path below ``root`` (``/etc/hosts`` becomes ``<root>/etc/hosts``), and
+    commands, along with any input they would be given, are appended to ``<root>/commands.sh`` in the
+    order they would have been run.  Every command is assumed to succeed.
+    """
+    COMMANDS = 'commands.sh'
+    STDIN_EOF = '__NSCT_STDIN_EOF__'
+
+    def __init__(self, root):
+        self._root = root
+        self._commands = None
+
+    @property
+    def root(self):
+        return self._root
+
+    def _path(self, path):
+        return os.path.join(self._root, path.lstrip('/'))
+
+    def writeFile(self, path, data):
+        localPath = self._path(path)
+        if not os.path.isdir(os.path.dirname(localPath)):
+            os.makedirs(os.path.dirname(localPath))
+        staging = stagingPath(localPath, join=os.path.join, split=os.path.split)
+        written = 0
+        try:
+            with timings.span('transfer', path=localPath) as span:
+                with io.open(staging, 'wb') as f:
+                    for chunk in encodedChunks(timings.iterate('render', data, span, path=localPath)):
+                        f.write(chunk)
+                        written += len(chunk)
+                os.replace(staging, localPath)
+        except Exception:
+            if os.path.exists(staging):
+                os.remove(staging)
+            raise
+        logger.debug('Wrote {} bytes to {}'.format(written, localPath))
+
+    def execCommand(self, cmd, stdin=None):
+        if self._commands is None:
+            if not os.path.isdir(self._root):
+                os.makedirs(self._root)
+            self._commands = io.open(self._path(self.COMMANDS), 'w', encoding='utf-8')
+
+        if stdin is None:
+            self._commands.write('{}\n'.format(cmd))
+        else:
+            if not isinstance(stdin, string_types):
+                stdin = ''.join(timings.iterate('render', stdin, cmd=cmd))
+            if not stdin.endswith('\n'):
+                stdin += '\n'
+            self._commands.write("{0} <<'{1}'\n{2}{1}\n".format(cmd, self.STDIN_EOF, stdin))
+        logger.debug('Recorded cmd [{}] in {}'.format(cmd, self._path(self.COMMANDS)))
+        return 0
+
+    def close(self):
+        if self._commands is not None:
+            self._commands.close()
+            self._commands = None
+
+    def __repr__(self):
+        return '{0.__class__.__name__}({0._root!r})'.format(self)
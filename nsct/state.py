@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2018 by Neil Jarvis
+:licence: MIT, see LICENCE for more details
+"""
+from __future__ import absolute_import, unicode_literals, print_function
+
+import json
+import logging
+import os
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+class State(object):
+    """Local record of what nsct last did, persisted as a JSON file.
+
+    Holds the digest of the configuration last generated for each service of each server, and
+    where it was deployed to, so that unchanged services can be skipped, the digest of each domain, device and server of the
+    definition, so that changes to them can be found, and the offsets handed out to AUTO
+    allocations, so that they stay put from one run to the next.  Safe to use from concurrent
+    server generation.
+    """
+    VERSION = 1
+    ENTITY_KINDS = ('domains', 'devices', 'servers')
+
+    def __init__(self, filename=None):
+        self._filename = filename
+        self._lock = Lock()
+        self._state = {'version': self.VERSION, 'deploy': {}, 'targets': {}, 'entities': {}, 'allocations': {}}
+
+        if filename and os.path.exists(filename):
+            try:
+                with open(filename, 'r') as f:
+                    state = json.load(f)
+                if state.get('version') == self.VERSION:
+                    self._state.update(state)
+                else:
+                    logger.warning('Ignoring state file {} with unsupported version {!r}'.
+                                   format(filename, state.get('version')))
+            except Exception as e:
+                logger.warning('Ignoring unreadable state file {}: {}'.format(filename, e))
+
+    @property
+    def filename(self):
+        return self._filename
+
+    def digest(self, server, service, target):
+        """The digest last deployed for ``service`` of ``server``, if it was deployed to ``target``."""
+        with self._lock:
+            if self._state['targets'].get(str(server)) != target:
+                return None
+            return self._state['deploy'].get(str(server), {}).get(service)
+
+    def setDigest(self, server, service, digest, target):
+        """Record ``digest`` as deployed for ``service`` of ``server`` to ``target``, forgetting the digests
+        deployed to any other target."""
+        with self._lock:
+            if self._state['targets'].get(str(server)) != target:
+                self._state['targets'][str(server)] = target
+                self._state['deploy'][str(server)] = {}
+            self._state['deploy'].setdefault(str(server), {})[service] = digest
+
+    def updateEntities(self, kind, digests):
+        """Record the digests of every entity of ``kind``, returning ``(changed, removed)`` name sets.
+
+        Entities that were not recorded before count as changed.
+        """
+        assert kind in self.ENTITY_KINDS
+        with self._lock:
+            previous = self._state['entities'].get(kind, {})
+            self._state['entities'][kind] = dict(digests)
+        changed = set(name for name, digest in digests.items() if previous.get(name) != digest)
+        removed = set(previous) - set(digests)
+        return (changed, removed)
+
+    def allocation(self, domain, version, deviceInterface):
+        with self._lock:
+            return self._state['allocations'].get(str(domain), {}).get(version, {}).get(str(deviceInterface))
+
+    def setAllocations(self, domain, version, allocations):
+        """Replace the AUTO allocations recorded for ``domain``: a mapping of device interface to offset."""
+        with self._lock:
+            self._state['allocations'].setdefault(str(domain), {})[version] = \
+                dict((str(deviceInterface), offset) for deviceInterface, offset in allocations.items())
+
+    def save(self):
+        if not self._filename:
+            return
+
+        with self._lock:
+            tmp = self._filename + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self._state, f, indent=2, sort_keys=True)
+            os.replace(tmp, self._filename)
+        logger.debug('Saved state to {}'.format(self._filename))
+
+    def __repr__(self):
+        return '{0.__class__.__name__}({0._filename!r})'.format(self)
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2018 by Neil Jarvis
+:licence: MIT, see LICENCE for more details
+"""
+from __future__ import absolute_import, unicode_literals, print_function
+
+from collections import OrderedDict
+import os
+from threading import Lock, current_thread
+import time
+
+from nsct._compat import iteritems
+
+
+class Span(object):
+    """The time spent in one step, named for the kind of step (``parse.domains``, ``transfer``...) with
+    ``attrs`` saying which one (the server, the file...).
+
+    Time given to :meth:`exclude` is not counted in the span's duration, for time spent within the span
+    that is recorded by another one, such as rendering the configuration being transferred.
+    """
+    __slots__ = ('_name', '_attrs', '_thread', '_start', '_duration', '_excluded')
+
+    def __init__(self, name, attrs):
+        self._name = name
+        self._attrs = attrs
+        self._thread = current_thread().ident
+        self._start = None
+        self._duration = None
+        self._excluded = 0.0
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def attrs(self):
+        return self._attrs
+
+    @property
+    def start(self):
+        return self._start
+
+    @property
+    def duration(self):
+        return self._duration
+
+    def exclude(self, seconds):
+        self._excluded += seconds
+
+    def __repr__(self):
+        return '{0.__class__.__name__}({0._name!r}, {0._attrs!r}, duration={0._duration!r})'.format(self)
+
+
+class _NullSpan(object):
+    """What :meth:`Timings.span` gives when timings are not being kept."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def exclude(self, seconds):
+        pass
+
+
+_nullSpan = _NullSpan()
+
+
+class _SpanContext(object):
+    __slots__ = ('_timings', '_span')
+
+    def __init__(self, timings, span):
+        self._timings = timings
+        self._span = span
+
+    def __enter__(self):
+        self._span._start = time.perf_counter()
+        return self._span
+
+    def __exit__(self, *exc):
+        span = self._span
+        span._duration = time.perf_counter() - span._start - span._excluded
+        self._timings._add(span)
+        return False
+
+
+class Timings(object):
+    """Spans of the time spent in each step of a run, kept only once :meth:`enable` has been called.
+
+    Steps are timed with ``with timings.span(name, **attrs):``, which costs next to nothing while timings are
+    not being kept.  Safe to use from concurrent server generation.
+    """
+    def __init__(self):
+        self._enabled = False
+        self._lock = Lock()
+        self._spans = []
+        self._origin = time.perf_counter()
+        self._epoch = time.time()
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @property
+    def spans(self):
+        return self._spans
+
+    def enable(self):
+        with self._lock:
+            self._enabled = True
+            self._spans = []
+            self._origin = time.perf_counter()
+            self._epoch = time.time()
+
+    def disable(self):
+        self._enabled = False
+
+    def span(self, name, **attrs):
+        if not self._enabled:
+            return _nullSpan
+        return _SpanContext(self, Span(name, attrs))
+
+    def iterate(self, name, iterable, parent=None, **attrs):
+        """Yield the items of ``iterable``, recording the time spent producing them as a ``name`` span.
+
+        The time is excluded from the ``parent`` span, if given.  For a generator whose items are consumed
+        as they are produced, such as a service's rendered configuration being written to a sink.
+        """
+        if not self._enabled:
+            for item in iterable:
+                yield item
+            return
+
+        span = Span(name, attrs)
+        span._start = time.perf_counter()
+        elapsed = 0.0
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - start
+            yield item
+        span._duration = elapsed
+        if parent is not None:
+            parent.exclude(elapsed)
+        self._add(span)
+
+    def _add(self, span):
+        with self._lock:
+            self._spans.append(span)
+
+    def summary(self):
+        """The spans, totalled by name in the order first seen, as a table."""
+        totals = OrderedDict()
+        with self._lock:
+            for span in self._spans:
+                count, total, longest = totals.get(span.name, (0, 0.0, 0.0))
+                totals[span.name] = (count + 1, total + span.duration, max(longest, span.duration))
+
+        width = max([len(name) for name in totals] + [len('Step')])
+        lines = ['{:<{}} {:>8} {:>12} {:>12} {:>12}'.format('Step', width, 'Count', 'Total ms', 'Mean ms', 'Max ms')]
+        for name, (count, total, longest) in iteritems(totals):
+            lines.append('{:<{}} {:>8} {:>12.1f} {:>12.3f} {:>12.3f}'.
+                         format(name, width, count, total * 1000, total * 1000 / count, longest * 1000))
+        return '\n'.join(lines)
+
+    def asTrace(self):
+        """The spans as a trace in the Trace Event Format, as read by chrome://tracing, Perfetto and others.
+
+        Each span is a complete event, timestamped in microseconds since the epoch, with its attributes as
+        arguments.
+        """
+        pid = os.getpid()
+        with self._lock:
+            events = [OrderedDict([('name', span.name),
+                                   ('cat', span.name.split('.')[0]),
+                                   ('ph', 'X'),
+                                   ('ts', int((self._epoch + span.start - self._origin) * 1000000)),
+                                   ('dur', int((span.duration + span._excluded) * 1000000)),
+                                   ('pid', pid),
+                                   ('tid', span._thread),
+                                   ('args', dict((k, str(v)) for k, v in iteritems(span.attrs)))])
+                      for span in self._spans]
+        return OrderedDict([('traceEvents', events), ('displayTimeUnit', 'ms')])
+
+    def __repr__(self):
+        return '{0.__class__.__name__}(enabled={0._enabled!r}, spans={1})'.format(self, len(self._spans))
+
+
+# The timings of the run, enabled by --timings and --trace
+timings = Timings()
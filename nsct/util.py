@@ -7,11 +7,13 @@ from __future__ import absolute_import, unicode_literals, print_function
 
 
 def nth(number):
-    if str(number)[-1] == '1':
-        return number + 'st'
+    if str(number)[-2:] in ('11', '12', '13'):
+        return str(number) + 'th'
+    elif str(number)[-1] == '1':
+        return str(number) + 'st'
     elif str(number)[-1] == '2':
-        return number + 'nd'
+        return str(number) + 'nd'
     elif str(number)[-1] == '3':
-        return number + '3rd'
+        return str(number) + 'rd'
     else:
-        return number + 'th'
+        return str(number) + 'th'
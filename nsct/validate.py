@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2018 by Neil Jarvis
+:licence: MIT, see LICENCE for more details
+"""
+from __future__ import absolute_import, unicode_literals, print_function
+
+import re
+
+hostnameRe = re.compile(r'^(((?!-))(xn--)?[a-z0-9-_]{0,61}[a-z0-9]{1,1}\.)*(xn--)?'
+                        r'([a-z0-9\-]{1,61}|[a-z0-9-]{1,30}\.[a-z]{2,})(\.)?$')
+
+
+def isHostname(host):
+    return hostnameRe.match(host) is not None
+
+
+def invalidHostname(hosts):
+    """Return the index of the first of ``hosts`` that is not a valid hostname, or None if all are.
+
+    Each distinct hostname is only matched once, however many times it appears, which matters for the
+    targets of CNAME and MX records.
+    """
+    match = hostnameRe.match
+    if all(map(match, set(hosts))):
+        return None
+
+    for i, host in enumerate(hosts):
+        if not match(host):
+            return i
+    return None
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2018 by Neil Jarvis
+:licence: MIT, see LICENCE for more details
+"""
+from __future__ import absolute_import, unicode_literals, print_function
+
+import logging
+import os
+import time
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+logger = logging.getLogger(__name__)
+
+
+class FileWatcher(object):
+    """Waits for any of a set of files to change.
+
+    A file counts as changed when its modification time or size differ from when it was last looked at,
+    or it appears or disappears.  Changes are noticed through inotify if the optional ``inotify_simple``
+    package is installed, and by looking at the files every ``interval`` seconds otherwise.  Once a change
+    is seen, :meth:`wait` waits for the files to be left alone for ``settle`` seconds before returning, so
+    that an editor saving a file in several steps causes a single change.
+    """
+    def __init__(self, filenames=(), interval=1.0, settle=0.2, inotify=None):
+        self._interval = interval
+        self._settle = settle
+        self._inotify = inotify if inotify is not None else inotify_simple is not None
+        self._filenames = []
+        self._snapshot = {}
+        self.watch(filenames)
+
+    @property
+    def filenames(self):
+        return self._filenames
+
+    @staticmethod
+    def _stat(filename):
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _take(self):
+        return dict((filename, self._stat(filename)) for filename in self._filenames)
+
+    def watch(self, filenames):
+        """Watch ``filenames`` from now on.
+
+        Files already being watched are still compared with how they were when first watched, so that
+        a change made in between is not missed; the others with how they are now.
+        """
+        self._filenames = [os.path.abspath(filename) for filename in filenames]
+        self._snapshot = dict((filename, self._snapshot[filename] if filename in self._snapshot else self._stat(filename))
+                              for filename in self._filenames)
+
+    def _changed(self):
+        snapshot = self._take()
+        return set(filename for filename in self._filenames if snapshot[filename] != self._snapshot[filename])
+
+    def _waitPolling(self):
+        while True:
+            changed = self._changed()
+            if changed:
+                return changed
+            time.sleep(self._interval)
+
+    def _waitINotify(self):
+        flags = inotify_simple.flags
+        mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.DELETE | flags.ATTRIB
+
+        # Editors often replace a file rather than write to it, so watch the directories the files are in
+        with inotify_simple.INotify() as inotify:
+            watches = {}
+            for directory in set(os.path.dirname(filename) for filename in self._filenames):
+                try:
+                    watches[inotify.add_watch(directory, mask)] = directory
+                except OSError as e:
+                    logger.warning('Cannot watch {} with inotify, looking at it every {}s instead: {}'.
+                                   format(directory, self._interval, e))
+                    watches = None
+                    break
+
+            while True:
+                # A change made before the watches were set up is caught here too
+                changed = self._changed()
+                if changed:
+                    return changed
+                if watches is None:
+                    time.sleep(self._interval)
+                else:
+                    inotify.read(timeout=int(self._interval * 1000))
+
+    def wait(self):
+        """Block until a watched file changes, returning the set of files changed."""
+        changed = self._waitINotify() if self._inotify else self._waitPolling()
+
+        # Let the files settle
+        while True:
+            snapshot = self._take()
+            time.sleep(self._settle)
+            if self._take() == snapshot:
+                break
+
+        changed |= self._changed()
+        self._snapshot = snapshot
+        logger.info('Changed: {}'.format(', '.join(sorted(changed))))
+        return changed
+
+    def __repr__(self):
+        return '{0.__class__.__name__}({0._filenames!r})'.format(self)
@@ -5,27 +5,36 @@
 """
 from __future__ import absolute_import, unicode_literals, print_function
 
-import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import hashlib
+import os
+from threading import local
 from ruamel.yaml import YAML, yaml_object
 from ruamel.yaml.error import YAMLError, MarkedYAMLError
 from netaddr import IPNetwork, IPAddress, IPRange, EUI, mac_unix_expanded
 
 from nsct._compat import iteritems, string_types
 from nsct.error import DefinitionError
+from nsct.validate import isHostname, invalidHostname
 
 yaml = YAML()
 yaml.indent(sequence=4, offset=2)
 
+# Safe loading builds plain dicts and lists without line/column information, and uses ruamel's C
+# parser when ruamel.yaml.clib is installed.  Much faster than round-trip loading, but only for
+# reading: positions are re-resolved from a round-trip load when an error has to be reported.
+fastYaml = YAML(typ='safe')
+
 
 class Scalar_mx(object):
-    def __init__(self, priority, host):
+    def __init__(self, priority, host, validate=True):
         try:
             priority = int(priority)
         except Exception as e:
             raise TypeError('invalid MX priority: {}'.format(e))
 
-        if not re.match(r'^(((?!-))(xn--)?[a-z0-9-_]{0,61}[a-z0-9]{1,1}\.)*(xn--)?'
-                        '([a-z0-9\-]{1,61}|[a-z0-9-]{1,30}\.[a-z]{2,})(\.)?$', host):
+        if validate and not isHostname(host):
             raise TypeError('invalid MX host')
 
         self._priority = priority
@@ -44,11 +53,10 @@ class Scalar_mx(object):
 
 
 class Scalar_cname(object):
-    def __init__(self, host):
+    def __init__(self, host, validate=True):
         if not isinstance(host, string_types):
             raise TypeError('invalid CNAME string')
-        if not re.match(r'^(((?!-))(xn--)?[a-z0-9-_]{0,61}[a-z0-9]{1,1}\.)*(xn--)?'
-                        '([a-z0-9\-]{1,61}|[a-z0-9-]{1,30}\.[a-z]{2,})(\.)?$', host):
+        if validate and not isHostname(host):
             raise TypeError('invalid CNAME host')
         self._host = host
 
@@ -108,9 +116,16 @@ class Scalar_allocation(object):
 
         self._strategyType = None
         self._offset = None
+        self._pool = None
 
         if strategy == 'EUI':
             self._strategyType = 'EUI'
+        elif strategy == 'AUTO' or strategy.startswith('AUTO/'):
+            if '/' in strategy:
+                self._pool = strategy.split('/', 1)[1]
+                if not self._pool:
+                    raise TypeError('Allocation strategy AUTO/ requires a pool name')
+            self._strategyType = 'AUTO'
         elif strategy.startswith('ALIAS/'):
             try:
                 self._offset = int(strategy.split('/', 1)[1])
@@ -149,15 +164,64 @@ class Scalar_allocation(object):
     def isOffsetStrategy(self):
         return self._strategyType == 'OFFSET'
 
+    @property
+    def isAutoStrategy(self):
+        return self._strategyType == 'AUTO'
+
     @property
     def offset(self):
         assert self.isOffsetStrategy or self.isAliasStrategy
         return self._offset
 
+    @property
+    def pool(self):
+        assert self.isAutoStrategy
+        return self._pool
+
     def __repr__(self):
         return '{}/{}'.format(self._domain, self._strategy)
 
 
+# Scalars whose validation is deferred until the end of the load they are part of, so that each kind
+# can be validated all at once: {cls: [(value, mark), ...]} while loading, None otherwise.
+_deferred = local()
+
+
+def _deferValidation(cls, value, mark):
+    pending = getattr(_deferred, 'pending', None)
+    if pending is None:
+        _validate(cls, [(value, mark)])
+    else:
+        pending.setdefault(cls, []).append((value, mark))
+
+
+def _validate(cls, entries):
+    """Raise a MarkedYAMLError for the first of ``entries`` of ``cls`` that is invalid, if any."""
+    invalid = cls.invalid([value for value, mark in entries])
+    if invalid is not None:
+        i, problem = invalid
+        raise MarkedYAMLError(None, None, problem, entries[i][1])
+
+
+def _load(loader, stream):
+    _deferred.pending = {}
+    try:
+        yml = loader.load(stream)
+
+        # Validate each kind of scalar in one go, reporting the invalid scalar earliest in the stream
+        errors = []
+        for cls, entries in iteritems(_deferred.pending):
+            try:
+                _validate(cls, entries)
+            except MarkedYAMLError as e:
+                errors.append(e)
+        if errors:
+            raise min(errors, key=lambda e: e.problem_mark.index)
+        return yml
+    finally:
+        _deferred.pending = None
+
+
 class YAML_scalar(object):
     def __init__(self, value, style=None):
         self._value = value
@@ -181,38 +245,55 @@ class YAML_scalar(object):
 
 
 @yaml_object(yaml)
+@yaml_object(fastYaml)
 class YAML_mx(YAML_scalar):
     yaml_tag = u'!mx'
 
-    def __init__(self, priority, host):
-        super(YAML_mx, self).__init__(Scalar_mx(priority, host))
+    def __init__(self, priority, host, validate=True):
+        super(YAML_mx, self).__init__(Scalar_mx(priority, host, validate=validate))
 
     @classmethod
     def from_yaml(cls, constructor, node):
         try:
-            return cls(*node.value.split('/'))
+            value = cls(*node.value.split('/'), validate=False)
         except Exception as e:
             raise MarkedYAMLError(None, None,
                                   "expected a MX scalar, found %s" % e, node.start_mark)
+        _deferValidation(cls, value, node.start_mark)
+        return value
+
+    @classmethod
+    def invalid(cls, values):
+        i = invalidHostname([value.scalarValue.host for value in values])
+        return (i, 'expected a MX scalar, found invalid MX host') if i is not None else None
 
 
 @yaml_object(yaml)
+@yaml_object(fastYaml)
 class YAML_cname(YAML_scalar):
     yaml_tag = u'!cname'
 
-    def __init__(self, host):
-        super(YAML_cname, self).__init__(Scalar_cname(host))
+    def __init__(self, host, validate=True):
+        super(YAML_cname, self).__init__(Scalar_cname(host, validate=validate))
 
     @classmethod
     def from_yaml(cls, constructor, node):
         try:
-            return cls(node.value)
+            value = cls(node.value, validate=False)
         except Exception as e:
             raise MarkedYAMLError(None, None,
                                   "expected a CNAME scalar, found %s" % e, node.start_mark)
+        _deferValidation(cls, value, node.start_mark)
+        return value
+
+    @classmethod
+    def invalid(cls, values):
+        i = invalidHostname([value.scalarValue.host for value in values])
+        return (i, 'expected a CNAME scalar, found invalid CNAME host') if i is not None else None
 
 
 @yaml_object(yaml)
+@yaml_object(fastYaml)
 class YAML_txt(YAML_scalar):
     yaml_tag = u'!txt'
 
@@ -229,6 +310,7 @@ class YAML_txt(YAML_scalar):
 
 
 @yaml_object(yaml)
+@yaml_object(fastYaml)
 class YAML_ipv4network(YAML_scalar):
     yaml_tag = u'!ipv4network'
 
@@ -245,6 +327,7 @@ class YAML_ipv4network(YAML_scalar):
 
 
 @yaml_object(yaml)
+@yaml_object(fastYaml)
 class YAML_ipv6network(YAML_scalar):
     yaml_tag = u'!ipv6network'
 
@@ -261,6 +344,7 @@ class YAML_ipv6network(YAML_scalar):
 
 
 @yaml_object(yaml)
+@yaml_object(fastYaml)
 class YAML_ipv4address(YAML_scalar):
     yaml_tag = u'!ipv4address'
 
@@ -277,6 +361,7 @@ class YAML_ipv4address(YAML_scalar):
 
 
 @yaml_object(yaml)
+@yaml_object(fastYaml)
 class YAML_ipv6address(YAML_scalar):
     yaml_tag = u'!ipv6address'
 
@@ -293,16 +378,19 @@ class YAML_ipv6address(YAML_scalar):
 
 
 @yaml_object(yaml)
+@yaml_object(fastYaml)
 class YAML_a(YAML_ipv4address):
     yaml_tag = u'!a'
 
 
 @yaml_object(yaml)
+@yaml_object(fastYaml)
 class YAML_aaaa(YAML_ipv6address):
     yaml_tag = u'!aaaa'
 
 
 @yaml_object(yaml)
+@yaml_object(fastYaml)
 class YAML_mac(YAML_scalar):
     yaml_tag = u'!mac'
 
@@ -319,6 +407,7 @@ class YAML_mac(YAML_scalar):
 
 
 @yaml_object(yaml)
+@yaml_object(fastYaml)
 class YAML_ipv4range(YAML_scalar):
     yaml_tag = u'!ipv4range'
 
@@ -335,6 +424,7 @@ class YAML_ipv4range(YAML_scalar):
 
 
 @yaml_object(yaml)
+@yaml_object(fastYaml)
 class YAML_allocation(YAML_scalar):
     yaml_tag = u'!allocation'
 
@@ -351,77 +441,227 @@ class YAML_allocation(YAML_scalar):
 
 
 class Location(object):
-    def __init__(self, filename, lc=None, section=None):
+    """Where a fragment of a definition is: a file, a line/column and a section path.
+
+    Locations form a chain of parent pointers, each holding only its own part of the section path, so
+    creating one for every fragment is cheap.  The line/column may be given lazily as the
+    ``(container, key)`` of the YAML node, and neither it nor the section path is worked out until
+    the location is displayed, normally because of an error.  For YAML loaded without positions, the
+    node is then found again in a round-trip load of the file (or ``text``, if it was loaded from a
+    string) by its path from the root.
+    """
+    __slots__ = ('_filename', '_parent', '_lc', '_lineCol', '_section', '_text')
+
+    def __init__(self, filename, lc=None, section=None, parent=None):
         assert isinstance(filename, str)
         assert lc is None or isinstance(lc, tuple)
-        assert section is None or isinstance(section, list)
+        assert section is None or isinstance(section, (list,) + string_types)
 
         self._filename = filename
+        self._parent = parent
         self._lc = lc if lc else (0, 0)
-        self._section = section if section else []
+        self._lineCol = None
+        self._section = section
+        self._text = None
 
     @property
     def filename(self):
         return self._filename
 
     def subLocation(self, lc, section):
-        if isinstance(section, list):
-            subSection = self._section + section
-        else:
-            subSection = self._section + [section]
-        return Location(self._filename, lc, subSection)
-
-    def _where(self):
-        (line, col) = self._lc
-        section = '|'.join(self._section).replace('|[', '[')
+        return Location(self._filename, lc, section, parent=self)
+
+    def lazySubLocation(self, container, key, section):
+        """Location of ``container[key]``, its line/column only looked up if the location is displayed."""
+        return Location(self._filename, (container, key), section, parent=self)
+
+    def detach(self):
+        """Drop the location's, and its parents', references to YAML nodes, so that a location kept for
+        reporting errors later does not keep the whole YAML tree alive.  A detached location's position
+        is found again from the file when needed.  Returns the location.
+        """
+        location = self
+        while location is not None and location._lc[0] is not None:
+            if not isinstance(location._lc[0], int):
+                location._lc = (None, location._lc[1])
+            location = location._parent
+        return self
+
+    def _roundTripContainer(self):
+        path = []
+        location = self
+        while location._parent is not None:
+            if not isinstance(location._lc[0], int):
+                path.append(location._lc[1])
+            location = location._parent
+        container = _roundTripLoad(location._filename, location._text, _fileVersion(location._filename, location._text))
+        for key in reversed(path[1:]):
+            container = container[key]
+        return container
+
+    def _lineColumn(self):
+        if self._lineCol is None:
+            if isinstance(self._lc[0], int):
+                self._lineCol = self._lc
+            else:
+                container, key = self._lc
+                if not hasattr(container, 'lc'):
+                    container = self._roundTripContainer()
+                if isinstance(container, list):
+                    self._lineCol = tuple(container.lc.item(key))
+                else:
+                    self._lineCol = tuple(container.lc.value(key))
+        return self._lineCol
+
+    def _sections(self):
+        sections = []
+        location = self
+        while location is not None:
+            if isinstance(location._section, list):
+                sections.extend(reversed(location._section))
+            elif location._section is not None:
+                sections.append(location._section)
+            location = location._parent
+        sections.reverse()
+        return sections
+
+    def where(self):
+        """``(line, column, section)`` of the location, 1-based."""
+        (line, col) = self._lineColumn()
+        section = '|'.join(self._sections()).replace('|[', '[')
         return (line + 1, col + 1, section)
 
+    def raiseError(self, msg):
+        line, column, section = self.where()
+        raise DefinitionError('DefinitionError: {!r} {}'.format(self, msg), filename=self._filename,
+                              line=line, column=column, section=section, message=msg)
+
     def __str__(self):
         return '{._filename}'.format(self)
 
     def __repr__(self):
-        line, col, section = self._where()
+        # Works out the position, so log with '%r' and leave it to logging: it is then only worked out when shown
+        line, col, section = self.where()
         if section == '':
             return '{._filename}:{}:{}:'.format(self, line, col)
         else:
             return '{._filename}:{}:{}: [{}]'.format(self, line, col, section)
 
 
+def _fileVersion(filename, text):
+    """What tells one version of a file from another, so that a round-trip load of it is not used once it
+    has changed."""
+    if text is not None:
+        return None
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+@lru_cache(maxsize=1)
+def _roundTripLoad(filename, text, version):
+    if text is None:
+        with open(filename, 'r') as s:
+            return yaml.load(s)
+    return yaml.load(text)
+
+
 class Fragment(object):
+    """A node of a definition's YAML and where it is.
+
+    The YAML is loaded from the ``ymlstr`` given, or from the location's file, with the round-trip
+    loader unless ``fast`` is given; fast loaded YAML cannot be dumped.
+    """
+    __slots__ = ('_location', '_yml')
+
     def __init__(self, location, **kwargs):
         assert isinstance(location, Location)
         self._location = location
         if 'yml' in kwargs:
             self._yml = kwargs['yml']
         else:
+            loader = fastYaml if kwargs.get('fast') else yaml
             try:
                 if 'ymlstr' in kwargs and kwargs['ymlstr'] is not None:
-                    self._yml = yaml.load(kwargs['ymlstr'])
+                    self._yml = _load(loader, kwargs['ymlstr'])
+                    self._location._text = kwargs['ymlstr']
                 else:
+                    # The file may have changed since a round-trip load of it was cached
+                    _roundTripLoad.cache_clear()
                     try:
                         with open(self._location.filename, 'r') as s:
-                            self._yml = yaml.load(s)
+                            self._yml = _load(loader, s)
                     except YAMLError:
                         raise
                     except Exception as e:
-                        raise DefinitionError('DefinitionError: {}:0:0: {}'.format(self._location.filename, e))
+                        raise DefinitionError('DefinitionError: {}:0:0: {}'.format(self._location.filename, e),
+                                              filename=self._location.filename, line=0, column=0, message=str(e))
             except YAMLError as e:
                 raise DefinitionError('DefinitionError: {}:{}:{}: {}'.format(self._location.filename,
                                                                              e.problem_mark.line + 1,
                                                                              e.problem_mark.column + 1,
-                                                                             e.problem))
+                                                                             e.problem),
+                                      filename=self._location.filename, line=e.problem_mark.line + 1,
+                                      column=e.problem_mark.column + 1, message=e.problem)
+
+    @property
+    def location(self):
+        return self._location
+
+    @property
+    def filename(self):
+        return self._location.filename
+
+    @property
+    def hasPositions(self):
+        """Whether the YAML was loaded with line/column information, i.e. round-trip."""
+        return hasattr(self._yml, 'lc')
 
     def subLocation(self, subLc, subSection):
         return self._location.subLocation(subLc, subSection)
 
+    def subFragment(self, key, section=None):
+        """Fragment of the value of ``key`` (an index for a sequence), located lazily."""
+        return Fragment(self._location.lazySubLocation(self._yml, key, str(key) if section is None else section),
+                        yml=self._yml[key])
+
     def dump(self, s):
         yaml.dump(self._yml, s)
 
+    def digest(self):
+        """SHA-256 of the fragment's content, ignoring comments, layout and position."""
+        h = hashlib.sha256()
+
+        def _update(yml):
+            if isinstance(yml, dict):
+                h.update(b'{')
+                for k, v in iteritems(yml):
+                    _update(k)
+                    _update(v)
+                h.update(b'}')
+            elif isinstance(yml, list):
+                h.update(b'[')
+                for v in yml:
+                    _update(v)
+                h.update(b']')
+            else:
+                # Quoting and number formats give subclasses of the builtin types; treat them all alike
+                for t in (bool, string_types[0], int, float):
+                    if isinstance(yml, t):
+                        yml = t(yml)
+                        break
+                h.update('{}:{!r}\0'.format(type(yml).__name__, yml).encode('utf-8'))
+
+        _update(self._yml)
+        return h.hexdigest()
+
     def ymlIsInstance(self, types):
         return isinstance(self._yml, types)
 
     def raiseError(self, msg):
-        raise DefinitionError('DefinitionError: {!r} {}'.format(self, msg))
+        self._location.raiseError(msg)
 
     def getValue(self, expectedType, source=None):
         if not isinstance(self._yml, expectedType):
@@ -454,8 +694,7 @@ class Fragment(object):
                                       returnValueFragment=returnValueFragment)
 
         if key in self._yml:
-            valueYml = self._yml[key]
-            valueFragment = Fragment(self.subLocation(self._yml.lc.value(key), key), yml=valueYml)
+            valueFragment = self.subFragment(key)
             value = valueFragment.getValue(expectedType, source='for key {}'.format(key))
 
             if returnValueFragment:
@@ -473,17 +712,13 @@ class Fragment(object):
 
     def getElements(self, key=[]):
         assert isinstance(self._yml, list)
-        return [(i, Fragment(self.subLocation(self._yml.lc.item(i),
-                                              key + ['[{}]'.format(i + 1)]),
-                             yml=v))
-                for i, v in enumerate(self._yml)]
+        return [(i, self.subFragment(i, key + ['[{}]'.format(i + 1)]))
+                for i in range(len(self._yml))]
 
     def getItems(self, key=[]):
         assert isinstance(self._yml, dict)
-        return [(str(k), Fragment(self.subLocation(self._yml.lc.value(k),
-                                                   key + [str(k)]),
-                                  yml=v))
-                for k, v in iteritems(self._yml)]
+        return [(str(k), self.subFragment(k, key + [str(k)]))
+                for k in self._yml]
 
     def getMappingItems(self, key, required=True):
         _rk = key
@@ -509,3 +744,20 @@ class Fragment(object):
 
     def __repr__(self):
         return self._location.__repr__()
+
+
+def _loadYml(filename):
+    return Fragment(Location(filename), fast=True)._yml
+
+
+def loadFragments(filenames, fast=False, jobs=1):
+    """Load each of ``filenames``, returning their fragments in the same order.
+
+    With ``fast``, files are loaded with the safe loader by up to ``jobs`` worker processes.
+    """
+    if fast and jobs > 1 and len(filenames) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(filenames))) as executor:
+            ymls = list(executor.map(_loadYml, filenames))
+        return [Fragment(Location(filename), yml=yml) for filename, yml in zip(filenames, ymls)]
+
+    return [Fragment(Location(filename), fast=fast) for filename in filenames]
@@ -75,6 +75,11 @@ setup(
     # Install requirements loaded from ``requirements.txt``
     install_requires=parse_reqs(),
 
+    # inotify lets --watch notice changes as soon as they are made, rather than by polling
+    extras_require={
+        'watch': ['inotify_simple'],
+    },
+
     test_suite='tests',
 
     # To provide executable scripts, use entry points in preference to the
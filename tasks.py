@@ -27,10 +27,16 @@ def test(ctx):
     ctx.run('py.test --flakes --cov-report term-missing --cov-report annotate:cov_annotate --cov nsct tests/', pty=True)
 
 
+@task
+def bench(ctx, devices=2000):
+    """bench - run the benchmarks on a synthetic definition of <devices> devices."""
+    ctx.run('py.test benchmarks --devices {}'.format(devices), pty=True)
+
+
 @task
 def lint(ctx):
     """lint - check style with flake8."""
-    ctx.run('flake8 nsct tests')
+    ctx.run('flake8 nsct tests benchmarks')
 
 
 @task(clean)
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+test_address
+----------------------------------
+
+Tests for `nsct.address` module.
+"""
+from netaddr import IPAddress, IPNetwork, EUI, mac_unix_expanded
+
+from nsct.address import formatIPv4, formatIPv6, formatMAC, modifiedEUI64
+
+
+class TestAddress(object):
+    @classmethod
+    def set_up(self):
+        pass
+
+    @classmethod
+    def tear_down(self):
+        pass
+
+    def test_format_ipv4(self):
+        for address in ('0.0.0.0', '10.0.0.1', '95.172.226.216', '255.255.255.255'):
+            assert formatIPv4(int(IPAddress(address))) == str(IPAddress(address))
+
+    def test_format_ipv6(self):
+        for address in ('::', '::1', '2001:470:1f1d:cc9::', '2001:470:1f1d:cc9:201:2ff:fe03:405',
+                        'fe80::1:0:0:1', '::ffff:1.2.3.4', 'ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff'):
+            assert formatIPv6(int(IPAddress(address))) == str(IPAddress(address))
+
+    def test_format_mac(self):
+        for mac in ('00:01:02:03:04:05', 'ff:ff:ff:ff:ff:ff', '00:00:00:00:00:00', 'a0:b1:c2:d3:e4:f5'):
+            assert formatMAC(int(EUI(mac))) == str(EUI(mac, dialect=mac_unix_expanded))
+
+    def test_modified_eui64(self):
+        subnet = IPNetwork('2001:470:1f1d:cc9::/64')
+        for mac in ('00:01:02:03:04:05', '02:00:00:00:00:01', 'a0:b1:c2:d3:e4:f5'):
+            assert subnet.first + modifiedEUI64(int(EUI(mac))) == int(EUI(mac).ipv6(subnet.first))
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+test_allocator
+----------------------------------
+
+Tests for `nsct.allocator` module.
+"""
+import pytest
+
+from nsct.allocator import AddressAllocator
+
+
+class TestAllocator(object):
+    @classmethod
+    def set_up(self):
+        pass
+
+    @classmethod
+    def tear_down(self):
+        pass
+
+    def test_empty(self):
+        a = AddressAllocator(256)
+        assert len(a) == 0
+        assert a.owner(0) is None
+        assert a.isFree(0, 255)
+        assert a.nextFree() == 0
+        assert list(a.freeRanges()) == [(0, 255)]
+
+    def test_allocate(self):
+        a = AddressAllocator(256)
+        a.allocate(1, 'one')
+        a.allocate(3, 'three')
+        assert len(a) == 2
+        assert a.owner(1) == 'one'
+        assert a.owner(2) is None
+        assert a.owner(3) == 'three'
+        assert not a.isFree(1)
+        assert a.isFree(2)
+        assert not a.isFree(0, 10)
+        assert list(a.items()) == [(1, 1, 'one'), (3, 3, 'three')]
+
+    def test_reserve_range(self):
+        a = AddressAllocator(2 ** 64)
+        a.reserve(100, 2 ** 32, 'pool')
+        assert len(a) == 1
+        assert a.owner(100) == 'pool'
+        assert a.owner(2 ** 31) == 'pool'
+        assert a.owner(2 ** 32 + 1) is None
+        assert not a.isFree(0, 200)
+        assert a.isFree(0, 99)
+        assert a.nextFree(100) == 2 ** 32 + 1
+
+    def test_reserve_conflict(self):
+        a = AddressAllocator(256)
+        a.reserve(10, 20, 'pool')
+        with pytest.raises(ValueError):
+            a.reserve(20, 30, 'other')
+        with pytest.raises(ValueError):
+            a.allocate(15, 'other')
+        with pytest.raises(IndexError):
+            a.allocate(256, 'other')
+
+    def test_next_free_skips_contiguous_allocations(self):
+        a = AddressAllocator(256)
+        a.reserve(100, 199, 'pool')
+        for offset in range(1, 100):
+            a.allocate(offset, offset)
+        assert a.nextFree(1) == 200
+        assert a.nextFree(0) == 0
+        assert a.nextFree(1, 199) is None
+        a.allocate(0, 0)
+        assert a.nextFree() == 200
+
+    def test_free_ranges(self):
+        a = AddressAllocator(256)
+        a.allocate(0, 'network')
+        a.reserve(100, 199, 'pool')
+        a.allocate(201, 'x')
+        a.allocate(255, 'broadcast')
+        assert list(a.freeRanges()) == [(1, 99), (200, 200), (202, 254)]
+        assert list(a.freeRanges(150, 210)) == [(200, 200), (202, 210)]
+        assert list(a.freeRanges(100, 199)) == []
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+test_cache
+----------------------------------
+
+Tests for `nsct.cache` module.
+"""
+import os
+
+import pytest
+
+from nsct.cache import DefinitionCache
+from nsct.definition import Definition
+from nsct.yaml import Fragment, Location, DefinitionError
+
+DEFINITION = """
+nameserver: test
+domains:
+  a.com:
+    ipv4-subnet: !ipv4network 10.0.0.0/24
+devices:
+  dev1:
+    lan:
+      mac: !mac 00:01:02:03:04:05
+      ipv4: !allocation a.com/1
+  dev2:
+    lan:
+      ipv4: !allocation a.com/{}
+"""
+
+
+class TestCache(object):
+    @classmethod
+    def set_up(self):
+        pass
+
+    @classmethod
+    def tear_down(self):
+        pass
+
+    def _definition(self, tmpdir, offset):
+        filename = str(tmpdir.join('definition.yaml'))
+        with open(filename, 'w') as f:
+            f.write(DEFINITION.format(offset))
+        return filename
+
+    def test_cache(self, tmpdir):
+        cache = DefinitionCache(str(tmpdir.join('cache')))
+        filename = self._definition(tmpdir, 2)
+        assert cache.load(filename) is None
+
+        cache.save(filename, Definition.parse(Fragment(Location(filename), fast=True)))
+        definition = cache.load(filename)
+        assert sorted(definition.devices) == ['dev1', 'dev2']
+        definition.compute()
+        assert [str(i) for o, i in definition.domains['a.com'].interfaceAllocations('ipv4')] == ['dev1/lan', 'dev2/lan']
+
+        # Same content, new modification time
+        st = os.stat(filename)
+        os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        assert cache.load(filename) is not None
+
+        # New content
+        self._definition(tmpdir, 3)
+        assert cache.load(filename) is None
+
+    def test_cached_error_location(self, tmpdir):
+        cache = DefinitionCache(str(tmpdir.join('cache')))
+        filename = self._definition(tmpdir, 1)
+        cache.save(filename, Definition.parse(Fragment(Location(filename), fast=True)))
+
+        # Found again in the file from the cached definition
+        with pytest.raises(DefinitionError, match=r'{}:13:13: \[devices\|dev2\|lan\|ipv4\] Address 10.0.0.1'.format(filename)):
+            cache.load(filename).compute()
+
+    def test_cache_includes(self, tmpdir):
+        cache = DefinitionCache(str(tmpdir.join('cache')))
+        filename = self._definition(tmpdir, 2)
+        with open(filename, 'a') as f:
+            f.write('includes:\n  - more.yaml\n')
+        tmpdir.join('more.yaml').write('devices:\n  dev3:\n    lan:\n      ipv4: !allocation a.com/3\n')
+
+        cache.save(filename, Definition.parse(Fragment(Location(filename), fast=True)))
+        assert sorted(cache.load(filename).devices) == ['dev1', 'dev2', 'dev3']
+
+        # A change to an included file is a change to the definition
+        tmpdir.join('more.yaml').write('devices:\n  dev4:\n    lan:\n      ipv4: !allocation a.com/3\n')
+        assert cache.load(filename) is None
+
+    def test_cache_relative(self, tmpdir):
+        cache = DefinitionCache(str(tmpdir.join('cache')))
+        sub = tmpdir.mkdir('sub')
+        self._definition(sub, 2)
+        with open(str(sub.join('definition.yaml')), 'a') as f:
+            f.write('includes:\n  - more.yaml\n')
+        sub.join('more.yaml').write('devices:\n  dev3:\n    lan:\n      ipv4: !allocation a.com/3\n')
+
+        with sub.as_cwd():
+            cache.save('definition.yaml', Definition.parse(Fragment(Location('definition.yaml'), fast=True)))
+
+        # Used from another working directory, the files checked are still those the definition was parsed from
+        tmpdir.join('more.yaml').write('devices:\n  dev4:\n    lan:\n      ipv4: !allocation a.com/3\n')
+        with tmpdir.as_cwd():
+            assert sorted(cache.load(os.path.join('sub', 'definition.yaml')).devices) == ['dev1', 'dev2', 'dev3']
+            sub.join('more.yaml').write('devices:\n  dev5:\n    lan:\n      ipv4: !allocation a.com/3\n')
+            assert cache.load(os.path.join('sub', 'definition.yaml')) is None
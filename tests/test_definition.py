@@ -6,12 +6,17 @@ test_nsct
 Tests for `nsct` module.
 """
 from functools import wraps
+import gc
 from inspect import getdoc
 from os.path import dirname, realpath
+from netaddr import IPAddress
 import pytest
+import weakref
 
+from nsct.error import DefinitionErrors
 from nsct.yaml import Fragment, Location, DefinitionError
 from nsct.definition import Definition
+from nsct.state import State
 
 
 def yamlDoc(f):
@@ -43,6 +48,11 @@ class TestNsct(object):
     def _good_definition(self, fname, fdoc):
         return Definition.parse(Fragment(Location(fname), ymlstr=fdoc))
 
+    def _bad_compute(self, fname, fdoc, location, error):
+        definition = self._good_definition(fname, fdoc)
+        with pytest.raises(DefinitionError, match=r'{}:{}:{}: {}'.format(fname, location[0], location[1], error)):
+            definition.compute()
+
     @yamlDoc
     def test_blank(self, fname=None, fdoc=None):
         """
@@ -207,6 +217,395 @@ servers:
         str(definition)
         repr(definition)
 
+    @yamlDoc
+    def test_allocation_conflict(self, fname=None, fdoc=None):
+        """
+nameserver: test
+domains:
+  a.com:
+    ipv4-subnet: !ipv4network 10.0.0.0/24
+devices:
+  dev1:
+    lan:
+      ipv4: !allocation a.com/1
+  dev2:
+    lan:
+      ipv4: !allocation a.com/1
+servers:
+  test:
+    ssh:
+      host: !ipv4address 10.10.10.1
+      user: user
+      identity: %testdir%/test_id_rsa
+      host-key: ssh-rsa AAAAxxx
+    services:
+      ipv4-dhcp:
+        type: dnsmasq.openwrt
+        interface: lan
+        domain: a.com
+        range: !ipv4range 10.0.0.100-10.0.0.199
+        """
+        definition = self._good_definition(fname, fdoc)
+        with pytest.raises(DefinitionError, match=r'{}:11:13: \[devices\|dev2\|lan\|ipv4\] Address 10.0.0.1 in ipv4 '
+                                                  'subnet of domain a.com allocated to device interface dev1/lan'.format(fname)):
+            definition.compute()
+
+        fdoc = fdoc.replace('dev2:\n    lan:\n      ipv4: !allocation a.com/1',
+                            'dev2:\n    lan:\n      ipv4: !allocation a.com/150')
+        definition = self._good_definition(fname, fdoc)
+        with pytest.raises(DefinitionError, match=r'Address 10.0.0.150 in ipv4 subnet of domain a.com reserved for '
+                                                  'DHCP allocation range 10.0.0.100-10.0.0.199'):
+            definition.compute()
+
+    @yamlDoc
+    def test_dhcp_range_records(self, fname=None, fdoc=None):
+        """
+nameserver: test
+domains:
+  a.com:
+    ipv4-subnet: !ipv4network 10.0.0.0/16
+    records:
+      a:
+        www: !a 10.0.0.10
+servers:
+  test:
+    ssh:
+      host: !ipv4address 10.10.10.1
+      user: user
+      identity: %testdir%/test_id_rsa
+      host-key: ssh-rsa AAAAxxx
+    services:
+      ipv4-dhcp:
+        type: dnsmasq.openwrt
+        interface: lan
+        domain: a.com
+        range: !ipv4range 10.0.1.0-10.0.255.254
+        """
+        definition = self._good_definition(fname, fdoc)
+        definition.compute()
+
+        domain = definition.domains['a.com']
+        assert len(domain.allocations('ipv4')) == 1
+
+        records = domain.records('a')
+        assert next(records) == ('www', {int(IPAddress('10.0.0.10'))})
+        assert next(records) == ('dhcp-256.a.com', {int(IPAddress('10.0.1.0'))})
+        assert next(records) == ('dhcp-257.a.com', {int(IPAddress('10.0.1.1'))})
+        assert sum(1 for r in records) == 65279 - 2
+        assert list(domain.records('aaaa')) == []
+
+    @yamlDoc
+    def test_auto_allocation(self, fname=None, fdoc=None):
+        """
+nameserver: test
+domains:
+  a.com:
+    ipv4-subnet: !ipv4network 10.0.0.0/28
+    pools:
+      servers: !ipv4range 10.0.0.8-10.0.0.9
+devices:
+  zed:
+    lan:
+      mac: !mac 00:01:02:03:04:05
+      ipv4: !allocation a.com/AUTO
+  alpha:
+    lan:
+      ipv4: !allocation a.com/AUTO
+  fixed:
+    lan:
+      ipv4: !allocation a.com/1
+  web:
+    lan:
+      ipv4: !allocation a.com/AUTO/servers
+servers:
+  test:
+    ssh:
+      host: !ipv4address 10.10.10.1
+      user: user
+      identity: %testdir%/test_id_rsa
+      host-key: ssh-rsa AAAAxxx
+    services:
+      ipv4-dhcp:
+        type: dnsmasq.openwrt
+        interface: lan
+        domain: a.com
+        range: !ipv4range 10.0.0.2-10.0.0.4
+        """
+        definition = self._good_definition(fname, fdoc)
+        definition.compute()
+
+        domain = definition.domains['a.com']
+        allocated = dict((str(i), domain.ipv4Subnet[o]) for o, i in domain.interfaceAllocations('ipv4'))
+        assert allocated == {'fixed/lan': IPAddress('10.0.0.1'),
+                             'alpha/lan': IPAddress('10.0.0.5'),
+                             'zed/lan': IPAddress('10.0.0.6'),
+                             'web/lan': IPAddress('10.0.0.8')}
+
+        # Only the device interface with a MAC gets a static DHCP allocation
+        dhcp = definition.servers['test']._services['ipv4-dhcp']
+        assert list(dhcp._staticAllocations.values()) == [(int(IPAddress('10.0.0.6')), 'zed', 'a.com')]
+
+    @yamlDoc
+    def test_auto_allocation_exhausted(self, fname=None, fdoc=None):
+        """
+nameserver: test
+domains:
+  a.com:
+    ipv4-subnet: !ipv4network 10.0.0.0/30
+devices:
+  dev1:
+    lan:
+      ipv4: !allocation a.com/AUTO
+  dev2:
+    lan:
+      ipv4: !allocation a.com/AUTO
+  dev3:
+    lan:
+      ipv4: !allocation a.com/AUTO/nopool
+        """
+        self._bad_compute(fname, fdoc, (14, 13), r'\[devices\|dev3\|lan\|ipv4\] Unknown pool \'nopool\' in domain a.com')
+
+        fdoc = fdoc.replace('a.com/AUTO/nopool', 'a.com/1')
+        self._bad_compute(fname, fdoc, (11, 13), r'\[devices\|dev2\|lan\|ipv4\] No free address left in ipv4 subnet '
+                                                 'of domain a.com')
+
+    @yamlDoc
+    def test_auto_allocation_state(self, tmpdir, fname=None, fdoc=None):
+        """
+nameserver: test
+domains:
+  a.com:
+    ipv4-subnet: !ipv4network 10.0.0.0/24
+devices:
+  bravo:
+    lan:
+      ipv4: !allocation a.com/AUTO
+  charlie:
+    lan:
+      ipv4: !allocation a.com/AUTO
+        """
+        def _allocated(definition):
+            domain = definition.domains['a.com']
+            return dict((str(i.device), o) for o, i in domain.interfaceAllocations('ipv4'))
+
+        stateFile = str(tmpdir.join('definition.state'))
+
+        state = State(stateFile)
+        definition = self._good_definition(fname, fdoc)
+        definition.compute(state)
+        assert _allocated(definition) == {'bravo': 1, 'charlie': 2}
+        assert definition.changed('devices') == {'bravo', 'charlie'}
+        state.save()
+
+        # A new device sorting first does not move the others
+        fdoc = fdoc.replace('devices:\n', 'devices:\n  alpha:\n    lan:\n      ipv4: !allocation a.com/AUTO\n')
+        state = State(stateFile)
+        definition = self._good_definition(fname, fdoc)
+        definition.compute(state)
+        assert _allocated(definition) == {'bravo': 1, 'charlie': 2, 'alpha': 3}
+        assert definition.changed('devices') == {'alpha'}
+        assert definition.changed('domains') == set()
+        state.save()
+
+        # Without state allocation is from scratch
+        definition = self._good_definition(fname, fdoc)
+        definition.compute()
+        assert _allocated(definition) == {'alpha': 1, 'bravo': 2, 'charlie': 3}
+
+        # A removed device frees its address
+        fdoc = fdoc.replace('  bravo:\n    lan:\n      ipv4: !allocation a.com/AUTO\n', '')
+        state = State(stateFile)
+        definition = self._good_definition(fname, fdoc)
+        definition.compute(state)
+        assert _allocated(definition) == {'charlie': 2, 'alpha': 3}
+        assert definition.removed('devices') == {'bravo'}
+
+    @yamlDoc
+    def test_all_errors(self, fname=None, fdoc=None):
+        """
+nameserver: test
+domains:
+  a.com:
+    ipv4-subnet: !ipv4network 10.0.0.0/24
+  b.com:
+    ipv4-subnet: 10
+devices:
+  dev1:
+    lan:
+      mac: !mac 00:01:02:03:04:05
+      ipv4: !allocation a.com/1
+  dev2:
+    lan:
+      mac: !mac 00:01:02:03:04:05
+    wan:
+      ipv4: !allocation a.com/1
+  dev3:
+    lan:
+      ipv4:
+        - !allocation b.com/1
+        - !allocation c.com/1
+        """
+        # Stops at the first error
+        self._bad_definition(fname, fdoc, (6, 18), r'\[domains\|b.com\|ipv4-subnet\] Value of type int')
+
+        definition = Definition.parse(Fragment(Location(fname), ymlstr=fdoc), allErrors=True)
+        assert definition.failed('domains') == {'b.com'}
+        assert list(definition.domains) == ['a.com']
+        with pytest.raises(DefinitionErrors) as e:
+            definition.compute()
+
+        # Nothing is reported about the allocation in b.com, left out for its own error
+        assert [(error.line, error.column, error.section, error.message) for error in e.value.errors] == [
+            (6, 18, 'domains|b.com|ipv4-subnet',
+             'Value of type int for key ipv4-subnet is not of expected type YAML_ipv4network.'),
+            (14, 12, 'devices|dev2|lan|mac', 'MAC address 00:01:02:03:04:05 already defined for device interface dev1/lan'),
+            (21, 11, 'devices|dev3|lan|ipv4[2]', 'Unknown domain \'c.com\' in 2nd allocation'),
+            (16, 13, 'devices|dev2|wan|ipv4',
+             'Address 10.0.0.1 in ipv4 subnet of domain a.com allocated to device interface dev1/lan'),
+        ]
+        assert str(e.value).split('\n')[0] == \
+            'DefinitionError: {}:6:18: [domains|b.com|ipv4-subnet] Value of type int for key ipv4-subnet ' \
+            'is not of expected type YAML_ipv4network.'.format(fname)
+
+    def test_includes(self, tmpdir):
+        tmpdir.join('main.yaml').write('''
+nameserver: test
+domains:
+  a.com:
+    ipv4-subnet: !ipv4network 10.0.0.0/24
+includes:
+  - devices.yaml
+  - sub/servers.yaml
+''')
+        tmpdir.join('devices.yaml').write('''
+devices:
+  dev1:
+    lan:
+      ipv4: !allocation a.com/1
+''')
+        tmpdir.mkdir('sub').join('servers.yaml').write('''
+domains:
+  b.com:
+    ipv4-subnet: !ipv4network 10.0.1.0/24
+includes:
+  - more.yaml
+''')
+        tmpdir.join('sub', 'more.yaml').write('''
+devices:
+  dev2:
+    lan:
+      ipv4: !allocation b.com/1
+  dev3:
+    lan:
+      ipv4: !allocation a.com/1
+''')
+        main = str(tmpdir.join('main.yaml'))
+
+        for fast, jobs in ((False, 1), (True, 1), (True, 2)):
+            definition = Definition.parse(Fragment(Location(main), fast=fast), jobs=jobs)
+            assert list(definition.domains) == ['a.com', 'b.com']
+            assert definition.domains['a.com'].globalDomain
+            assert list(definition.devices) == ['dev1', 'dev2', 'dev3']
+            assert [f[len(str(tmpdir)) + 1:] for f in definition.files] == \
+                ['main.yaml', 'devices.yaml', 'sub/servers.yaml', 'sub/more.yaml']
+
+            # Errors point into the included file
+            with pytest.raises(DefinitionError, match=r'{}:8:13: \[devices\|dev3\|lan\|ipv4\] Address 10.0.0.1'.
+                               format(tmpdir.join('sub', 'more.yaml'))):
+                definition.compute()
+
+        tmpdir.join('devices.yaml').write('''
+devices:
+  dev2:
+    lan:
+      ipv4: !allocation a.com/2
+''')
+        with pytest.raises(DefinitionError, match=r'{}:4:5: \[devices\|dev2\] Device \'dev2\' is already defined'.
+                           format(tmpdir.join('sub', 'more.yaml'))):
+            Definition.parse(Fragment(Location(main), fast=True), jobs=2)
+
+        tmpdir.join('devices.yaml').write('''
+includes:
+  - missing.yaml
+''')
+        with pytest.raises(DefinitionError, match=r'{}:3:5: \[includes\[1\]\] Included file \'.*missing.yaml\' not found'.
+                           format(tmpdir.join('devices.yaml'))):
+            Definition.parse(Fragment(Location(main), fast=True), jobs=2)
+
+    @yamlDoc
+    def test_yaml_released(self, fname=None, fdoc=None):
+        """
+nameserver: test
+domains:
+  a.com:
+    ipv4-subnet: !ipv4network 10.0.0.0/24
+devices:
+  dev1:
+    lan:
+      mac: !mac 00:01:02:03:04:05
+      ipv4: !allocation a.com/1
+  dev2:
+    lan:
+      ipv4: !allocation a.com/AUTO
+servers:
+  test:
+    ssh:
+      host: !ipv4address 10.10.10.1
+      user: user
+      identity: %testdir%/test_id_rsa
+      host-key: ssh-rsa AAAAxxx
+    services:
+      dns:
+        type: dnsmasq.openwrt
+        domains:
+          - a.com
+        """
+        fragment = Fragment(Location(fname), ymlstr=fdoc)
+        yml = weakref.ref(fragment._yml)
+        definition = Definition.parse(fragment)
+        del fragment
+        gc.collect()
+
+        # The model keeps nothing of the YAML once parsed...
+        assert yml() is None
+        definition.compute()
+        assert sorted(definition.devices) == ['dev1', 'dev2']
+
+        # ...but errors found later still have their positions
+        definition = self._good_definition(fname, fdoc.replace('a.com/AUTO', 'a.com/1'))
+        gc.collect()
+        with pytest.raises(DefinitionError, match=r'{}:12:13: \[devices\|dev2\|lan\|ipv4\] Address 10.0.0.1'.format(fname)):
+            definition.compute()
+
+    def test_rewritten_file_positions(self, tmpdir):
+        filename = tmpdir.join('d.yaml')
+        head = """nameserver: test
+domains:
+  a.com:
+    ipv4-subnet: !ipv4network 10.0.0.0/24
+devices:
+"""
+
+        def _compute():
+            definition = Definition.parse(Fragment(Location(str(filename)), fast=True))
+            definition.compute()
+
+        filename.write(head + """  a:
+    lan:
+      ipv4: !allocation a.com/OFFSET/999
+""")
+        with pytest.raises(DefinitionError, match=r'{}:8:13: \[devices\|a\|lan\|ipv4\]'.format(filename)):
+            _compute()
+
+        # The positions of errors are found in the file as it is now, not as first loaded
+        filename.write(head + """  b:
+    lan:
+      mac: !mac 00:01:02:03:04:05
+      ipv4: !allocation a.com/OFFSET/999
+""")
+        with pytest.raises(DefinitionError, match=r'{}:9:13: \[devices\|b\|lan\|ipv4\]'.format(filename)):
+            _compute()
+
     @classmethod
     def tear_down(self):
         pass
@@ -5,6 +5,16 @@ test_nsct
 
 Tests for `nsct` module.
 """
+from os.path import dirname, join, realpath
+import sys
+
+# The parser of -X importtime output is shared with benchmarks/startup.py
+sys.path.insert(0, join(dirname(dirname(realpath(__file__))), 'benchmarks'))
+from startup import importTimes  # noqa
+
+# The ceiling on the time `import nsct.__main__` may take, in microseconds.  Generous, so as not to fail on a
+# slow or busy machine, but it still catches something as heavy as paramiko coming back.
+STARTUP_BUDGET = 1000000
 
 
 class TestNsct(object):
@@ -15,3 +25,20 @@ class TestNsct(object):
     @classmethod
     def tear_down(self):
         pass
+
+    def test_startup(self):
+        times = importTimes()
+        assert 'nsct.__main__' in times
+        assert 'paramiko' not in times
+        assert 'cryptography' not in times
+        assert times['nsct.__main__'][1] < STARTUP_BUDGET, 'import nsct.__main__ took {}us'.format(times['nsct.__main__'][1])
+
+    def test_check_does_not_import_ssh(self, tmpdir):
+        definition = tmpdir.join('definition.yaml')
+        definition.write('nameserver: test\n'
+                         'domains:\n'
+                         '  a.com:\n'
+                         '    ipv4-subnet: !ipv4network 10.0.0.0/24\n')
+        times = importTimes('-m', 'nsct', str(definition), '--check', '--no-cache')
+        assert 'nsct.definition' in times
+        assert 'paramiko' not in times
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+test_plan
+----------------------------------
+
+Tests for `nsct.plan` module.
+"""
+from functools import wraps
+from inspect import getdoc
+from os.path import dirname, realpath
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from nsct.definition import Definition
+from nsct.plan import plan
+from nsct.yaml import Fragment, Location
+
+
+def yamlDoc(f):
+    __f_name__ = f.__name__
+    __f_doc__ = getdoc(f)
+    assert __f_doc__ is not None, '@yamlDoc function must have YAML in document string'
+
+    __f_doc__ = __f_doc__.strip().replace('%testdir%', dirname(realpath(__file__)))
+
+    @wraps(f)
+    def new_f(*args, **kwargs):
+        kwargs['fname'] = __f_name__
+        kwargs['fdoc'] = __f_doc__
+
+        return f(*args, **kwargs)
+    return new_f
+
+
+class TestPlan(object):
+    @classmethod
+    def set_up(self):
+        pass
+
+    @classmethod
+    def tear_down(self):
+        pass
+
+    def _definition(self, fname, fdoc):
+        definition = Definition.parse(Fragment(Location(fname), ymlstr=fdoc))
+        definition.compute()
+        return definition
+
+    @yamlDoc
+    def test_plan(self, fname=None, fdoc=None):
+        """
+nameserver: test
+domains:
+  a.com:
+    ipv4-subnet: !ipv4network 10.0.0.0/24
+    records:
+      mx:
+        a.com: !mx 10/mail.a.com
+devices:
+  dev1:
+    lan:
+      mac: !mac 00:01:02:03:04:05
+      ipv4: !allocation a.com/1
+  dev2:
+    lan:
+      mac: !mac 00:01:02:03:04:06
+      ipv4: !allocation a.com/2
+servers:
+  router:
+    ssh:
+      host: !ipv4address 10.0.0.254
+      user: root
+      identity: %testdir%/test_id_rsa
+      host-key: ssh-rsa AAAAB3NzaC1yc2E=
+    services:
+      ipv4-dhcp:
+        type: dnsmasq.openwrt
+        interface: lan
+        domain: a.com
+        range: !ipv4range 10.0.0.100-10.0.0.199
+      dns:
+        type: dnsmasq.openwrt
+        domains:
+          - a.com
+      ethers:
+        type: dnsmasq.openwrt
+        """
+        old = self._definition(fname, fdoc)
+        assert len(plan(old, self._definition(fname, fdoc))) == 0
+
+        new = fdoc.replace('a.com/2', 'a.com/7').replace('10/mail', '20/mail').replace('00:01:02:03:04:05', '00:01:02:03:04:15')
+        p = plan(old, self._definition(fname, new))
+
+        assert [(c.scope, c.kind, c.key, c.action) for c in p.changes] == [
+            ('servers/router/ipv4-dhcp', 'dhcp-statics', '00:01:02:03:04:05', 'remove'),
+            ('servers/router/ipv4-dhcp', 'dhcp-statics', '00:01:02:03:04:06', 'change'),
+            ('servers/router/ipv4-dhcp', 'dhcp-statics', '00:01:02:03:04:15', 'add'),
+            ('servers/router/dns', 'hosts', 'dev2.a.com', 'change'),
+            ('servers/router/ethers', 'ethers', '00:01:02:03:04:05', 'remove'),
+            ('servers/router/ethers', 'ethers', '00:01:02:03:04:15', 'add'),
+            ('domains/a.com', 'mx', 'a.com', 'change'),
+            ('domains/a.com', 'a', 'dev2', 'change')]
+        assert p.services() == {'router': ['ipv4-dhcp', 'dns', 'ethers']}
+        assert str(p).startswith('servers/router/ipv4-dhcp:\n  dhcp-statics:\n    - 00:01:02:03:04:05 10.0.0.1 dev1\n')
+        assert '    ~ dev2.a.com 10.0.0.2 -> 10.0.0.7\n' in str(p)
+        assert p.asDict()['changes'][3] == {'scope': 'servers/router/dns', 'kind': 'hosts', 'key': 'dev2.a.com',
+                                            'action': 'change', 'old': '10.0.0.2', 'new': '10.0.0.7'}
+
+        # Removing a server removes everything its services configured
+        p = plan(old, self._definition(fname, fdoc[:fdoc.index('servers:')]))
+        assert p.services() == {'router': ['ipv4-dhcp', 'dns', 'ethers']}
+        assert all(c.action == 'remove' for c in p.changes)
+        assert '- dev1.a.com 10.0.0.1' in [str(c) for c in p.changes]
+
+    @yamlDoc
+    def test_unchanged_services_not_compared(self, fname=None, fdoc=None):
+        """
+nameserver: test
+domains:
+  a.com:
+    ipv4-subnet: !ipv4network 10.0.0.0/24
+devices:
+  dev1:
+    lan:
+      mac: !mac 00:01:02:03:04:05
+      ipv4: !allocation a.com/1
+servers:
+  router:
+    ssh:
+      host: !ipv4address 10.0.0.254
+      user: root
+      identity: %testdir%/test_id_rsa
+      host-key: ssh-rsa AAAAB3NzaC1yc2E=
+    services:
+      dns:
+        type: dnsmasq.openwrt
+        domains:
+          - a.com
+      ethers:
+        type: dnsmasq.openwrt
+        """
+        old = self._definition(fname, fdoc)
+        new = self._definition(fname, fdoc.replace('00:01:02:03:04:05', '00:01:02:03:04:15'))
+
+        dns = new.servers['router'].services['dns']
+        with mock.patch.object(type(dns), 'snapshot') as snapshot:
+            p = plan(old, new)
+            assert snapshot.call_count == 0
+        assert p.services() == {'router': ['ethers']}
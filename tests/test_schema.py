@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+test_schema
+----------------------------------
+
+Tests for `nsct.schema` module.
+"""
+from functools import wraps
+from inspect import getdoc
+import pytest
+
+from nsct._compat import string_types, integer_types
+from nsct.schema import Schema, Key
+from nsct.yaml import Fragment, Location, DefinitionError, YAML_ipv4address, YAML_a
+
+
+def yamlDoc(f):
+    __f_name__ = f.__name__
+    __f_doc__ = getdoc(f)
+    assert __f_doc__ is not None, '@yamlDoc function must have YAML in document string'
+
+    __f_doc__ = __f_doc__.strip()
+
+    @wraps(f)
+    def new_f(*args, **kwargs):
+        kwargs['fname'] = __f_name__
+        kwargs['fdoc'] = __f_doc__
+
+        return f(*args, **kwargs)
+    return new_f
+
+
+schema = Schema(Key('ssh.host', YAML_ipv4address),
+                Key('ssh.port', integer_types, required=False, default=22),
+                Key('ssh.user', string_types),
+                Key('extra.thing', string_types, required=False, default='none'),
+                Key('records', dict, required=False, itemType=YAML_a, itemSource='for a record'))
+
+
+class TestSchema(object):
+    @classmethod
+    def set_up(self):
+        pass
+
+    @classmethod
+    def tear_down(self):
+        pass
+
+    def _bad_schema(self, fname, fdoc, location, error):
+        fragment = Fragment(Location(fname), ymlstr=fdoc)
+        with pytest.raises(DefinitionError, match=r'{}:{}:{}: {}'.format(fname, location[0], location[1], error)):
+            schema.validate(fragment)
+
+    @yamlDoc
+    def test_schema_good(self, fname=None, fdoc=None):
+        """
+ssh:
+  host: !ipv4address 10.0.0.1
+  user: root
+records:
+  www: !a 10.0.0.2
+        """
+        record = schema.validate(Fragment(Location(fname), ymlstr=fdoc))
+        assert str(record['ssh.host']) == '10.0.0.1'
+        assert record['ssh.port'] == 22
+        assert record['ssh.user'] == 'root'
+        assert record['extra.thing'] == 'none'
+        assert record.fragment('ssh.port') is None
+        assert repr(record.fragment('ssh.user')) == '{}:3:9: [ssh|user]'.format(fname)
+        assert [(n, str(v), repr(f)) for n, v, f in record.items('records')] == \
+            [('www', '10.0.0.2', '{}:5:8: [records|www]'.format(fname))]
+
+    @yamlDoc
+    def test_schema_missing(self, fname=None, fdoc=None):
+        """
+ssh:
+  host: !ipv4address 10.0.0.1
+        """
+        self._bad_schema(fname, fdoc, (2, 3), r'\[ssh\] Missing required key \'user\'')
+
+    @yamlDoc
+    def test_schema_missing_parent(self, fname=None, fdoc=None):
+        """
+extra:
+  thing: x
+        """
+        self._bad_schema(fname, fdoc, (1, 1), r'Missing required key \'ssh\'')
+
+    @yamlDoc
+    def test_schema_bad_type(self, fname=None, fdoc=None):
+        """
+ssh:
+  host: !ipv4address 10.0.0.1
+  user: root
+  port: twenty-two
+        """
+        self._bad_schema(fname, fdoc, (4, 9), r'\[ssh\|port\] Value of type str for key port is not of expected type int')
+
+    @yamlDoc
+    def test_schema_bad_parent_type(self, fname=None, fdoc=None):
+        """
+ssh: [ 1, 2 ]
+        """
+        self._bad_schema(fname, fdoc, (1, 6), r'\[ssh\] Value of type .* for key ssh is not of expected type dict')
+
+    @yamlDoc
+    def test_schema_bad_item_type(self, fname=None, fdoc=None):
+        """
+ssh:
+  host: !ipv4address 10.0.0.1
+  user: root
+records:
+  www: 10.0.0.2
+        """
+        self._bad_schema(fname, fdoc, (5, 8), r'\[records\|www\] Value of type str for a record is not of expected type YAML_a')
@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+"""
+test_server
+----------------------------------
+
+Tests for `nsct.server` module.
+"""
+from functools import wraps
+from inspect import getdoc
+from os.path import dirname, realpath
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from nsct.yaml import Fragment, Location
+from nsct.definition import Definition
+from nsct.sink import CONNECT_TIMEOUT, DirectorySink
+from nsct.state import State
+from nsct.support import supportedServices
+
+
+def yamlDoc(f):
+    __f_name__ = f.__name__
+    __f_doc__ = getdoc(f)
+    assert __f_doc__ is not None, '@yamlDoc function must have YAML in document string'
+
+    __f_doc__ = __f_doc__.strip().replace('%testdir%', dirname(realpath(__file__)))
+
+    @wraps(f)
+    def new_f(*args, **kwargs):
+        kwargs['fname'] = __f_name__
+        kwargs['fdoc'] = __f_doc__
+
+        return f(*args, **kwargs)
+    return new_f
+
+
+class TestServer(object):
+    @classmethod
+    def set_up(self):
+        pass
+
+    @classmethod
+    def tear_down(self):
+        pass
+
+    def _definition(self, fname, fdoc):
+        definition = Definition.parse(Fragment(Location(fname), ymlstr=fdoc))
+        definition.compute()
+        return definition
+
+    @yamlDoc
+    def test_single_connection_per_server(self, fname=None, fdoc=None):
+        """
+nameserver: test
+domains:
+  a.com:
+    ipv4-subnet: !ipv4network 10.0.0.0/24
+devices:
+  dev1:
+    lan:
+      mac: !mac 00:01:02:03:04:05
+      ipv4: !allocation a.com/1
+servers:
+  router:
+    ssh:
+      host: !ipv4address 10.0.0.254
+      user: root
+      identity: %testdir%/test_id_rsa
+      host-key: ssh-rsa AAAAB3NzaC1yc2E=
+    services:
+      ipv4-dhcp:
+        type: dnsmasq.openwrt
+        interface: lan
+        domain: a.com
+        range: !ipv4range 10.0.0.100-10.0.0.199
+      dns:
+        type: dnsmasq.openwrt
+        domains:
+          - a.com
+      ethers:
+        type: dnsmasq.openwrt
+        """
+        definition = self._definition(fname, fdoc)
+
+        with mock.patch('nsct.sink.paramiko') as paramiko:
+            session = paramiko.SSHClient.return_value.get_transport.return_value.open_session.return_value
+            session.recv_exit_status.return_value = 0
+            try:
+                results = definition.generate(list(supportedServices))
+            finally:
+                definition.close()
+
+            # dnsmasq is restarted once, the restart needed by DHCP superseding the hosts/ethers reloads
+            commands = [c[0][0] for c in session.exec_command.call_args_list]
+            assert commands == ['/bin/ash -s', '/etc/init.d/dnsmasq restart']
+
+            assert paramiko.SSHClient.call_count == 1
+            assert paramiko.SSHClient.return_value.connect.call_count == 1
+            assert paramiko.SFTPClient.from_transport.call_count == 1
+            assert paramiko.SSHClient.return_value.close.call_count == 1
+
+        assert len(results) == 1
+        assert results[0].ok
+        assert results[0].succeeded == ['ipv4-dhcp', 'dns', 'ethers']
+
+    @yamlDoc
+    def test_dhcp_single_uci_batch(self, fname=None, fdoc=None):
+        """
+nameserver: test
+domains:
+  a.com:
+    ipv4-subnet: !ipv4network 10.0.0.0/24
+devices:
+  dev1:
+    lan:
+      mac: !mac 00:01:02:03:04:05
+      ipv4: !allocation a.com/1
+servers:
+  router:
+    ssh:
+      host: !ipv4address 10.0.0.254
+      user: root
+      identity: %testdir%/test_id_rsa
+      host-key: ssh-rsa AAAAB3NzaC1yc2E=
+    services:
+      ipv4-dhcp:
+        type: dnsmasq.openwrt
+        interface: lan
+        domain: a.com
+        range: !ipv4range 10.0.0.100-10.0.0.199
+      dns:
+        type: dnsmasq.openwrt
+        domains:
+          - a.com
+      ethers:
+        type: dnsmasq.openwrt
+        """
+        definition = self._definition(fname, fdoc)
+
+        with mock.patch('nsct.sink.paramiko') as paramiko:
+            session = paramiko.SSHClient.return_value.get_transport.return_value.open_session.return_value
+            session.recv_exit_status.return_value = 0
+            try:
+                definition.generate(['ipv4-dhcp'])
+            finally:
+                definition.close()
+
+            commands = [c[0][0] for c in session.exec_command.call_args_list]
+            assert commands == ['/bin/ash -s', '/etc/init.d/dnsmasq restart']
+
+            script = session.sendall.call_args_list[0][0][0].decode('utf-8')
+            assert 'set dhcp.lan.start=\'100\'' in script
+            assert 'set dhcp.@host[-1].ip=\'10.0.0.1\'' in script
+            assert 'set dhcp.@host[-1].name=\'dev1\'' in script
+            assert 'uci revert dhcp' in script
+
+            # A failure is left to the batch to revert, and is what is reported
+            for effect, error in ((lambda: 1, 'uci batch returned 1'), (IOError('connection lost'), 'connection lost')):
+                session.reset_mock()
+                session.recv_exit_status.side_effect = effect
+                try:
+                    results = definition.generate(['ipv4-dhcp'])
+                finally:
+                    definition.close()
+                assert [c[0][0] for c in session.exec_command.call_args_list] == ['/bin/ash -s']
+                assert [(action, str(e)) for action, e in results[0].failed] == [('ipv4-dhcp', error)]
+
+    @yamlDoc
+    def test_parallel_generate_collects_errors(self, fname=None, fdoc=None):
+        """
+nameserver: test
+domains:
+  a.com:
+    ipv4-subnet: !ipv4network 10.0.0.0/24
+servers:
+  good:
+    ssh:
+      host: !ipv4address 10.0.0.253
+      user: root
+      identity: %testdir%/test_id_rsa
+      host-key: ssh-rsa AAAAB3NzaC1yc2E=
+    services:
+      dns:
+        type: dnsmasq.openwrt
+        domains:
+          - a.com
+  bad:
+    ssh:
+      host: !ipv4address 10.0.0.254
+      user: root
+      identity: %testdir%/test_id_rsa
+      host-key: ssh-rsa AAAAB3NzaC1yc2E=
+    services:
+      dns:
+        type: dnsmasq.openwrt
+        domains:
+          - a.com
+      ethers:
+        type: dnsmasq.openwrt
+        """
+        definition = self._definition(fname, fdoc)
+
+        connects = []
+
+        def connect(host, **kwargs):
+            connects.append((host, kwargs['timeout']))
+            if host == '10.0.0.254':
+                raise IOError('unreachable')
+
+        with mock.patch('nsct.sink.paramiko') as paramiko:
+            paramiko.SSHClient.return_value.connect.side_effect = connect
+            paramiko.SSHClient.return_value.get_transport.return_value.open_session.return_value.\
+                recv_exit_status.return_value = 0
+            results = definition.generate(list(supportedServices), jobs=2)
+
+        assert [r.name for r in results] == ['good', 'bad']
+        assert results[0].ok
+        assert results[0].succeeded == ['dns']
+        assert not results[1].ok
+        assert [(a, str(e)) for a, e in results[1].failed] == [('dns', 'unreachable'), ('ethers', 'unreachable')]
+
+        # The unreachable server is only tried once, not once for each of its services
+        assert sorted(connects) == [('10.0.0.253', CONNECT_TIMEOUT), ('10.0.0.254', CONNECT_TIMEOUT)]
+
+    @yamlDoc
+    def test_hosts_and_ethers_reload_once(self, fname=None, fdoc=None):
+        """
+nameserver: test
+domains:
+  a.com:
+    ipv4-subnet: !ipv4network 10.0.0.0/24
+servers:
+  router:
+    ssh:
+      host: !ipv4address 10.0.0.254
+      user: root
+      identity: %testdir%/test_id_rsa
+      host-key: ssh-rsa AAAAB3NzaC1yc2E=
+    services:
+      dns:
+        type: dnsmasq.openwrt
+        domains:
+          - a.com
+      ethers:
+        type: dnsmasq.openwrt
+        """
+        definition = self._definition(fname, fdoc)
+
+        with mock.patch('nsct.sink.paramiko') as paramiko:
+            session = paramiko.SSHClient.return_value.get_transport.return_value.open_session.return_value
+            session.recv_exit_status.return_value = 0
+            results = definition.generate(list(supportedServices))
+
+            commands = [c[0][0] for c in session.exec_command.call_args_list]
+            assert commands == ['killall -HUP dnsmasq']
+
+        assert results[0].succeeded == ['dns', 'ethers']
+
+    @yamlDoc
+    def test_unchanged_services_skipped(self, tmpdir, fname=None, fdoc=None):
+        """
+nameserver: test
+domains:
+  a.com:
+    ipv4-subnet: !ipv4network 10.0.0.0/24
+devices:
+  dev1:
+    lan:
+      mac: !mac 00:01:02:03:04:05
+      ipv4: !allocation a.com/1
+servers:
+  router:
+    ssh:
+      host: !ipv4address 10.0.0.254
+      user: root
+      identity: %testdir%/test_id_rsa
+      host-key: ssh-rsa AAAAB3NzaC1yc2E=
+    services:
+      dns:
+        type: dnsmasq.openwrt
+        domains:
+          - a.com
+      ethers:
+        type: dnsmasq.openwrt
+        """
+        stateFile = str(tmpdir.join('definition.state'))
+
+        with mock.patch('nsct.sink.paramiko') as paramiko:
+            paramiko.SSHClient.return_value.get_transport.return_value.open_session.return_value.\
+                recv_exit_status.return_value = 0
+
+            state = State(stateFile)
+            results = self._definition(fname, fdoc).generate(list(supportedServices), state=state)
+            state.save()
+            assert results[0].succeeded == ['dns', 'ethers']
+            assert paramiko.SSHClient.call_count == 1
+
+            # Nothing changed: no connection is made at all
+            state = State(stateFile)
+            results = self._definition(fname, fdoc).generate(list(supportedServices), state=state)
+            assert results[0].succeeded == []
+            assert results[0].skipped == ['dns', 'ethers']
+            assert paramiko.SSHClient.call_count == 1
+
+            # Forced
+            results = self._definition(fname, fdoc).generate(list(supportedServices), state=state, force=True)
+            assert results[0].succeeded == ['dns', 'ethers']
+            assert paramiko.SSHClient.call_count == 2
+
+            # Only the changed service is generated
+            fdoc = fdoc.replace('a.com/1', 'a.com/2')
+            results = self._definition(fname, fdoc).generate(list(supportedServices), state=state)
+            assert results[0].succeeded == ['dns']
+            assert results[0].skipped == ['ethers']
+
+            # A server re-pointed at another box, or port, is configured in full
+            for old, new in (('10.0.0.254', '10.0.0.253'), ('user: root', 'port: 2222\n      user: root')):
+                fdoc = fdoc.replace(old, new)
+                results = self._definition(fname, fdoc).generate(list(supportedServices), state=state)
+                assert results[0].succeeded == ['dns', 'ethers']
+                results = self._definition(fname, fdoc).generate(list(supportedServices), state=state)
+                assert results[0].skipped == ['dns', 'ethers']
+
+    @yamlDoc
+    def test_directory_sink(self, tmpdir, fname=None, fdoc=None):
+        """
+nameserver: test
+domains:
+  a.com:
+    ipv4-subnet: !ipv4network 10.0.0.0/24
+devices:
+  dev1:
+    lan:
+      mac: !mac 00:01:02:03:04:05
+      ipv4: !allocation a.com/1
+servers:
+  router:
+    ssh:
+      host: !ipv4address 10.0.0.254
+      user: root
+      identity: %testdir%/test_id_rsa
+      host-key: ssh-rsa AAAAB3NzaC1yc2E=
+    services:
+      ipv4-dhcp:
+        type: dnsmasq.openwrt
+        interface: lan
+        domain: a.com
+        range: !ipv4range 10.0.0.100-10.0.0.199
+      dns:
+        type: dnsmasq.openwrt
+        domains:
+          - a.com
+      ethers:
+        type: dnsmasq.openwrt
+      smokeping:
+        type: docker
+        config-name: /srv/smokeping/Targets
+        domains:
+          - a.com
+        """
+        definition = self._definition(fname, fdoc)
+        results = definition.generate(list(supportedServices),
+                                      sinkFactory=lambda server: DirectorySink(str(tmpdir.join(str(server)))))
+        assert results[0].succeeded == ['ipv4-dhcp', 'dns', 'ethers', 'smokeping']
+
+        root = tmpdir.join('router')
+        assert '10.0.0.1\tdev1.a.com\n' in root.join('etc', 'hosts').read()
+        assert root.join('etc', 'ethers').read() == '00:01:02:03:04:05 dev1\n'
+        assert 'host = 10.0.0.1\n' in root.join('srv', 'smokeping', 'Targets').read()
+
+        commands = root.join('commands.sh').read()
+        assert commands.startswith("/bin/ash -s <<'__NSCT_STDIN_EOF__'\n")
+        assert "set dhcp.@host[-1].mac='00:01:02:03:04:05'\n" in commands
+        assert commands.endswith('__NSCT_STDIN_EOF__\n/etc/init.d/dnsmasq restart\nsudo systemctl restart docker-smokeping\n')
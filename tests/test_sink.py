@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+test_sink
+----------------------------------
+
+Tests for `nsct.sink` module.
+"""
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import pytest
+
+from nsct.sink import CHUNK_SIZE, DirectorySink, SinkPool, SSHSink, encodedChunks, stagingPath
+
+
+class TestSink(object):
+    @classmethod
+    def set_up(self):
+        pass
+
+    @classmethod
+    def tear_down(self):
+        pass
+
+    def test_encoded_chunks(self):
+        assert list(encodedChunks('')) == [b'']
+        assert list(encodedChunks('abc')) == [b'abc']
+        assert list(encodedChunks(['a\n', 'b\n', 'c\n'])) == [b'a\nb\nc\n']
+        assert list(encodedChunks(iter([]))) == []
+        assert list(encodedChunks(['é'])) == [b'\xc3\xa9']
+
+        chunks = list(encodedChunks(('x' * 10 for i in range(25)), size=100))
+        assert chunks == [b'x' * 100, b'x' * 100, b'x' * 50]
+
+    def test_staging_path(self):
+        assert stagingPath('/etc/hosts') == '/etc/.hosts.nsct-tmp'
+        assert stagingPath('/srv/smokeping/Targets') == '/srv/smokeping/.Targets.nsct-tmp'
+
+    def test_ssh_write_file_streams(self):
+        server = mock.MagicMock()
+        sink = SSHSink(server)
+
+        def lines():
+            for i in range(3):
+                yield 'line {}\n'.format(i)
+
+        with mock.patch('nsct.sink.paramiko') as paramiko:
+            sftp = paramiko.SFTPClient.from_transport.return_value
+            sftp.stat.return_value.st_mode = 0o100644
+            f = sftp.open.return_value.__enter__.return_value
+            sink.writeFile('/etc/hosts', lines())
+
+            sftp.open.assert_called_once_with('/etc/.hosts.nsct-tmp', 'w', bufsize=CHUNK_SIZE)
+            f.set_pipelined.assert_called_once_with(True)
+            f.chmod.assert_called_once_with(0o644)
+            assert b''.join(c[0][0] for c in f.write.call_args_list) == b'line 0\nline 1\nline 2\n'
+            sftp.posix_rename.assert_called_once_with('/etc/.hosts.nsct-tmp', '/etc/hosts')
+
+    def test_ssh_write_file_failure(self):
+        sink = SSHSink(mock.MagicMock())
+
+        with mock.patch('nsct.sink.paramiko') as paramiko:
+            sftp = paramiko.SFTPClient.from_transport.return_value
+            sftp.stat.side_effect = IOError('No such file')
+            f = sftp.open.return_value.__enter__.return_value
+            f.write.side_effect = IOError('Connection lost')
+            with pytest.raises(IOError, match='Connection lost'):
+                sink.writeFile('/etc/ethers', 'aa:bb:cc:dd:ee:ff host\n')
+
+            # The file itself is never touched
+            assert f.chmod.call_count == 0
+            assert sftp.posix_rename.call_count == 0
+            sftp.remove.assert_called_once_with('/etc/.ethers.nsct-tmp')
+
+    def test_sink_pool(self):
+        def server(name, host='10.0.0.254'):
+            s = mock.MagicMock()
+            s.__str__.return_value = name
+            s.ssh.host = host
+            s.ssh.port = 22
+            s.ssh.user = 'root'
+            s.ssh.identity = 'id_rsa'
+            s.ssh.hostkeyType = 'ssh-rsa'
+            s.ssh.hostkeyValue = 'AAAA'
+            return s
+
+        pool = SinkPool()
+        with mock.patch('nsct.sink.paramiko') as paramiko:
+            transport = paramiko.SSHClient.return_value.get_transport.return_value
+            transport.is_active.return_value = True
+
+            first = server('router')
+            pool.sink(first).execCommand('true')
+            pool.sink(first).close()
+            assert paramiko.SSHClient.call_count == 1
+
+            # The same server in a new definition reuses the connection
+            pool.sink(server('router')).execCommand('true')
+            assert paramiko.SSHClient.call_count == 1
+            assert len(pool) == 1
+
+            # A lost connection is made again
+            transport.is_active.return_value = False
+            pool.sink(server('router')).execCommand('true')
+            assert paramiko.SSHClient.call_count == 2
+            transport.is_active.return_value = True
+
+            # A connection that could not be made is tried again, but only on the next generation
+            paramiko.SSHClient.return_value.connect.side_effect = IOError('unreachable')
+            unreachable = server('unreachable', host='10.0.0.1')
+            sink = pool.sink(unreachable)
+            for i in range(2):
+                with pytest.raises(IOError, match='unreachable'):
+                    sink.execCommand('true')
+            assert paramiko.SSHClient.call_count == 3
+            paramiko.SSHClient.return_value.connect.side_effect = None
+            pool.sink(unreachable).execCommand('true')
+            assert paramiko.SSHClient.call_count == 4
+            pool.prune([server('router')])
+
+            # Servers that have gone, or moved, are closed
+            moved = server('router', host='10.0.0.253')
+            pool.sink(moved).execCommand('true')
+            assert paramiko.SSHClient.call_count == 5
+            assert len(pool) == 2
+            pool.prune([moved])
+            assert len(pool) == 1
+            assert paramiko.SSHClient.return_value.close.call_count == 4
+
+            pool.close()
+            assert len(pool) == 0
+            assert paramiko.SSHClient.return_value.close.call_count == 5
+
+    def test_directory_sink_streams(self, tmpdir):
+        sink = DirectorySink(str(tmpdir))
+        sink.writeFile('/etc/ethers', iter(['a\n', 'b\n']))
+        sink.execCommand('/bin/ash -s', stdin=iter(['echo a\n', 'echo b']))
+        sink.close()
+
+        assert tmpdir.join('etc', 'ethers').read() == 'a\nb\n'
+        assert tmpdir.join('etc').listdir() == [tmpdir.join('etc', 'ethers')]
+        assert tmpdir.join('commands.sh').read() == "/bin/ash -s <<'__NSCT_STDIN_EOF__'\necho a\necho b\n__NSCT_STDIN_EOF__\n"
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+test_timing
+----------------------------------
+
+Tests for `nsct.timing` module.
+"""
+import json
+import time
+
+from nsct.sink import DirectorySink
+from nsct.timing import Timings, timings
+
+
+class TestTiming(object):
+    @classmethod
+    def set_up(self):
+        pass
+
+    @classmethod
+    def tear_down(self):
+        pass
+
+    def test_disabled(self):
+        t = Timings()
+        with t.span('parse', filename='a.yaml') as span:
+            span.exclude(1.0)
+        assert list(t.iterate('render', iter(['a', 'b']))) == ['a', 'b']
+        assert t.spans == []
+
+    def test_spans(self):
+        t = Timings()
+        t.enable()
+        with t.span('parse', filename='a.yaml'):
+            pass
+        for i in range(3):
+            with t.span('compute.device', device=i):
+                pass
+
+        assert [span.name for span in t.spans] == ['parse'] + ['compute.device'] * 3
+        assert t.spans[0].attrs == {'filename': 'a.yaml'}
+        assert all(span.duration >= 0 for span in t.spans)
+
+        summary = t.summary().splitlines()
+        assert summary[0].split() == ['Step', 'Count', 'Total', 'ms', 'Mean', 'ms', 'Max', 'ms']
+        assert summary[1].split()[:2] == ['parse', '1']
+        assert summary[2].split()[:2] == ['compute.device', '3']
+
+        trace = json.loads(json.dumps(t.asTrace()))
+        assert [event['name'] for event in trace['traceEvents']] == ['parse'] + ['compute.device'] * 3
+        assert trace['traceEvents'][0]['ph'] == 'X'
+        assert trace['traceEvents'][0]['args'] == {'filename': 'a.yaml'}
+        assert trace['traceEvents'][1]['args'] == {'device': '0'}
+
+        # Enabling again starts afresh
+        t.enable()
+        assert t.spans == []
+
+    def test_render_excluded_from_transfer(self):
+        t = Timings()
+        t.enable()
+
+        def render():
+            for i in range(2):
+                time.sleep(0.02)
+                yield 'line {}\n'.format(i)
+
+        with t.span('transfer') as span:
+            assert ''.join(t.iterate('render', render(), span)) == 'line 0\nline 1\n'
+
+        render, transfer = t.spans
+        assert render.name == 'render'
+        assert render.duration >= 0.04
+        assert transfer.name == 'transfer'
+        assert transfer.duration < 0.02
+
+    def test_sink_spans(self, tmpdir):
+        t = timings
+        t.enable()
+        try:
+            sink = DirectorySink(str(tmpdir))
+            sink.writeFile('/etc/ethers', iter(['a\n', 'b\n']))
+        finally:
+            t.disable()
+        assert [span.name for span in t.spans] == ['render', 'transfer']
+        assert t.spans[1].attrs['path'] == str(tmpdir.join('etc', 'ethers'))
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+test_watch
+----------------------------------
+
+Tests for `nsct.watch` module.
+"""
+from argparse import Namespace
+from threading import Timer
+
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from nsct import watch
+from nsct.__main__ import _watch
+from nsct.definition import Definition
+from nsct.watch import FileWatcher
+
+
+class TestWatch(object):
+    @classmethod
+    def set_up(self):
+        pass
+
+    @classmethod
+    def tear_down(self):
+        pass
+
+    @pytest.mark.parametrize('inotify', [False, pytest.param(True, marks=pytest.mark.skipif(
+        watch.inotify_simple is None, reason='inotify_simple is not installed'))])
+    def test_wait(self, tmpdir, inotify):
+        a = tmpdir.join('a.yaml')
+        b = tmpdir.join('b.yaml')
+        a.write('a: 1\n')
+        b.write('b: 1\n')
+
+        watcher = FileWatcher([str(a), str(b)], interval=0.01, settle=0.01, inotify=inotify)
+        timer = Timer(0.05, lambda: b.write('b: 22\n'))
+        timer.start()
+        try:
+            assert watcher.wait() == set([str(b)])
+        finally:
+            timer.join()
+
+        # Appearing and disappearing count as changes too
+        c = tmpdir.join('c.yaml')
+        watcher.watch([str(a), str(c)])
+        c.write('c: 1\n')
+        assert watcher.wait() == set([str(c)])
+        a.remove()
+        assert watcher.wait() == set([str(a)])
+
+    def test_change_before_wait(self, tmpdir):
+        a = tmpdir.join('a.yaml')
+        a.write('a: 1\n')
+
+        watcher = FileWatcher([str(a)], interval=0.01, settle=0.01)
+        a.write('a: 22\n')
+
+        # Watching again keeps what the file was compared with
+        b = tmpdir.join('b.yaml')
+        b.write('b: 1\n')
+        watcher.watch([str(a), str(b)])
+        assert watcher.wait() == set([str(a)])
+
+    def test_watch_survives_errors(self, tmpdir, capsys):
+        filename = tmpdir.join('d.yaml')
+        head = """nameserver: test
+domains:
+  a.com:
+    ipv4-subnet: !ipv4network 10.0.0.0/24
+devices:
+"""
+        bad = """  {}:
+    lan:
+      ipv4: !allocation a.com/OFFSET/999
+"""
+        good = """  ok:
+    lan:
+      ipv4: !allocation a.com/1
+"""
+        # What is written on each change; after the last, the loop is interrupted
+        edits = [head + bad.format('b'), head + good + bad.format('c'), head + good, None]
+        filename.write(head + bad.format('a'))
+
+        def wait():
+            edit = edits.pop(0)
+            if edit is None:
+                raise KeyboardInterrupt
+            filename.write(edit)
+
+        args = Namespace(filename=Namespace(name=str(filename)), all_errors=False, jobs=1, json=False, force=False,
+                         output_dir=str(tmpdir.join('out')), state=None, watch_interval=0.01)
+        with mock.patch('nsct.__main__.FileWatcher') as watcher, \
+                mock.patch.object(Definition, 'generate', side_effect=RuntimeError('connection lost')) as generate:
+            watcher.return_value.wait.side_effect = wait
+            _watch(args, ['dns'], None)
+
+        # Each bad edit is reported where it is, and the unexpected failure of the last is survived
+        assert edits == []
+        assert generate.call_count == 1
+        out = capsys.readouterr().out
+        for device, line in (('a', 8), ('b', 8), ('c', 11)):
+            assert '{}:{}:13: [devices|{}|lan|ipv4]'.format(filename, line, device) in out
@@ -462,6 +462,29 @@ class TestNsct(object):
         assert allocation.isAliasStrategy
         assert allocation.offset == 2
 
+    @yamlDoc
+    def test_yaml_good_allocation_5(self, fname=None, fdoc=None):
+        """
+!allocation domain/AUTO
+        """
+        f = self._good_yaml(fname, fdoc)
+        allocation = f.getValue(YAML_allocation)
+        assert allocation.domain == 'domain'
+        assert allocation.strategyType == 'AUTO'
+        assert allocation.isAutoStrategy
+        assert allocation.pool is None
+
+    @yamlDoc
+    def test_yaml_good_allocation_6(self, fname=None, fdoc=None):
+        """
+!allocation domain/AUTO/servers
+        """
+        f = self._good_yaml(fname, fdoc)
+        allocation = f.getValue(YAML_allocation)
+        assert allocation.domain == 'domain'
+        assert allocation.isAutoStrategy
+        assert allocation.pool == 'servers'
+
     @yamlDoc
     def test_yaml_bad_allocation_1(self, fname=None, fdoc=None):
         """
@@ -503,3 +526,52 @@ class TestNsct(object):
 !allocation domain/ALIAS/not-an-integer
         """
         self._bad_yaml(fname, fdoc, (1, 1), 'expected an allocation scalar, found ')
+
+    @yamlDoc
+    def test_yaml_location(self, fname=None, fdoc=None):
+        """
+a:
+  b:
+    - x
+    - c: 1
+        """
+        f = Fragment(Location(fname), ymlstr=fdoc)
+        _, b = f.getMappingValue('a.b', list, returnValueFragment=True)
+        _, e = b.getElements(['b'])[1]
+        c = e.getItems()[0][1]
+        assert c._location._parent is e._location
+        assert repr(c) == '{}:4:10: [a|b|b[2]|c]'.format(fname)
+        assert repr(e) == '{}:4:7: [a|b|b[2]]'.format(fname)
+        with pytest.raises(DefinitionError, match=r'{}:4:10: \[a\|b\|b\[2\]\|c\] bad'.format(fname)):
+            c.raiseError('bad')
+
+    @yamlDoc
+    def test_yaml_fast_location(self, fname=None, fdoc=None):
+        """
+a:
+  b:
+    - x
+    - c: !mac 00:01:02:03:04:05
+        """
+        f = Fragment(Location(fname), ymlstr=fdoc, fast=True)
+        assert type(f._yml) is dict
+        _, b = f.getMappingValue('a.b', list, returnValueFragment=True)
+        _, e = b.getElements(['b'])[1]
+        c = e.getItems()[0][1]
+        assert str(c.getValue(YAML_mac)) == '00:01:02:03:04:05'
+        with pytest.raises(DefinitionError, match=r'{}:4:10: \[a\|b\|b\[2\]\|c\] bad'.format(fname)):
+            c.raiseError('bad')
+
+    @yamlDoc
+    def test_yaml_bad_hostnames_batched(self, fname=None, fdoc=None):
+        """
+a: !cname a.com
+b: !mx 10/b.com
+c: !cname a.com
+d: !mx 20/not a valid hostname
+e: !cname not a valid host name
+        """
+        # The invalid scalar earliest in the document is reported, whatever its kind
+        self._bad_yaml(fname, fdoc, (4, 4), 'expected a MX scalar, found invalid MX host')
+        with pytest.raises(DefinitionError, match=r'{}:5:4: expected a CNAME scalar'.format(fname)):
+            Fragment(Location(fname), ymlstr=fdoc.replace('not a valid hostname', 'd.com'), fast=True)